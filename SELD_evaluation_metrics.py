@@ -14,8 +14,6 @@
 import numpy as np
 
 eps = np.finfo(float).eps
-from scipy.optimize import linear_sum_assignment
-from IPython import embed
 
 
 class SELDMetricsSegmentLevel(object):
@@ -534,6 +532,7 @@ def least_distance_between_gt_pred(gt_list, pred_list, gt_dist=None, pred_dist=N
             if not ret_3d_dist:
                 dist_mat[ind_pairs[:, 0], ind_pairs[:, 1]] = distances_ang
 
+    from scipy.optimize import linear_sum_assignment  # scipy.optimize is slow to import, only loaded once used
     row_ind, col_ind = linear_sum_assignment(cost_mat)
     cost = dist_mat[row_ind, col_ind]
     return cost, row_ind, col_ind
@@ -28,6 +28,7 @@ from .utils import (
 )
 from .sofa_utils import load_rir_pos, load_pos
 from .spatialize import spatialize
+from .fft_backend import FFTBackend
 
 
 # Sound event classes for DCASE Challenge
@@ -102,6 +103,8 @@ class Scaper:
         ref_db=-60,
         speed_limit=1.5,
         max_sample_attempts=100,
+        fft_backend="scipy",
+        fft_workers=None,
     ):
         """
         Initializes a SpatialScaper object.
@@ -132,6 +135,8 @@ class Scaper:
                 from a starting to an end point. Default is 1.5.
             max_sample_attempts (int): Maximum attempts to place a sound event at a specific point in time
                 without exceeding max_event_overlap, before giving up . Default is 100.
+            fft_backend (str): 'scipy', 'numpy' or 'torch', FFT backend of the spatialization. Default is 'scipy'.
+            fft_workers (int): Threads of every scipy.fft call, -1 for all the cores. Default is None (1 thread).
 
         Attributes:
             fg_events (list): Initialized as an empty list to hold foreground event specifications.
@@ -170,6 +175,8 @@ class Scaper:
 
         self.max_sample_attempts = max_sample_attempts
 
+        self.fft = FFTBackend(fft_backend, fft_workers)
+
     def get_path_to_room_ambient_noise(self):
         path_to_ambient_noise_files = os.path.join(
             #self.rir_dir, __PATH_TO_AMBIENT_NOISE_FILES__
@@ -663,7 +670,9 @@ class Scaper:
             norm_irs = np.transpose(
                 norm_irs, (1, 0, 2)
             )  # (n_irs, n_ch, n_ir_samples) -> (n_ch, n_irs, n_ir_samples)
-            xS = spatialize(x, norm_irs, ir_times, sr=self.sr, snr=event.snr)
+            xS = spatialize(
+                x, norm_irs, ir_times, sr=self.sr, snr=event.snr, fft=self.fft
+            )
 
             # standardize the spatialized audio
             event_scale = db2multiplier(self.ref_db + event.snr, np.mean(np.abs(xS)))
@@ -0,0 +1,39 @@
+import numpy as np
+import scipy.fft
+
+__all__ = ["FFTBackend"]
+
+BACKENDS = ("scipy", "numpy", "torch")
+
+
+class FFTBackend:
+    """rfft and irfft with the signature of scipy.fft, computed by scipy.fft, numpy.fft or torch.fft.
+
+    Arguments:
+        name (str): 'scipy', 'numpy' or 'torch' (imported on first use, torch is not a dependency).
+        workers (int): Threads of each scipy.fft call, -1 for all the cores. Defaults to 1 thread.
+    """
+
+    def __init__(self, name="scipy", workers=None):
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown FFT backend {name}, expected one of {BACKENDS}")
+        self.name = name
+        self.workers = workers
+
+    def _transform(self, fn_name, x, n, axis, norm):
+        if self.name == "scipy":
+            return getattr(scipy.fft, fn_name)(
+                x, n=n, axis=axis, norm=norm, workers=self.workers
+            )
+        if self.name == "numpy":
+            return getattr(np.fft, fn_name)(x, n=n, axis=axis, norm=norm)
+        import torch
+
+        x = torch.from_numpy(np.ascontiguousarray(x))
+        return getattr(torch.fft, fn_name)(x, n=n, dim=axis, norm=norm).numpy()
+
+    def rfft(self, x, n=None, axis=-1, norm=None):
+        return self._transform("rfft", x, n, axis, norm)
+
+    def irfft(self, x, n=None, axis=-1, norm=None):
+        return self._transform("irfft", x, n, axis, norm)
@@ -1,10 +1,13 @@
 import numpy as np
 import scipy.fft
+from .fft_backend import FFTBackend
 
 __all__ = ["spatialize"]
 
 
-def stft(y, fft_size=512, win_size=256, hop_size=128, stft_dims_first=True):
+def stft(
+    y, fft_size=512, win_size=256, hop_size=128, stft_dims_first=True, fft=FFTBackend()
+):
     # Generate the window function
     window = np.sin(np.pi / win_size * np.arange(win_size)) ** 2
 
@@ -24,7 +27,7 @@ def stft(y, fft_size=512, win_size=256, hop_size=128, stft_dims_first=True):
     windows = np.lib.stride_tricks.as_strided(y_padded, shape=shape, strides=strides)
 
     # Apply window function and compute FFT
-    spec = scipy.fft.rfft(windows * window[:, None], fft_size, norm="backward", axis=-2)
+    spec = fft.rfft(windows * window[:, None], fft_size, norm="backward", axis=-2)
 
     # move stft dims to the front (it's what the tv conv expects)
     if stft_dims_first:
@@ -128,13 +131,15 @@ def perform_time_variant_convolution(
 
 
 # @profile
-def istft_overlap_synthesis(spatial_stft, fft_size, win_size, hop_size):
+def istft_overlap_synthesis(
+    spatial_stft, fft_size, win_size, hop_size, fft=FFTBackend()
+):
     """Given an stft, recompose it into audio samples using overlap-add synthesis."""
     n_frames, _, n_ch = spatial_stft.shape
 
     # Inverse FFT
     audio_frames = np.real(
-        scipy.fft.irfft(spatial_stft, n=fft_size, axis=1, norm="forward")
+        fft.irfft(spatial_stft, n=fft_size, axis=1, norm="forward")
     )
 
     # Overlap-add synthesis for all frames
@@ -151,7 +156,7 @@ def apply_snr(x, snr):
 
 
 # @profile
-def spatialize(audio, irs, ir_times, sr, win_size=512, snr=1.0):
+def spatialize(audio, irs, ir_times, sr, win_size=512, snr=1.0, fft=FFTBackend()):
     """Performs time-variant convolution of a signal with multiple impulse responses.
 
     This function convolves an input signal with a series of impulse responses that vary over time.
@@ -167,6 +172,8 @@ def spatialize(audio, irs, ir_times, sr, win_size=512, snr=1.0):
         win_size (int): The window size of the FFT
         snr (float): The signal-to-noise ratio of the audio file. By default, the audio peak is normalized to 1.
             This is equivalent to multiplying the output signal by this number.
+        fft (FFTBackend): Backend and threads of the FFTs (single-IR convolution, STFT and inverse STFT).
+            Defaults to single-threaded scipy.fft.
 
     Returns:
         np.ndarray: The spatialized audio signal with shape (audio samples, channels).
@@ -175,8 +182,13 @@ def spatialize(audio, irs, ir_times, sr, win_size=512, snr=1.0):
 
     # simple cases
     if n_irs == 1:  # single ir
-        spatial_audio = scipy.signal.fftconvolve(
-            audio[:, None], irs[:, 0].T, mode="full", axes=0
+        # full linear convolution, both signals zero-padded to a fast FFT length
+        fft_size = scipy.fft.next_fast_len(len(audio) + n_ir_samples - 1, real=True)
+        spatial_audio = fft.irfft(
+            fft.rfft(audio, fft_size)[:, None]
+            * fft.rfft(irs[:, 0].T, fft_size, axis=0),
+            fft_size,
+            axis=0,
         )[: len(audio), :]
         _assert_shape_match(spatial_audio.shape, (audio.shape[0], n_ch))
         return spatial_audio
@@ -191,8 +203,8 @@ def spatialize(audio, irs, ir_times, sr, win_size=512, snr=1.0):
     # compute spectrograms
     # ir_spec:    (n_frames, n_freq, n_ch, n_irs)
     # audio_spec: (n_frames, n_freq)
-    ir_spec = stft(irs, fft_size, win_size, hop_size)
-    audio_spec = stft(audio, fft_size, win_size, hop_size)
+    ir_spec = stft(irs, fft_size, win_size, hop_size, fft=fft)
+    audio_spec = stft(audio, fft_size, win_size, hop_size, fft=fft)
     _assert_shape_match(ir_spec.shape, (None, win_size + 1, n_ch, n_irs))
     _assert_shape_match(audio_spec.shape, (None, win_size + 1))
 
@@ -211,7 +223,9 @@ def spatialize(audio, irs, ir_times, sr, win_size=512, snr=1.0):
 
     # convolve signal with irs
     spatial_stft = perform_time_variant_convolution(audio_spec, ir_spec, W_ir)
-    spatial_audio = istft_overlap_synthesis(spatial_stft, fft_size, win_size, hop_size)
+    spatial_audio = istft_overlap_synthesis(
+        spatial_stft, fft_size, win_size, hop_size, fft=fft
+    )
     spatial_audio = apply_snr(spatial_audio, snr)
     _assert_shape_match(spatial_audio.shape, (None, n_ch))
     return spatial_audio
@@ -0,0 +1,23 @@
+import numpy as np
+import scipy.signal
+import pytest
+from spatialscaper.fft_backend import FFTBackend
+from spatialscaper.spatialize import spatialize
+
+
+@pytest.mark.parametrize(
+    "fft", [FFTBackend("scipy"), FFTBackend("numpy"), FFTBackend("torch")]
+)
+def test_single_ir_spatialize_backends(fft):
+    rng = np.random.default_rng(0)
+    audio = rng.standard_normal(24000)
+    irs = rng.standard_normal((4, 1, 3000)) * np.exp(-np.arange(3000) / 500)
+    spatial_audio = spatialize(audio, irs, np.zeros(1), 24000, fft=fft)
+    reference = scipy.signal.fftconvolve(
+        audio[:, None], irs[:, 0].T, mode="full", axes=0
+    )[: len(audio)]
+    assert spatial_audio.shape == (len(audio), 4)
+    assert np.allclose(spatial_audio, reference)
+    assert np.allclose(
+        spatial_audio, spatialize(audio, irs, np.zeros(1), 24000, fft=FFTBackend())
+    )
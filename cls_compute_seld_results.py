@@ -3,8 +3,6 @@ import SELD_evaluation_metrics
 import cls_feature_class
 import parameters
 import numpy as np
-from scipy import stats
-from IPython import embed
 
 
 def jackknife_estimation(global_value, partial_estimates, significance_level=0.05):
@@ -38,6 +36,7 @@ def jackknife_estimation(global_value, partial_estimates, significance_level=0.0
     if not (0 < significance_level < 1):
         raise ValueError("confidence level must be in (0, 1).")
 
+    from scipy import stats  # only needed for the jackknife confidence intervals
     t_value = stats.t.ppf(1 - significance_level / 2, n - 1)
 
     # t-test
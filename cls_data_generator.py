@@ -4,8 +4,9 @@
 
 import os
 import numpy as np
+import joblib
 import cls_feature_class
-from IPython import embed
+from feature_extraction_utils import load_features, list_features
 from collections import deque
 import random
 
@@ -22,10 +23,20 @@ class DataGenerator(object):
         self._shuffle = shuffle
         self._feat_cls = cls_feature_class.FeatureClass(params=params, is_eval=self._is_eval)
         self._label_dir = self._feat_cls.get_label_dir()
-        self._feat_dir = self._feat_cls.get_normalized_feat_dir()
+        self._lazy_normalization = params['lazy_normalization']
+        if self._lazy_normalization:
+            # unnormalized features, normalized on load with the weights saved by preprocess_features
+            self._feat_dir = self._feat_cls.get_unnormalized_feat_dir()
+            spec_scaler = joblib.load(self._feat_cls.get_normalized_wts_file())
+            self._feat_mean, self._feat_scale = spec_scaler.mean_, spec_scaler.scale_
+        else:
+            self._feat_dir = self._feat_cls.get_normalized_feat_dir()
         self._multi_accdoa = params['multi_accdoa']
+        # only the feature files of the current feature_storage_format are read
+        self._feat_file_ext = '.{}'.format(params['feature_storage_format'])
 
         self._filenames_list = list()
+        self._feat_files = dict()  # .npy name of every file -> name of its feature file (.npy or .npz)
         self._nb_frames_file = 0     # Using a fixed number of frames in feat files. Updated in _get_label_filenames_sizes()
         self._nb_mel_bins = self._feat_cls.get_nb_mel_bins()
         self._nb_ch = None
@@ -86,12 +97,15 @@ class DataGenerator(object):
     def _get_filenames_list_and_feat_label_sizes(self):
         print('Computing some stats about the dataset')
         max_frames, total_frames, temp_feat = -1, 0, []
-        for filename in os.listdir(self._feat_dir):
+        for feat_filename in list_features(self._feat_dir, self._feat_file_ext):
+            # labels, video features and outputs keep the .npy name, whatever the container of the features
+            filename = '{}.npy'.format(feat_filename.split('.')[0])
+            self._feat_files[filename] = feat_filename
             if self._is_eval:
                 if self._modality == 'audio' or (hasattr(self, '_vid_feat_dir') and os.path.exists(
                         os.path.join(self._vid_feat_dir, filename))):  # some audio files do not have corresponding videos. Ignore them.
                     self._filenames_list.append(filename)
-                    temp_feat = np.load(os.path.join(self._feat_dir, filename))
+                    temp_feat = load_features(os.path.join(self._feat_dir, feat_filename))
                     total_frames += (temp_feat.shape[0] - (temp_feat.shape[0] % self._feature_seq_len))
                     if temp_feat.shape[0] > max_frames:
                         max_frames = temp_feat.shape[0]
@@ -99,7 +113,7 @@ class DataGenerator(object):
                 if int(filename[4]) in self._splits:  # check which split the file belongs to
                     if self._modality == 'audio' or (hasattr(self, '_vid_feat_dir') and os.path.exists(os.path.join(self._vid_feat_dir, filename))):   # some audio files do not have corresponding videos. Ignore them.
                         self._filenames_list.append(filename)
-                        temp_feat = np.load(os.path.join(self._feat_dir, filename))
+                        temp_feat = load_features(os.path.join(self._feat_dir, feat_filename))
                         total_frames += (temp_feat.shape[0] - (temp_feat.shape[0] % self._feature_seq_len))
                         if temp_feat.shape[0]>max_frames:
                             max_frames = temp_feat.shape[0]
@@ -158,7 +172,7 @@ class DataGenerator(object):
                 # load feat and label to circular buffer. Always maintain atleast one batch worth feat and label in the
                 # circular buffer. If not keep refilling it.
                 while (len(self._circ_buf_feat) < self._feature_batch_seq_len or (hasattr(self, '_circ_buf_vid_feat') and hasattr(self, '_vid_feature_batch_seq_len') and len(self._circ_buf_vid_feat) < self._vid_feature_batch_seq_len)):
-                    temp_feat = np.load(os.path.join(self._feat_dir, self._filenames_list[file_cnt]))
+                    temp_feat = self._load_feat(self._filenames_list[file_cnt])
 
                     for row_cnt, row in enumerate(temp_feat):
                         self._circ_buf_feat.append(row)
@@ -210,7 +224,7 @@ class DataGenerator(object):
                 # load feat and label to circular buffer. Always maintain atleast one batch worth feat and label in the
                 # circular buffer. If not keep refilling it.
                 while (len(self._circ_buf_feat) < self._feature_batch_seq_len or (hasattr(self, '_circ_buf_vid_feat') and hasattr(self, '_vid_feature_batch_seq_len') and len(self._circ_buf_vid_feat) < self._vid_feature_batch_seq_len)):
-                    temp_feat = np.load(os.path.join(self._feat_dir, self._filenames_list[file_cnt]))
+                    temp_feat = self._load_feat(self._filenames_list[file_cnt])
                     temp_label = np.load(os.path.join(self._label_dir, self._filenames_list[file_cnt]))
                     if self._modality == 'audio_visual':
                         temp_vid_feat = np.load(os.path.join(self._vid_feat_dir, self._filenames_list[file_cnt]))
@@ -300,6 +314,16 @@ class DataGenerator(object):
                 else:
                     yield feat, label
 
+    def _load_feat(self, filename):
+        feat = load_features(os.path.join(self._feat_dir, self._feat_files[filename]))
+        if self._lazy_normalization:
+            # in place on the freshly loaded array (float16 features upcast to float32), the operations of
+            # StandardScaler.transform, weights cast to the dtype of the features as it does
+            feat = feat.astype(np.promote_types(feat.dtype, np.float32), copy=False)
+            feat -= self._feat_mean.astype(feat.dtype, copy=False)
+            feat /= self._feat_scale.astype(feat.dtype, copy=False)
+        return feat
+
     def _split_in_seqs(self, data, _seq_len): # data - 250*8, 7, 64 - 250
         if len(data.shape) == 1:
             if data.shape[0] % _seq_len:
@@ -1,21 +1,21 @@
 # Contains routines for labels creation, features extraction and normalization
 #
+# librosa, sklearn and the video models are imported where they are used, so that the class imports (e.g. for its
+# paths and label formats) without them.
+#
 
-from cls_vid_features import VideoFeatures
-from PIL import Image
 import os
 import numpy as np
 import scipy.io.wavfile as wav
-from sklearn import preprocessing
 import joblib
-from IPython import embed
-import matplotlib.pyplot as plot
-import librosa
-plot.switch_backend('agg')
 import shutil
 import math
 import wave
 import contextlib
+import stft_engine
+from fft_backend import FFTBackend
+from feature_extraction_utils import run_extraction_jobs, print_throughput, pool_frames, STFTCache, StageProfiler, \
+    write_profile_report, profile_hook, RunningStats, list_features
 # import cv2
 
 
@@ -89,11 +89,52 @@ class FeatureClass:
             self._nb_mel_bins = self._cutoff_bin - self._lower_bin
         else:
             self._nb_mel_bins = params['nb_mel_bins']
-            self._mel_wts = librosa.filters.mel(sr=self._fs, n_fft=self._nfft, n_mels=self._nb_mel_bins).T
+        self._mel_filters = None  # librosa mel filters of _mel_wts
         # Sound event classes dictionary
         self._nb_unique_classes = params['unique_classes']
 
+        # feature extraction worker processes, 1 extracts serially in the calling process
+        self._nb_feature_workers = params['nb_feature_workers']
+
+        # channels of the recordings the features are computed from. The mic GCC features only decode the
+        # mic_channels, FOA (mel spectra of the mic_channels, intensity vectors of the foa_channels) and SALSA-lite
+        # decode all the channels
+        self._mic_channels = params['mic_channels']
+        self._foa_channels = params['foa_channels']
+        self._load_channels = self._mic_channels if self._dataset == 'mic' and not self._use_salsalite else None
+
+        # features computed every feature_pool_frames STFT frames, averaging ('mean') or decimating the spectra
+        self._feature_pool_frames = params['feature_pool_frames']
+        self._feature_pool_mode = params['feature_pool_mode']
+        self._feat_pool_suffix = '' if self._feature_pool_frames == 1 else '_{}{}'.format(self._feature_pool_mode,
+                                                                                          self._feature_pool_frames)
+        if self._feature_pool_frames > 1 and self._feature_pool_mode == 'mean' and (self._dataset == 'foa' or self._use_salsalite):
+            print('ERROR: feature_pool_mode mean is only implemented for the mel and GCC features')
+            exit()
+
+        # if True, preprocess_features stops at the weights, the DataGenerator normalizes the features on load
+        self._lazy_normalization = params['lazy_normalization']
+
+        # complex64 STFTs reused by every feature type and run, see feature_extraction_utils.STFTCache
+        self._stft_cache = None if params['stft_cache_dir'] is None else STFTCache(params['stft_cache_dir'])
+
+        # backend and threads of the FFTs of the STFT and GCC
+        self._fft = FFTBackend(params['fft_backend'], params['fft_workers'])
+
+        # time, memory and I/O of every file and stage written to extraction_profile_dir, and the extraction of
+        # _profiled_file run under cProfile or torch.profiler, see feature_extraction_utils.StageProfiler
+        self._profile_dir = params['extraction_profile_dir']
+        self._profiler_hook = params['extraction_profiler']
+        self._profiled_file = params['extraction_profiler_file']
+        if self._profiler_hook not in (None, 'cprofile', 'torch') or (self._profiler_hook and not self._profile_dir):
+            print('ERROR: extraction_profiler {} needs to be cprofile or torch, with an extraction_profile_dir'.format(
+                self._profiler_hook))
+            exit()
+        self._profiler = StageProfiler(enabled=False)
+
         self._filewise_frames = {}
+        # normalization weights saved from the statistics gathered by extract_all_feature, see _save_scaler_from_stats
+        self._extraction_wts_file = None
 
     def get_frame_stats(self):
 
@@ -115,8 +156,12 @@ class FeatureClass:
         return
 
     def _load_audio(self, audio_path):
-        fs, audio = wav.read(audio_path)
-        audio = audio / 2**15
+        # memory-mapped, only the selected channels are copied out of the file
+        fs, audio = wav.read(audio_path, mmap=True)
+        with self._profiler.stage('load', bytes_read=audio.nbytes):
+            if self._load_channels is not None:
+                audio = audio[:, self._load_channels]
+            audio = audio / 2**15
         return audio, fs
 
     # INPUT FEATURES
@@ -125,24 +170,28 @@ class FeatureClass:
         return 2 ** (x - 1).bit_length()
 
     def _spectrogram(self, audio_input, _nb_frames):
-        _nb_ch = audio_input.shape[1]
-        nb_bins = self._nfft // 2
-        spectra = []
-        for ch_cnt in range(_nb_ch):
-            stft_ch = librosa.core.stft(np.asfortranarray(audio_input[:, ch_cnt]), n_fft=self._nfft, hop_length=self._hop_len,
-                                        win_length=self._win_len, window='hann')
-            spectra.append(stft_ch[:, :_nb_frames])
-        return np.array(spectra).T
-
-
-    def _get_mel_spectrogram(self, linear_spectra):
-        mel_feat = np.zeros((linear_spectra.shape[0], self._nb_mel_bins, linear_spectra.shape[-1]))
+        return stft_engine.multichannel_stft(audio_input, self._nfft, self._hop_len, self._win_len, nb_frames=_nb_frames,
+                                             fft=self._fft)
+
+
+    @property
+    def _mel_wts(self):
+        # built on first use, the class is created (e.g. for its paths) without importing librosa
+        if self._mel_filters is None:
+            import librosa
+            self._mel_filters = librosa.filters.mel(sr=self._fs, n_fft=self._nfft, n_mels=self._nb_mel_bins).T
+        return self._mel_filters
+
+    def _get_mel_spectrogram(self, linear_spectra, nb_pool=1):
+        import librosa
+        nb_frames = linear_spectra.shape[0] // nb_pool
+        mel_feat = np.zeros((nb_frames, self._nb_mel_bins, linear_spectra.shape[-1]))
         for ch_cnt in range(linear_spectra.shape[-1]):
-            mag_spectra = np.abs(linear_spectra[:, :, ch_cnt])**2
+            mag_spectra = pool_frames(np.abs(linear_spectra[:, :, ch_cnt])**2, nb_pool)
             mel_spectra = np.dot(mag_spectra, self._mel_wts)
             log_mel_spectra = librosa.power_to_db(mel_spectra)
             mel_feat[:, :, ch_cnt] = log_mel_spectra
-        mel_feat = mel_feat.transpose((0, 2, 1)).reshape((linear_spectra.shape[0], -1))
+        mel_feat = mel_feat.transpose((0, 2, 1)).reshape((nb_frames, -1))
         return mel_feat
 
     def _get_foa_intensity_vectors(self, linear_spectra):
@@ -158,20 +207,33 @@ class FeatureClass:
             exit()
         return foa_iv
 
-    def _get_gcc(self, linear_spectra):
-        gcc_channels = nCr(linear_spectra.shape[-1], 2)
-        gcc_feat = np.zeros((linear_spectra.shape[0], self._nb_mel_bins, gcc_channels))
-        cnt = 0
-        for m in range(linear_spectra.shape[-1]):
-            for n in range(m+1, linear_spectra.shape[-1]):
-                R = np.conj(linear_spectra[:, :, m]) * linear_spectra[:, :, n]
-                cc = np.fft.irfft(np.exp(1.j*np.angle(R)))
-                cc = np.concatenate((cc[:, -self._nb_mel_bins//2:], cc[:, :self._nb_mel_bins//2]), axis=-1)
-                gcc_feat[:, :, cnt] = cc
-                cnt += 1
-        return gcc_feat.transpose((0, 2, 1)).reshape((linear_spectra.shape[0], -1))
+    def _get_gcc(self, linear_spectra, nb_pool=1):
+        nb_frames = linear_spectra.shape[0] // nb_pool
+        # all the m < n pairs at once, in the order of the former pair loop
+        m, n = np.triu_indices(linear_spectra.shape[-1], k=1)
+        spectra = np.ascontiguousarray(linear_spectra.transpose((0, 2, 1)))  # [nb_frames, nb_channels, nb_bins]
+        # conjugated in place on the gathered pairs, not on a copy of the whole multichannel spectrum
+        R = spectra[:, m]
+        np.conjugate(R, out=R)
+        np.multiply(spectra[:, n], R, out=R)
+        R = pool_frames(R, nb_pool)  # [nb_frames, nb_pairs, nb_bins]
+
+        # PHAT weighting, exp(1j*angle(R)) without the transcendental functions (1 where R is 0, as angle(0) = 0)
+        R_abs = np.abs(R)
+        zero = R_abs == 0
+        R_abs[zero] = 1
+        R /= R_abs
+        R[zero] = 1
+        cc = self._fft.irfft(R, axis=-1)
+
+        # lags -nb_mel_bins//2 to nb_mel_bins//2 - 1, written in the [nb_frames, nb_pairs, nb_mel_bins] feature layout
+        gcc_feat = np.empty((nb_frames, len(m), self._nb_mel_bins))
+        gcc_feat[:, :, :self._nb_mel_bins//2] = cc[:, :, -self._nb_mel_bins//2:]
+        gcc_feat[:, :, self._nb_mel_bins//2:] = cc[:, :, :self._nb_mel_bins//2]
+        return gcc_feat.reshape((nb_frames, -1))
 
     def _get_salsalite(self, linear_spectra):
+        import librosa
         # Adapted from the official SALSA repo- https://github.com/thomeou/SALSA
         # spatial features
         phase_vector = np.angle(linear_spectra[:, :, 1:] * np.conj(linear_spectra[:, :, 0, None]))
@@ -190,14 +252,29 @@ class FeatureClass:
         return np.concatenate((linear_spectra, phase_vector), axis=-1)
 
     def _get_spectrogram_for_file(self, audio_filename):
-        audio_in, fs = self._load_audio(audio_filename)
+        fs, audio = wav.read(audio_filename, mmap=True)
 
-        nb_feat_frames = int(len(audio_in) / float(self._hop_len))
-        nb_label_frames = int(len(audio_in) / float(self._label_hop_len))
+        nb_feat_frames = int(len(audio) / float(self._hop_len))
+        nb_label_frames = int(len(audio) / float(self._label_hop_len))
         self._filewise_frames[os.path.basename(audio_filename).split('.')[0]] = [nb_feat_frames, nb_label_frames]
 
-        audio_spec = self._spectrogram(audio_in, nb_feat_frames)
-        return audio_spec
+        with self._profiler.stage('stft'):
+            if self._stft_cache is None:
+                audio_in, fs = self._load_audio(audio_filename)
+                return self._spectrogram(audio_in, nb_feat_frames)
+            # on a miss as on a hit, the features are computed from the cached complex64 spectra, the key hashes the
+            # whole wav
+            key = self._stft_cache.key(audio_filename, self._nfft, self._hop_len, self._win_len, self._load_channels,
+                                       nb_feat_frames)
+            self._profiler.add('stft', bytes_read=os.path.getsize(audio_filename))
+            audio_spec = self._stft_cache.load(key)
+            if audio_spec is None:
+                audio_in, fs = self._load_audio(audio_filename)
+                audio_spec = self._stft_cache.save(key, self._spectrogram(audio_in, nb_feat_frames))
+                self._profiler.add('stft', bytes_written=audio_spec.nbytes)
+            else:
+                self._profiler.add('stft', bytes_read=audio_spec.nbytes)
+            return audio_spec.astype(np.complex128)
 
     # OUTPUT LABELS
     def get_labels_for_file(self, _desc_file, _nb_label_frames):
@@ -353,46 +430,68 @@ class FeatureClass:
 
     def extract_file_feature(self, _arg_in):
         _file_cnt, _wav_path, _feat_path = _arg_in
+        file_name = os.path.basename(_wav_path).split('.')[0]
+        self._profiler = StageProfiler(file_name, enabled=self._profile_dir is not None,
+                                       record_function=self._profiler_hook == 'torch')
+        hook = contextlib.nullcontext()
+        if self._profiler_hook is not None and file_name == self._profiled_file:
+            hook = profile_hook(self._profiler_hook, os.path.join(self._profile_dir, file_name))
+        with hook:
+            stats = self._extract_file_feature(_file_cnt, _wav_path, _feat_path)
+
+        # frame stats are returned as well, since a worker process only updates its own copy of _filewise_frames,
+        # the normalization statistics of the file, merged with those of the other files by the caller, and the
+        # StageProfiler record of the file (None if not profiled)
+        return file_name, self._filewise_frames[file_name], stats, self._profiler.record()
+
+    def _extract_file_feature(self, _file_cnt, _wav_path, _feat_path):
         spect = self._get_spectrogram_for_file(_wav_path)
         print('STFT shape: {}'.format(spect.shape))
-        spect_mics = np.zeros((spect.shape[0], spect.shape[1], 4), dtype=np.complex128)
-        spect_mics[:, :, 0] = spect[:, :, 14]
-        spect_mics[:, :, 1] = spect[:, :, 15]
-        spect_mics[:, :, 2] = spect[:, :, 16]
-        spect_mics[:, :, 3] = spect[:, :, 17]
+        # decimation drops frames before any feature, averaging pools the mel power and the cross-spectra instead
+        nb_pool = self._feature_pool_frames if self._feature_pool_mode == 'mean' else 1
+        if self._feature_pool_mode == 'decimate':
+            spect = pool_frames(spect, self._feature_pool_frames, 'decimate')
+        # only the mic_channels have been loaded for the mic features
+        spect_mics = spect
+        if self._load_channels is None and self._mic_channels is not None:
+            spect_mics = spect[:, :, self._mic_channels]
 
         # extract mel
         if not self._use_salsalite:
-            mel_spect = self._get_mel_spectrogram(spect_mics)
+            with self._profiler.stage('mel'):
+                mel_spect = self._get_mel_spectrogram(spect_mics, nb_pool)
             print('Mel spectorgram shape: {}'.format(mel_spect.shape))
 
         feat = None
-        if self._dataset == 'foa':
-            # extract intensity vectors
-            foa_iv = self._get_foa_intensity_vectors(spect)
-            feat = np.concatenate((mel_spect, foa_iv), axis=-1)
-        elif self._dataset == 'mic':
-            if self._use_salsalite:
-                feat = self._get_salsalite(spect)
+        # GCC/SALSA-lite or intensity vectors
+        with self._profiler.stage('spatial'):
+            if self._dataset == 'foa':
+                # extract intensity vectors
+                foa_iv = self._get_foa_intensity_vectors(spect[:, :, self._foa_channels])
+                feat = np.concatenate((mel_spect, foa_iv), axis=-1)
+            elif self._dataset == 'mic':
+                if self._use_salsalite:
+                    feat = self._get_salsalite(spect)
+                else:
+                    # extract gcc
+                    gcc = self._get_gcc(spect_mics, nb_pool)
+                    feat = np.concatenate((mel_spect, gcc), axis=-1)
             else:
-                # extract gcc
-                gcc = self._get_gcc(spect_mics)
-                feat = np.concatenate((mel_spect, gcc), axis=-1)
-        else:
-            print('ERROR: Unknown dataset format {}'.format(self._dataset))
-            exit()
+                print('ERROR: Unknown dataset format {}'.format(self._dataset))
+                exit()
 
         if feat is not None:
             print('{}: {}, {}'.format(_file_cnt, os.path.basename(_wav_path), feat.shape))
-            np.save(_feat_path, feat)
+            with self._profiler.stage('save'):
+                np.save(_feat_path, feat)
+            self._profiler.add('save', bytes_written=os.path.getsize(_feat_path))
+            with self._profiler.stage('stats'):
+                return RunningStats().update(feat)
 
     def extract_all_feature(self):
         # setting up folders
         self._feat_dir = self.get_unnormalized_feat_dir()
         create_folder(self._feat_dir)
-        from multiprocessing import Pool
-        import time
-        start_s = time.time()
         # extraction starts
         print('Extracting spectrogram:')
         print('\t\taud_dir {}\n\t\tdesc_dir {}\n\t\tfeat_dir {}'.format(
@@ -404,19 +503,47 @@ class FeatureClass:
                 wav_filename = '{}.wav'.format(file_name.split('.')[0])
                 wav_path = os.path.join(loc_aud_folder, wav_filename)
                 feat_path = os.path.join(self._feat_dir, '{}.npy'.format(wav_filename.split('.')[0]))
-                self.extract_file_feature((file_cnt, wav_path, feat_path))
                 arg_list.append((file_cnt, wav_path, feat_path))
-#        with Pool() as pool:
-#            result = pool.map(self.extract_file_feature, iterable=arg_list)
-#            pool.close()
-#            pool.join()
-        print(time.time()-start_s)
+
+        if self._profile_dir is not None:
+            create_folder(self._profile_dir)
+            if self._profiled_file is None and arg_list:
+                self._profiled_file = os.path.basename(arg_list[0][1]).split('.')[0]
+
+        results, elapsed_s = run_extraction_jobs(self.extract_file_feature, arg_list, self._nb_feature_workers)
+        self._filewise_frames.update((file_name, frames) for file_name, frames, _, _ in results)
+        audio_s = sum(frames[0] for _, frames, _, _ in results) * self._hop_len_s
+        print_throughput(len(results), audio_s, elapsed_s)
+        if self._profile_dir is not None:
+            write_profile_report(self._profile_dir, [profile for _, _, _, profile in results], elapsed_s=elapsed_s,
+                                 audio_s=audio_s, nb_workers=self._nb_feature_workers)
+
+        if not self._is_eval:
+            self._save_scaler_from_stats(results)
+
+    def _save_scaler_from_stats(self, results):
+        '''
+        Merges the normalization statistics of the extracted files into the normalization weights, so that
+        preprocess_features loads them instead of reading all the features again. Nothing is saved if the feature
+        folder holds other files than the extracted ones.
+        '''
+        feat_names = sorted('{}.npy'.format(file_name) for file_name, _, stats, _ in results if stats is not None)
+        if not feat_names or feat_names != list_features(self._feat_dir, '.npy'):
+            print('Feature files not all extracted by this run, weights left to preprocess_features')
+            return
+        spec_stats = RunningStats()
+        for _, _, stats, _ in results:
+            spec_stats.merge(stats)
+        normalized_features_wts_file = self.get_normalized_wts_file()
+        joblib.dump(spec_stats.to_scaler(), normalized_features_wts_file)
+        self._extraction_wts_file = normalized_features_wts_file
+        print('Normalized_features_wts_file: {}. Saved from the extraction statistics.'.format(
+            normalized_features_wts_file))
 
     def preprocess_features(self):
         # Setting up folders and filenames
         self._feat_dir = self.get_unnormalized_feat_dir()
         self._feat_dir_norm = self.get_normalized_feat_dir()
-        create_folder(self._feat_dir_norm)
         normalized_features_wts_file = self.get_normalized_wts_file()
         spec_scaler = None
 
@@ -425,12 +552,18 @@ class FeatureClass:
             spec_scaler = joblib.load(normalized_features_wts_file)
             print('Normalized_features_wts_file: {}. Loaded.'.format(normalized_features_wts_file))
 
+        elif self._extraction_wts_file == normalized_features_wts_file:
+            spec_scaler = joblib.load(normalized_features_wts_file)
+            print('Normalized_features_wts_file: {}. Saved by extract_all_feature, loaded.'.format(
+                normalized_features_wts_file))
+
         else:
             print('Estimating weights for normalizing feature files:')
             print('\t\tfeat_dir: {}'.format(self._feat_dir))
 
+            from sklearn import preprocessing
             spec_scaler = preprocessing.StandardScaler()
-            for file_cnt, file_name in enumerate(os.listdir(self._feat_dir)):
+            for file_cnt, file_name in enumerate(list_features(self._feat_dir, '.npy')):
                 print('{}: {}'.format(file_cnt, file_name))
                 feat_file = np.load(os.path.join(self._feat_dir, file_name))
                 spec_scaler.partial_fit(feat_file)
@@ -441,9 +574,14 @@ class FeatureClass:
             )
             print('Normalized_features_wts_file: {}. Saved.'.format(normalized_features_wts_file))
 
+        if self._lazy_normalization:
+            print('Lazy normalization, the features in {} are normalized on load'.format(self._feat_dir))
+            return
+
+        create_folder(self._feat_dir_norm)
         print('Normalizing feature files:')
         print('\t\tfeat_dir_norm {}'.format(self._feat_dir_norm))
-        for file_cnt, file_name in enumerate(os.listdir(self._feat_dir)):
+        for file_cnt, file_name in enumerate(list_features(self._feat_dir, '.npy')):
             print('{}: {}'.format(file_cnt, file_name))
             feat_file = np.load(os.path.join(self._feat_dir, file_name))
             feat_file = spec_scaler.transform(feat_file)
@@ -481,6 +619,7 @@ class FeatureClass:
     # ------------------------------- EXTRACT VISUAL FEATURES AND PREPROCESS IT -------------------------------
     """"@staticmethod
     def _read_vid_frames(vid_filename):
+        from PIL import Image
         cap = cv2.VideoCapture(vid_filename)
         pil_frames = []
         frame_cnt = 0
@@ -503,6 +642,7 @@ class FeatureClass:
         _file_cnt, _mp4_path, _vid_feat_path = _arg_in
         vid_feat = None
 
+        from cls_vid_features import VideoFeatures
         vid_frames = self._read_vid_frames(_mp4_path)
         pretrained_vid_model = VideoFeatures()
         vid_feat = pretrained_vid_model(vid_frames)
@@ -713,13 +853,13 @@ class FeatureClass:
     def get_normalized_feat_dir(self):
         return os.path.join(
             self._feat_label_dir,
-            '{}_norm'.format('{}_salsa'.format(self._dataset_combination) if (self._dataset=='mic' and self._use_salsalite) else self._dataset_combination)
+            '{}{}_norm'.format('{}_salsa'.format(self._dataset_combination) if (self._dataset=='mic' and self._use_salsalite) else self._dataset_combination, self._feat_pool_suffix)
         )
 
     def get_unnormalized_feat_dir(self):
         return os.path.join(
             self._feat_label_dir,
-            '{}'.format('{}_salsa'.format(self._dataset_combination) if (self._dataset=='mic' and self._use_salsalite) else self._dataset_combination)
+            '{}{}'.format('{}_salsa'.format(self._dataset_combination) if (self._dataset=='mic' and self._use_salsalite) else self._dataset_combination, self._feat_pool_suffix)
         )
 
     def get_label_dir(self):
@@ -734,7 +874,7 @@ class FeatureClass:
     def get_normalized_wts_file(self):
         return os.path.join(
             self._feat_label_dir,
-            '{}_wts'.format(self._dataset)
+            '{}{}_wts'.format(self._dataset, self._feat_pool_suffix)
         )
 
     def get_vid_feat_dir(self):
@@ -0,0 +1,461 @@
+# Helpers shared by the GCC (cls_feature_class) and Mel-FSGCC (pytorch_mel_fsgcc_cls_feature_class) feature classes
+# to run the per-file extraction jobs.
+#
+
+import os
+import re
+import csv
+import sys
+import json
+import time
+import hashlib
+import resource
+import zipfile
+import contextlib
+import numpy as np
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+def run_extraction_jobs(extract_fn, arg_list, nb_workers=1, on_result=None):
+    '''
+    Runs extract_fn on every (file_cnt, wav_path, feat_path) job, in a pool of nb_workers processes if nb_workers > 1.
+
+    Every worker gets cpu_count // nb_workers torch/BLAS threads so that the pool does not oversubscribe the cores.
+
+    :param extract_fn: per-file extraction function, e.g. FeatureClass.extract_file_feature
+    :param arg_list: list of jobs
+    :param nb_workers: number of worker processes
+    :param on_result: optional callback run in the calling process on every result as soon as its job completes
+    :return: list of the extract_fn results (in completion order), elapsed time in seconds
+    '''
+    start_s = time.time()
+    results = []
+    if nb_workers <= 1:
+        for arg_in in arg_list:
+            results.append(extract_fn(arg_in))
+            if on_result is not None:
+                on_result(results[-1])
+        return results, time.time() - start_s
+
+    nb_threads = max(1, (os.cpu_count() or 1) // nb_workers)
+    # spawned workers inherit the environment and apply the caps when they import numpy/torch
+    saved_env = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+    os.environ.update({var: str(nb_threads) for var in THREAD_ENV_VARS})
+    try:
+        # unlike multiprocessing.Pool, the executor raises BrokenProcessPool instead of hanging if a worker dies (OOM)
+        with ProcessPoolExecutor(nb_workers, mp_context=get_context('spawn')) as pool:
+            for future in as_completed([pool.submit(extract_fn, arg_in) for arg_in in arg_list]):
+                results.append(future.result())
+                if on_result is not None:
+                    on_result(results[-1])
+    finally:
+        for var, value in saved_env.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+    return results, time.time() - start_s
+
+
+def print_throughput(nb_files, audio_s, elapsed_s):
+    print('Extracted {} files ({:.1f} s of audio) in {:.1f} s: {:.2f} files/s, {:.1f} audio-s/s'.format(
+        nb_files, audio_s, elapsed_s, nb_files / max(elapsed_s, 1e-9), audio_s / max(elapsed_s, 1e-9)))
+
+
+def peak_rss_mb():
+    ''' Peak resident memory of the calling process so far, in MB '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _read_rss_mb():
+    '''
+    Current and peak (VmHWM) resident memory of the calling process in MB, read from /proc/self/status on Linux,
+    elsewhere both the peak of the process so far
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            status = f.read()
+        return tuple(int(re.search(r'{}:\s+(\d+)'.format(field), status).group(1)) / 1024 for field in ['VmRSS', 'VmHWM'])
+    except (OSError, AttributeError):
+        peak_mb = peak_rss_mb()
+        return peak_mb, peak_mb
+
+
+class StageProfiler:
+    '''
+    Wall time, peak resident memory and bytes read and written of the stages of the extraction of a file.
+
+    Stages are timed with stage(name). A stage entered several times (e.g. once per streaming chunk) accumulates its
+    time and bytes and keeps its highest peak. Nested stages are timed exclusively: the time of a stage does not
+    include the stages entered within it, whose peak memory it does include. A disabled profiler records nothing.
+
+    The peak of the process (VmHWM) is never reset, peak_rss_mb stays the peak of the whole process: it is the peak
+    of a stage when the stage raises it, otherwise the peak of the stage is its resident memory at start or end.
+    '''
+    fields = ('time_s', 'calls', 'peak_rss_mb', 'bytes_read', 'bytes_written')
+
+    def __init__(self, file_name=None, enabled=True, record_function=False):
+        '''
+        :param file_name: name of the profiled file in the record
+        :param enabled: False - stage and add do nothing
+        :param record_function: if True, stages are also labelled in the trace of an active torch.profiler
+        '''
+        self.file_name = file_name
+        self.enabled = enabled
+        self.record_function = record_function
+        self.stages = {}
+        self._open = []  # [time spent in nested stages, peak memory so far] of the stages entered
+        self._start_s = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name, bytes_read=0, bytes_written=0):
+        if not self.enabled:
+            yield
+            return
+        start_rss_mb, start_peak_mb = _read_rss_mb()
+        self._open.append([0., start_rss_mb])
+        start_s = time.perf_counter()
+        try:
+            if self.record_function:
+                import torch
+                with torch.profiler.record_function(name):
+                    yield
+            else:
+                yield
+        finally:
+            elapsed_s = time.perf_counter() - start_s
+            nested_s, peak_mb = self._open.pop()
+            rss_mb, process_peak_mb = _read_rss_mb()
+            # the peak of the process is the peak of the stage only if the stage raised it, otherwise the resident
+            # memory at the start and end of the stage and the peaks of its nested stages bound it from below
+            peak_mb = max(peak_mb, rss_mb, process_peak_mb if process_peak_mb > start_peak_mb else 0.)
+            if self._open:
+                self._open[-1][0] += elapsed_s
+                self._open[-1][1] = max(self._open[-1][1], peak_mb)
+            record = self._record(name)
+            record['time_s'] += elapsed_s - nested_s
+            record['calls'] += 1
+            record['peak_rss_mb'] = max(record['peak_rss_mb'], peak_mb)
+            self.add(name, bytes_read, bytes_written)
+
+    def iterate(self, name, iterable):
+        ''' Yields the items of iterable, profiling the production of every item (e.g. by a generator) as stage name '''
+        iterator, done = iter(iterable), object()
+        while True:
+            with self.stage(name):
+                item = next(iterator, done)
+            if item is done:
+                return
+            yield item
+
+    def add(self, name, bytes_read=0, bytes_written=0):
+        ''' Counts bytes read or written by stage name '''
+        if self.enabled:
+            record = self._record(name)
+            record['bytes_read'] += int(bytes_read)
+            record['bytes_written'] += int(bytes_written)
+
+    def _record(self, name):
+        return self.stages.setdefault(name, dict.fromkeys(self.fields, 0))
+
+    def record(self):
+        ''' :return: JSON serializable record of the file, None if disabled '''
+        if not self.enabled:
+            return None
+        return {'file': self.file_name, 'time_s': time.perf_counter() - self._start_s,
+                'peak_rss_mb': peak_rss_mb(), 'pid': os.getpid(), 'stages': self.stages}
+
+
+def write_profile_report(profile_dir, records, **info):
+    '''
+    Writes the StageProfiler records of the extracted files to profile_dir: extraction_profile.json with the records
+    and the totals of every stage over the files, extraction_profile.csv with a row per file and stage. Prints the
+    totals.
+
+    :param info: JSON serializable information on the run saved with the records, e.g. the elapsed time
+    '''
+    records = [record for record in records if record is not None]
+    totals = {}
+    for record in records:
+        for name, stage in record['stages'].items():
+            total = totals.setdefault(name, dict.fromkeys(StageProfiler.fields, 0))
+            for field in StageProfiler.fields:
+                total[field] = max(total[field], stage[field]) if field == 'peak_rss_mb' else total[field] + stage[field]
+    files_s = sum(record['time_s'] for record in records)
+    totals['other'] = dict.fromkeys(StageProfiler.fields, 0)
+    totals['other']['time_s'] = files_s - sum(total['time_s'] for total in totals.values())
+
+    os.makedirs(profile_dir, exist_ok=True)
+    with open(os.path.join(profile_dir, 'extraction_profile.json'), 'w') as f:
+        json.dump(dict(info, nb_files=len(records), totals=totals, files=records), f, indent=1)
+    with open(os.path.join(profile_dir, 'extraction_profile.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(('file', 'stage') + StageProfiler.fields)
+        for record in records:
+            for name, stage in record['stages'].items():
+                writer.writerow([record['file'], name] + [stage[field] for field in StageProfiler.fields])
+
+    print('Extraction profile of {} files written to {}:'.format(len(records), profile_dir))
+    for name, total in sorted(totals.items(), key=lambda item: -item[1]['time_s']):
+        print('\t{:>8}: {:8.2f} s ({:4.1f}%), peak RSS {:6.0f} MB, read {:8.1f} MB, written {:8.1f} MB'.format(
+            name, total['time_s'], 100 * total['time_s'] / max(files_s, 1e-9), total['peak_rss_mb'],
+            total['bytes_read'] / 2**20, total['bytes_written'] / 2**20))
+
+
+@contextlib.contextmanager
+def profile_hook(profiler, out_prefix):
+    '''
+    Runs the block under cProfile or torch.profiler, saving the profile next to out_prefix and printing its top entries.
+
+    :param profiler: 'cprofile' - out_prefix.prof (snakeviz, pstats), 'torch' - out_prefix.trace.json (chrome://tracing,
+        perfetto), with the CUDA kernels if a GPU is available
+    '''
+    if profiler == 'cprofile':
+        import cProfile
+        import pstats
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            prof.dump_stats('{}.prof'.format(out_prefix))
+            pstats.Stats(prof, stream=sys.stdout).sort_stats('cumulative').print_stats(25)
+    elif profiler == 'torch':
+        import torch
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        with torch.profiler.profile(activities=activities, record_shapes=True) as prof:
+            yield
+        prof.export_chrome_trace('{}.trace.json'.format(out_prefix))
+        print(prof.key_averages().table(sort_by='self_cpu_time_total', row_limit=25))
+    else:
+        raise ValueError('Unknown profiler {}, expected cprofile or torch'.format(profiler))
+
+
+def pool_frames(x, nb_pool, mode='mean'):
+    '''
+    Pools non-overlapping groups of nb_pool frames along the first axis, the trailing incomplete group is dropped.
+
+    :param x: numpy array or torch tensor [nb_frames, ...]
+    :param mode: 'mean' - average of the group, 'decimate' - first frame of the group
+    :return: pooled frames [nb_frames // nb_pool, ...]
+    '''
+    nb_frames = x.shape[0] // nb_pool
+    if nb_pool == 1:
+        return x
+    elif mode == 'decimate':
+        return x[:nb_frames * nb_pool:nb_pool]
+    return x[:nb_frames * nb_pool].reshape((nb_frames, nb_pool) + tuple(x.shape[1:])).mean(axis=1)
+
+
+def save_features(path, feats, chunk_frames=1024):
+    '''
+    Saves the features [nb_frames, nb_features] as .npy or, for a .npz path, as chunks of chunk_frames frames, each
+    compressed with deflate (level 1, fast) as a member chunk_00000, chunk_00001, ... of the archive, so that plain
+    np.load reads the chunks as well. A memory-mapped feats is compressed one chunk at a time.
+    '''
+    if not path.endswith('.npz'):
+        np.save(path, feats)
+        return
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        for chunk_cnt, start in enumerate(range(0, max(len(feats), 1), chunk_frames)):
+            with archive.open('chunk_{:05d}.npy'.format(chunk_cnt), 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, np.ascontiguousarray(feats[start:start + chunk_frames]))
+
+
+def load_features(path):
+    ''' Features saved by save_features, in their saved dtype '''
+    if not path.endswith('.npz'):
+        return np.load(path)
+    with np.load(path) as archive:
+        return np.concatenate([archive[chunk] for chunk in sorted(archive.files)])
+
+
+def list_features(feat_dir, ext):
+    '''
+    Names of the feature files of feat_dir saved as ext ('.npy' or '.npz'), sorted. Files of another
+    feature_storage_format, left by a previous run, are ignored.
+    '''
+    return sorted(file_name for file_name in os.listdir(feat_dir) if file_name.endswith(ext))
+
+
+def params_hash(values):
+    ''' Short hash of the (JSON serializable) parameter values an output depends on '''
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def file_sha1(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def stat_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class ExtractionManifest:
+    '''
+    JSON record of the outputs written by the feature extraction pipeline.
+
+    Every stage ('features', 'scaler', 'norm', 'labels') maps an input key to the signature of the input, the hash of
+    the parameters and the signature of the output written from it, so that a rerun (or a resumed run) only redoes
+    the missing and stale outputs. The file is rewritten after every update.
+    '''
+    def __init__(self, manifest_file, content_hash=False):
+        '''
+        :param manifest_file: JSON file, loaded if it exists
+        :param content_hash: if True, inputs are identified by a hash of their contents instead of size and mtime
+        '''
+        self._manifest_file = manifest_file
+        self._content_hash = content_hash
+        self._entries = {}
+        if os.path.exists(manifest_file):
+            with open(manifest_file, 'r') as f:
+                self._entries = json.load(f)
+
+    def signature(self, path):
+        if not self._content_hash:
+            return stat_signature(path)
+        return {'size': os.path.getsize(path), 'sha1': file_sha1(path)}
+
+    def get(self, stage, key):
+        return self._entries.get(stage, {}).get(key)
+
+    def is_up_to_date(self, stage, key, input_sig, params_hash, output_path):
+        entry = self.get(stage, key)
+        return (entry is not None and entry['input'] == input_sig and entry['params'] == params_hash
+                and os.path.exists(output_path) and entry['output'] == stat_signature(output_path))
+
+    def update(self, stage, key, input_sig, params_hash, output_path, **info):
+        self._entries.setdefault(stage, {})[key] = dict(info, input=input_sig, params=params_hash,
+                                                        output=stat_signature(output_path))
+        self.save()
+
+    def save(self):
+        # written aside and renamed, an interrupted run never leaves a truncated manifest
+        tmp_file = '{}.tmp'.format(self._manifest_file)
+        with open(tmp_file, 'w') as f:
+            json.dump(self._entries, f, indent=1)
+        os.replace(tmp_file, self._manifest_file)
+
+
+class STFTCache:
+    '''
+    Folder of complex64 STFTs, one .npy per recording and set of STFT parameters, shared by all the feature types.
+
+    An entry is keyed by the hash of the audio file contents and of the STFT parameters, so that a renamed or copied
+    recording hits the same entry and an edited one never hits a stale one. Entries are written aside and renamed,
+    concurrent workers never read a truncated one.
+    '''
+    dtype = np.dtype(np.complex64)
+
+    def __init__(self, cache_dir):
+        self._cache_dir = cache_dir
+
+    def key(self, audio_path, nfft, hop_len, win_len, channels, nb_frames, window='hann'):
+        '''
+        :param channels: channels of the recording the STFT is computed from, None - all the channels
+        :param nb_frames: number of STFT frames
+        '''
+        return params_hash([file_sha1(audio_path), nfft, hop_len, win_len, window, channels, nb_frames,
+                            self.dtype.name])
+
+    def path(self, key):
+        return os.path.join(self._cache_dir, 'stft_{}.npy'.format(key))
+
+    def load(self, key, mmap_mode=None):
+        ''' :return: the cached spectra [nb_frames, nfft//2+1, nb_channels], None if not cached '''
+        if not os.path.exists(self.path(key)):
+            return None
+        return np.load(self.path(key), mmap_mode=mmap_mode)
+
+    def save(self, key, spect):
+        ''' Caches spect, :return: the cached (complex64) spectra '''
+        spect = spect.astype(self.dtype, copy=False)
+        os.makedirs(self._cache_dir, exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(self.path(key), os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, spect)
+        os.replace(tmp_path, self.path(key))
+        return spect
+
+    def open(self, key, shape):
+        ''' Memory-mapped entry to fill block by block, cached once commit is called on it '''
+        os.makedirs(self._cache_dir, exist_ok=True)
+        return np.lib.format.open_memmap('{}.{}.tmp'.format(self.path(key), os.getpid()), mode='w+',
+                                         dtype=self.dtype, shape=shape)
+
+    def commit(self, key, spect):
+        spect.flush()
+        os.replace(spect.filename, self.path(key))
+
+
+class RunningStats:
+    '''
+    Per-feature frame count, mean and sum of squared deviations from the mean, the normalization statistics.
+
+    Batches of frames are added with update (Welford) and accumulators with merge (Chan et al. pairwise update), so
+    that the statistics of chunks, files and workers combine into those of all the frames without a second pass.
+    '''
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+
+    def update(self, x):
+        ''' Adds the frames of x [nb_frames, nb_features] '''
+        batch = RunningStats()
+        batch.count = len(x)
+        batch.mean = np.mean(x, axis=0, dtype=np.float64)
+        batch.m2 = np.sum((x - batch.mean) ** 2, axis=0, dtype=np.float64)
+        return self.merge(batch)
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean.copy(), other.m2.copy()
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / count)
+        self.m2 = self.m2 + other.m2 + delta ** 2 * (self.count * other.count / count)
+        self.count = count
+        return self
+
+    @property
+    def var(self):
+        return self.m2 / self.count
+
+    def save(self, path, **info):
+        np.savez(path, count=self.count, mean=self.mean, m2=self.m2, **info)
+
+    @classmethod
+    def load(cls, path):
+        ''' :return: RunningStats, dict of the info saved with them '''
+        stats = cls()
+        with np.load(path) as f:
+            stats.count, stats.mean, stats.m2 = int(f['count']), f['mean'], f['m2']
+            info = {key: f[key] for key in f.files if key not in ('count', 'mean', 'm2')}
+        return stats, info
+
+    def to_scaler(self):
+        ''' sklearn StandardScaler with these statistics, as fitted by partial_fit on the same frames '''
+        from sklearn import preprocessing
+        scaler = preprocessing.StandardScaler()
+        scaler.mean_ = self.mean
+        scaler.var_ = self.var
+        scale = np.sqrt(self.var)
+        scaler.scale_ = np.where(scale == 0, 1., scale)
+        scaler.n_samples_seen_ = self.count
+        scaler.n_features_in_ = len(self.mean)
+        return scaler
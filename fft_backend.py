@@ -0,0 +1,59 @@
+# FFT backend of the feature extraction: the transforms of numpy arrays go through scipy.fft (with its workers
+# threads), numpy.fft or torch.fft, as chosen by the fft_backend and fft_workers parameters. torch tensors always go
+# through torch.fft, on their device. torch is only imported by the 'torch' backend.
+#
+
+import sys
+import numpy as np
+import scipy.fft
+
+BACKENDS = ('scipy', 'numpy', 'torch')
+
+
+def is_tensor(x):
+    ''' True for a torch tensor, without importing torch: if it is not imported, there cannot be tensors '''
+    return 'torch' in sys.modules and sys.modules['torch'].is_tensor(x)
+
+
+class FFTBackend:
+    '''
+    rfft, irfft, fft and ifft with the signature of scipy.fft, dispatched to the chosen backend.
+
+    Plain attributes only, so that the backend of a feature class reaches the spawned extraction workers with it.
+    '''
+    def __init__(self, name='scipy', workers=None):
+        '''
+        :param name: 'scipy', 'numpy' or 'torch'
+        :param workers: threads of each scipy.fft call, -1 - all the cores, None - 1 (numpy has no threads, torch
+            uses torch.get_num_threads)
+        '''
+        if name not in BACKENDS:
+            raise ValueError('Unknown FFT backend {}, expected one of {}'.format(name, BACKENDS))
+        self.name = name
+        self.workers = workers
+
+    def _transform(self, fn_name, x, n, axis, norm):
+        if is_tensor(x):
+            import torch
+            return getattr(torch.fft, fn_name)(x, n=n, dim=axis, norm=norm)
+        if self.name == 'scipy':
+            return getattr(scipy.fft, fn_name)(x, n=n, axis=axis, norm=norm, workers=self.workers)
+        if self.name == 'numpy':
+            return getattr(np.fft, fn_name)(x, n=n, axis=axis, norm=norm)
+        import torch
+        return getattr(torch.fft, fn_name)(torch.from_numpy(np.asarray(x)), n=n, dim=axis, norm=norm).numpy()
+
+    def rfft(self, x, n=None, axis=-1, norm=None):
+        return self._transform('rfft', x, n, axis, norm)
+
+    def irfft(self, x, n=None, axis=-1, norm=None):
+        return self._transform('irfft', x, n, axis, norm)
+
+    def fft(self, x, n=None, axis=-1, norm=None):
+        return self._transform('fft', x, n, axis, norm)
+
+    def ifft(self, x, n=None, axis=-1, norm=None):
+        return self._transform('ifft', x, n, axis, norm)
+
+    def __repr__(self):
+        return 'FFTBackend({!r}, workers={!r})'.format(self.name, self.workers)
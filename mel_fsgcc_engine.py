@@ -0,0 +1,594 @@
+# Batched Mel-FSGCC engine: computes the band-wise GCC-PHAT statistics for every mel band, mic pair and frame
+# with broadcast FFT calls instead of a Python loop over bands.
+#
+# The engine works on onesided spectra [..., nfft//2+1] (the rfft of the real mic signals): band bins beyond the
+# Nyquist frequency are read as the conjugate of their mirror bin instead of materializing the full spectrum.
+#
+
+import os
+import hashlib
+import warnings
+import zipfile
+import numpy as np
+import torch
+
+
+def pair_max_lags(mic_positions, pairs, fs, c=343.):
+    '''
+    Largest lag (in samples) a source can produce on every mic pair, from the distance between the two mics.
+
+    :param mic_positions: [nb_mics, 3] mic coordinates in meters
+    :param pairs: list of (p1, p2) mic index tuples
+    :param c: speed of sound in m/s
+    :return: max lags [nb_pairs] (int)
+    '''
+    mic_positions = np.asarray(mic_positions, dtype=float)
+    dist = [np.linalg.norm(mic_positions[p2] - mic_positions[p1]) for p1, p2 in pairs]
+    return [int(np.ceil(d / c * fs)) for d in dist]
+
+
+def mel_band_limits(fs, nfft, nb_mel_bins):
+    ''' FFT bins delimiting the (overlapping) mel bands, shape [nb_mel_bins+2] '''
+    import librosa  # slow to import, only loaded once the bands are needed
+    mel_bins_edges_hz = librosa.mel_frequencies(n_mels=nb_mel_bins + 2, fmin=0, fmax=fs / 2)
+    return np.round(mel_bins_edges_hz / fs * nfft).astype(int)
+
+
+def complex_dtype(dtype):
+    ''' Complex counterpart of a real torch dtype '''
+    return torch.complex64 if dtype == torch.float32 else torch.complex128
+
+
+def _band_window(BW, win, dtype, device):
+    if win == 'hann':
+        return torch.hann_window(BW, dtype=dtype, device=device)
+    return torch.ones(BW, dtype=dtype, device=device)
+
+
+def mel_band_supports(k_lims, nfft, win='boxcar', dtype=torch.float64, device='cpu'):
+    '''
+    Bins spanned by the frequency window of every mel band, padded to the widest band.
+
+    The window of band k is centred on bin -k_lims[k+1] (the roll applied to the GCC spectrum): rolling the spectrum
+    only modulates the IFFT output, so the band has the same lag-domain magnitude when taken in place.
+
+    :param k_lims: band limits as returned by mel_band_limits
+    :param nfft: FFT size of the (extended) spectrum
+    :param win: 'boxcar' or 'hann'
+    :return: idx [nb_bands, max_bw] spectrum bins, weights [nb_bands, max_bw] window values (0 on the padding),
+             bw [nb_bands] (even band widths in bins)
+    '''
+    nb_bands = len(k_lims) - 2
+    BW = k_lims[2:] - k_lims[:-2] + 1
+    BW = BW + BW % 2
+    max_bw = int(BW.max())
+
+    idx = torch.zeros((nb_bands, max_bw), dtype=torch.int64)
+    weights = torch.zeros((nb_bands, max_bw), dtype=dtype, device=device)
+    for k in range(nb_bands):
+        first = -int(k_lims[k + 1]) - int(BW[k]) // 2
+        idx[k] = torch.remainder(first + torch.arange(max_bw), nfft)
+        weights[k, :BW[k]] = _band_window(int(BW[k]), win, dtype, device)
+    return idx.to(device), weights, torch.tensor(BW, dtype=torch.int64)
+
+
+def mel_band_masks(k_lims, nfft, win='boxcar', dtype=torch.float64, device='cpu'):
+    '''
+    Frequency window of every mel band over the whole spectrum, see mel_band_supports.
+
+    :return: masks [nb_bands, nfft], bw [nb_bands]
+    '''
+    idx, weights, bw = mel_band_supports(k_lims, nfft, win=win, dtype=dtype, device=device)
+    masks = torch.zeros((idx.shape[0], nfft), dtype=dtype, device=device)
+    masks.scatter_add_(1, idx, weights)
+    return masks, bw
+
+
+def onesided_supports(idx, weights, nfft):
+    '''
+    Band supports of mel_band_supports remapped to the onesided spectrum: bin j > nfft/2 of the spectrum of a real
+    signal is the conjugate of bin nfft-j.
+
+    :return: idx [..., width] onesided bins, weights [..., width, 2] window for the real and imaginary parts, the
+             latter negated on the conjugated bins
+    '''
+    conj = idx > nfft // 2
+    sign = 1. - 2. * conj.to(weights.dtype)
+    return torch.where(conj, nfft - idx, idx), torch.stack((weights, weights * sign), dim=-1)
+
+
+def full_spectrum(GCC):
+    ''' Full spectrum [..., nfft] of the onesided spectrum [..., nfft//2+1] of a real signal '''
+    return torch.cat((GCC, torch.conj(torch.flip(GCC[..., 1:-1], dims=(-1,)))), dim=-1)
+
+
+def mel_band_groups(k_lims, nfft, win='boxcar', granularity=8, dtype=torch.float64, device='cpu'):
+    '''
+    Band supports of mel_band_supports grouped by width, each group padded only up to the next multiple of
+    granularity bins instead of up to the widest band.
+
+    :return: groups, list of (bands [n], idx [n, width], weights [n, width]), bw [nb_bands]
+    '''
+    idx, weights, bw = mel_band_supports(k_lims, nfft, win=win, dtype=dtype, device=device)
+    widths = (bw + granularity - 1) // granularity * granularity
+    groups = []
+    for width in torch.unique(widths).tolist():
+        bands = torch.nonzero(widths == width).flatten().to(device)
+        groups.append((bands, idx[bands, :width], weights[bands, :width]))
+    return groups, bw
+
+
+def lag_basis(max_bw, nfft, max_lag, dtype=torch.complex128, device='cpu'):
+    '''
+    Inverse DFT matrix restricted to the first max_bw bins and to the lags in [-max_lag, max_lag].
+
+    :return: basis [max_bw, 2*max_lag+1]
+    '''
+    d = torch.arange(max_bw, dtype=torch.float64)
+    lags = torch.arange(-max_lag, max_lag + 1, dtype=torch.float64)
+    basis = torch.exp(2j * np.pi * d[:, None] * lags[None, :] / nfft) / nfft
+    return basis.to(dtype=dtype, device=device)
+
+
+def fft_lag_response(GCC, masks, max_lag):
+    '''
+    Band lag responses through a full-length IFFT of the masked spectrum, cropped to [-max_lag, max_lag].
+
+    The full spectrum is only rebuilt for the frames passed in (a batch of mel_fsgcc).
+
+    :param GCC: onesided PHAT cross-spectra [..., nfft//2+1]
+    :return: lag responses [..., nb_bands, 2*max_lag+1]
+    '''
+    nfft = masks.shape[-1]
+    aux = torch.fft.ifft(full_spectrum(GCC)[..., None, :] * masks, dim=-1)
+    return torch.cat((aux[..., nfft - max_lag:], aux[..., :max_lag + 1]), dim=-1)
+
+
+def dft_lag_response(GCC, idx, weights, basis):
+    '''
+    Band lag responses evaluated only on the admissible lags, with a DFT over the bins of each band.
+
+    The band content starts at bin idx[k, 0] instead of 0, which only changes the phase of the response.
+
+    :param GCC: onesided PHAT cross-spectra [..., nfft//2+1]
+    :param idx, weights: onesided band supports, see onesided_supports
+    :return: lag responses [..., nb_bands, 2*max_lag+1]
+    '''
+    return torch.view_as_complex(torch.view_as_real(GCC[..., idx]) * weights) @ basis
+
+
+def sparse_lag_response(GCC, groups, basis, nb_bands):
+    '''
+    As dft_lag_response, but every group of bands only gathers (and transforms) its own width of bins.
+
+    :param GCC: onesided PHAT cross-spectra [..., nfft//2+1]
+    :return: lag responses [..., nb_bands, 2*max_lag+1]
+    '''
+    aux = torch.empty(GCC.shape[:-1] + (nb_bands, basis.shape[1]), dtype=basis.dtype, device=GCC.device)
+    for bands, idx, weights in groups:
+        aux[..., bands, :] = dft_lag_response(GCC, idx, weights, basis[:idx.shape[1]])
+    return aux
+
+
+def fsgcc_operator(k_lims, nfft, max_lag, win='boxcar', dtype=torch.float64, device='cpu', sparse=True):
+    '''
+    Band window, IFFT and lag crop of all the bands as one real linear operator, from the interleaved real and
+    imaginary parts of the onesided spectrum to those of the lag responses.
+
+    Only the band supports contribute, so the sparse (CSR) operator holds about 4 * sum(bw) * (2*max_lag+1) values.
+
+    :param sparse: if False, the operator is returned as a dense matrix (for benchmarking, it is ~15x larger)
+    :return: operator [nb_bands*(2*max_lag+1)*2, (nfft//2+1)*2], bw [nb_bands]
+    '''
+    idx, weights, bw = mel_band_supports(k_lims, nfft, win=win, dtype=dtype)
+    basis = lag_basis(idx.shape[1], nfft, max_lag, dtype=complex_dtype(dtype))
+    idx, weights = onesided_supports(idx, weights, nfft)
+    nb_bands, nb_lags = idx.shape[0], basis.shape[1]
+
+    # output row (band, lag, re/im), input column (bin, re/im), one 2x2 real block per band bin and lag
+    lags = torch.arange(nb_lags)
+    indices, values = [], []
+    for k in range(nb_bands):
+        n = int(bw[k])
+        w_re, w_im = weights[k, :n, 0, None], weights[k, :n, 1, None]
+        b_re, b_im = basis.real[:n], basis.imag[:n]
+        out_re = (2 * (k * nb_lags + lags))[None, :].expand(n, nb_lags)
+        in_re = (2 * idx[k, :n])[:, None].expand(n, nb_lags)
+        indices.append(torch.stack((torch.stack((out_re, out_re, out_re + 1, out_re + 1)),
+                                    torch.stack((in_re, in_re + 1, in_re, in_re + 1)))).reshape(2, -1))
+        values.append(torch.stack((w_re * b_re, -w_im * b_im, w_re * b_im, w_im * b_re)).reshape(-1))
+
+    shape = (nb_bands * nb_lags * 2, (nfft // 2 + 1) * 2)
+    operator = torch.sparse_coo_tensor(torch.cat(indices, dim=1), torch.cat(values), shape,
+                                       check_invariants=True).coalesce()
+    if not sparse:
+        return operator.to_dense().to(device), bw
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)  # CSR support is flagged as beta
+        return operator.to_sparse_csr().to(device), bw
+
+
+def operator_lag_response(GCC, operator, nb_bands):
+    '''
+    Band lag responses of all the bands as a single (sparse) matrix product with the fsgcc_operator.
+
+    :param GCC: onesided PHAT cross-spectra [..., nfft//2+1]
+    :return: lag responses [..., nb_bands, 2*max_lag+1]
+    '''
+    x = torch.view_as_real(GCC).reshape(-1, operator.shape[1])
+    aux = (operator @ x.T).T.contiguous()
+    return torch.view_as_complex(aux.reshape(GCC.shape[:-1] + (nb_bands, -1, 2)))
+
+
+def lag_response_tensors(mode, k_lims, nfft, max_lag, win='boxcar', dtype=torch.float64, device='cpu'):
+    '''
+    Precomputed tensors of the band lag responses of the given FSGCC mode, see make_lag_response.
+
+    :return: dict of tensors, always holding the band widths 'bw'
+    '''
+    if mode == 'fft':
+        masks, bw = mel_band_masks(k_lims, nfft, win=win, dtype=dtype, device=device)
+        return dict(masks=masks, bw=bw)
+    elif mode == 'pruned':
+        idx, weights, bw = mel_band_supports(k_lims, nfft, win=win, dtype=dtype, device=device)
+        basis = lag_basis(idx.shape[1], nfft, max_lag, dtype=complex_dtype(dtype), device=device)
+        idx, weights = onesided_supports(idx, weights, nfft)
+        return dict(idx=idx, weights=weights, basis=basis, bw=bw)
+    elif mode == 'sparse':
+        groups, bw = mel_band_groups(k_lims, nfft, win=win, dtype=dtype, device=device)
+        basis = lag_basis(max(g[1].shape[1] for g in groups), nfft, max_lag, dtype=complex_dtype(dtype), device=device)
+        groups = [(bands,) + onesided_supports(idx, weights, nfft) for bands, idx, weights in groups]
+        return dict(groups=groups, basis=basis, bw=bw)
+    elif mode == 'operator':
+        operator, bw = fsgcc_operator(k_lims, nfft, max_lag, win=win, dtype=dtype, device=device)
+        return dict(operator=operator, bw=bw)
+    else:
+        raise ValueError('Unknown FSGCC mode {}'.format(mode))
+
+
+def lag_response_function(mode, tensors, max_lag):
+    ''' Band lag response function of the given FSGCC mode over the tensors of lag_response_tensors '''
+    nb_bands = len(tensors['bw'])
+    if mode == 'fft':
+        return lambda GCC: fft_lag_response(GCC, tensors['masks'], max_lag)
+    elif mode == 'pruned':
+        return lambda GCC: dft_lag_response(GCC, tensors['idx'], tensors['weights'], tensors['basis'])
+    elif mode == 'sparse':
+        return lambda GCC: sparse_lag_response(GCC, tensors['groups'], tensors['basis'], nb_bands)
+    elif mode == 'operator':
+        return lambda GCC: operator_lag_response(GCC, tensors['operator'], nb_bands)
+    else:
+        raise ValueError('Unknown FSGCC mode {}'.format(mode))
+
+
+def make_lag_response(mode, k_lims, nfft, max_lag, win='boxcar', dtype=torch.float64, device='cpu'):
+    '''
+    Band lag response function of the given FSGCC mode, computing in dtype (float32 or float64) precision.
+
+    :param mode: 'fft' (full-length IFFT per band, then lag crop), 'pruned' (DFT on the admissible lags only),
+                 'sparse' (as 'pruned', with bands grouped by width so that narrow bands use narrow DFTs) or
+                 'operator' (all the bands as one sparse matrix product, see fsgcc_operator)
+    :param nfft: FFT size, the lag response function takes onesided spectra [..., nfft//2+1]
+    :return: function mapping PHAT cross-spectra [..., nfft//2+1] to lag responses [..., nb_bands, 2*max_lag+1],
+             bw [nb_bands]
+    '''
+    tensors = lag_response_tensors(mode, k_lims, nfft, max_lag, win=win, dtype=dtype, device=device)
+    return lag_response_function(mode, tensors, max_lag), tensors['bw']
+
+
+class FSGCCPlan:
+    '''
+    Everything Mel-FSGCC precomputes for one configuration: band limits and widths, and the lag response tensors of
+    every lag window. Like an FFT plan, it is built once (see get_plan) and reused for every file.
+    '''
+    def __init__(self, fs, nfft, nb_mel_bins, mode, max_lags, win='boxcar', dtype=torch.float64, device='cpu',
+                 tensors=None, k_lims=None):
+        '''
+        :param max_lags: lag windows the plan serves, e.g. the max lag of every mic pair
+        :param tensors: dict max_lag -> lag_response_tensors, computed if None
+        :param k_lims: band limits of a saved plan, computed by mel_band_limits if None
+        '''
+        self.mode = mode
+        self.k_lims = mel_band_limits(fs, nfft, nb_mel_bins) if k_lims is None else np.asarray(k_lims)
+        if tensors is None:
+            tensors = {max_lag: lag_response_tensors(mode, self.k_lims, nfft, max_lag, win=win, dtype=dtype,
+                                                     device=device) for max_lag in sorted(set(max_lags))}
+        self.tensors = tensors
+        self.lag_responses = {max_lag: lag_response_function(mode, t, max_lag) for max_lag, t in tensors.items()}
+        self.bw = next(iter(tensors.values()))['bw']
+
+
+_plans = {}
+
+
+def get_plan(fs, nfft, nb_mel_bins, mode, max_lags, win='boxcar', dtype=torch.float64, device='cpu', plan_dir=None):
+    '''
+    FSGCCPlan of the configuration, memoized per process and, if plan_dir is given, saved to / loaded from disk.
+
+    :param plan_dir: folder of the saved plans, None keeps them in memory only
+    :return: FSGCCPlan
+    '''
+    key = (fs, nfft, nb_mel_bins, mode, tuple(sorted(set(max_lags))), win, str(dtype), str(device))
+    if key in _plans:
+        return _plans[key]
+
+    saved = {}
+    if plan_dir is not None:
+        plan_file = os.path.join(plan_dir, 'fsgcc_plan_{}.pt'.format(
+            hashlib.sha1(repr(key[:-1]).encode()).hexdigest()[:16]))
+        if os.path.exists(plan_file):
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', UserWarning)  # the operator is re-validated on load
+                saved = torch.load(plan_file, map_location=device)
+            if 'k_lims' not in saved:
+                saved = {}  # plan saved without its band limits, computed and saved again
+    # a saved plan holds the band limits as well, librosa is then not even imported
+    plan = FSGCCPlan(fs, nfft, nb_mel_bins, mode, max_lags, win=win, dtype=dtype, device=device,
+                     tensors=saved.get('tensors'), k_lims=saved.get('k_lims'))
+    if plan_dir is not None and not saved:
+        os.makedirs(plan_dir, exist_ok=True)
+        # written aside and renamed, parallel workers never read a partially written plan
+        tmp_file = '{}.{}.tmp'.format(plan_file, os.getpid())
+        torch.save({'k_lims': [int(k) for k in plan.k_lims],
+                    'tensors': {max_lag: {name: _to_cpu(t) for name, t in tensors.items()}
+                                for max_lag, tensors in plan.tensors.items()}}, tmp_file)
+        os.replace(tmp_file, plan_file)
+    _plans[key] = plan
+    return plan
+
+
+def _to_cpu(tensors):
+    if torch.is_tensor(tensors):
+        return tensors.cpu()
+    return [tuple(t.cpu() for t in group) for group in tensors]  # band groups of the 'sparse' mode
+
+
+def phat_cross_spectra(Xframes, pairs, nb_pool=1):
+    '''
+    PHAT-weighted cross-spectra of all the microphone pairs.
+
+    :param Xframes: onesided spectrum [nb_frames, nfft//2+1, nb_channels]
+    :param pairs: list of (p1, p2) channel index tuples
+    :param nb_pool: cross-spectra averaged over non-overlapping groups of nb_pool frames before the PHAT weighting
+    :return: GCC [nb_pairs, nb_frames // nb_pool, nfft//2+1]
+    '''
+    p1 = [p[0] for p in pairs]
+    p2 = [p[1] for p in pairs]
+    X1 = Xframes[:, :, p1].permute(2, 0, 1)
+    X2 = Xframes[:, :, p2].permute(2, 0, 1)
+    R = X2 * torch.conj(X1)
+    if nb_pool > 1:
+        nb_frames = R.shape[1] // nb_pool
+        R = R[:, :nb_frames * nb_pool].unflatten(1, (nb_frames, nb_pool)).mean(dim=2)
+    return torch.exp(1j * torch.angle(R))
+
+
+def lag_statistics(abs_aux, lags):
+    '''
+    Peak value, peak lag, mean lag and lag spread of the lag responses along the last dimension.
+
+    The mean is taken as a matrix-vector product instead of materializing the normalized lag distribution. The
+    spread uses the centered second moment, E[l^2] - avg^2 cancels for sharp peaks at large lags in float32.
+
+    :param abs_aux: magnitude of the lag responses [..., nb_lags]
+    :param lags: lag of each position of the last dimension [nb_lags]
+    :return: tde, mde, avg, std, each [...]
+    '''
+    mde, max_ind = torch.max(abs_aux, dim=-1)
+    tde = lags[max_ind]
+
+    norm = abs_aux.sum(dim=-1)
+    avg = (abs_aux @ lags) / norm
+    std = torch.sqrt(((lags - avg[..., None]) ** 2 * abs_aux).sum(dim=-1) / norm)
+    return tde, mde, avg, std
+
+
+def mel_fsgcc(GCC, lag_response, bw, max_lag, batch_size=16, lag_store=None, frame_offset=0, pair_ind=None):
+    '''
+    Mel-FSGCC statistics of all bands, pairs and frames.
+
+    Frames are processed in chunks of batch_size, every chunk going through a single lag_response call for all the
+    pairs and bands. The statistics stay on the device of GCC, in the layout of the saved features, so that the
+    caller transfers a single block per file.
+
+    :param GCC: onesided PHAT cross-spectra [nb_pairs, nb_frames, nfft//2+1]
+    :param lag_response: band lag response function from make_lag_response
+    :param bw: band widths [nb_bands] from make_lag_response
+    :param max_lag: maximum lag (in samples) admitted by the array geometry
+    :param lag_store: optional LagResponseStore the magnitude lag responses are written to
+    :param frame_offset: index in lag_store of the first frame of GCC
+    :param pair_ind: indices in lag_store of the pairs of GCC, all the pairs by default
+    :return: stats [nb_frames, 4 (tde, mde, std, avg), nb_pairs, nb_bands]
+    '''
+    nb_pairs, nb_frames = GCC.shape[:2]
+    nb_bands = len(bw)
+    device = GCC.device
+    rdtype = GCC.real.dtype
+
+    lags = torch.arange(-max_lag, max_lag + 1, dtype=rdtype, device=device)
+    inv_bw = 1. / bw.to(device=device, dtype=rdtype)[:, None]  # [nb_bands, 1]
+
+    stats = torch.empty((nb_frames, 4, nb_pairs, nb_bands), dtype=rdtype, device=device)
+
+    for start in range(0, nb_frames, batch_size):
+        end = min(start + batch_size, nb_frames)
+
+        aux = lag_response(GCC[:, start:end])  # [nb_pairs, n_frames, nb_bands, nb_lags]
+        abs_aux = torch.linalg.vector_norm(torch.view_as_real(aux), dim=-1) * inv_bw
+        del aux
+        if lag_store is not None:
+            lag_store.write(frame_offset + start, abs_aux, max_lag, pair_ind)
+
+        tde, mde, avg, std = lag_statistics(abs_aux, lags)  # each [nb_pairs, n_frames, nb_bands]
+        for stat_ind, stat in enumerate((tde, mde, std, avg)):
+            stats[start:end, stat_ind] = stat.transpose(0, 1)
+
+    return stats
+
+
+def mel_fsgcc_pairs(GCC, lag_responses, bw, pair_lags, batch_size=16, lag_store=None, frame_offset=0):
+    '''
+    Mel-FSGCC statistics with a lag window per pair, the pairs sharing a max lag go through mel_fsgcc together.
+
+    :param GCC: onesided PHAT cross-spectra [nb_pairs, nb_frames, nfft//2+1]
+    :param lag_responses: dict max_lag -> band lag response function from make_lag_response
+    :param pair_lags: max lag of every pair [nb_pairs]
+    :param lag_store: optional LagResponseStore of all the pairs, see mel_fsgcc
+    :return: stats [nb_frames, 4 (tde, mde, std, avg), nb_pairs, nb_bands]
+    '''
+    nb_frames = GCC.shape[1]
+    stats = torch.empty((nb_frames, 4, GCC.shape[0], len(bw)), dtype=GCC.real.dtype, device=GCC.device)
+    # with a lag_store, all the pairs of a chunk of frames are computed before the next chunk, so that the store only
+    # buffers about one chunk
+    window = nb_frames if lag_store is None else lag_store.chunk_frames
+    for start in range(0, nb_frames, window):
+        for max_lag, lag_response in lag_responses.items():
+            pair_ind = [p for p, lag in enumerate(pair_lags) if lag == max_lag]
+            stats[start:start + window, :, pair_ind] = mel_fsgcc(
+                GCC[pair_ind, start:start + window], lag_response, bw, max_lag, batch_size=batch_size,
+                lag_store=lag_store, frame_offset=frame_offset + start, pair_ind=pair_ind)
+    return stats
+
+
+class LagResponseStore:
+    '''
+    Magnitude lag responses of a recording, as mel_fsgcc computes its statistics from, kept in float16 so that new
+    statistics can be derived later (see reduce_lag_responses) without computing the Mel-FSGCC again.
+
+    The responses [nb_frames, nb_pairs, nb_bands, 2*max_lag+1] are cropped to the lags -max_lag..max_lag of the
+    widest pair window, the lags beyond the window of a pair are 0. They are buffered until all the pairs of
+    chunk_frames frames are written, and each chunk is then compressed with deflate (level 1) as a member
+    chunk_00000, chunk_00001, ... of a temporary .npz archive, the layout of feature_extraction_utils.save_features.
+    The archive only replaces path once close is called. Used as a context manager, the store is closed on exit,
+    or its temporary file removed if the block raises.
+
+    float16 keeps about 3 significant digits: the peak values and lag moments are kept to ~1e-3, but on the broad
+    peaks of the narrowest bands the peak lag can move by a couple of lags along the peak.
+    '''
+    dtype = np.dtype(np.float16)
+
+    def __init__(self, path, nb_frames, nb_pairs, nb_bands, max_lag, chunk_frames=64):
+        '''
+        :param path: .npz file the responses are saved to
+        :param chunk_frames: frames per compressed chunk, the store buffers about one chunk
+        '''
+        self.path = path
+        self.nb_frames = nb_frames
+        self.max_lag = max_lag
+        self.chunk_frames = chunk_frames
+        self._shape = (nb_pairs, nb_bands, 2 * max_lag + 1)
+        self._tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        self._archive = zipfile.ZipFile(self._tmp_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1)
+        self._nb_chunks = 0
+        # frames from _start_frame written so far, and the pairs written of every one of them
+        self._start_frame = 0
+        self._buffer = np.zeros((0,) + self._shape, dtype=self.dtype)
+        self._written = np.zeros((0, nb_pairs), dtype=bool)
+
+    def write(self, start_frame, abs_aux, max_lag, pair_ind=None):
+        '''
+        :param abs_aux: magnitude lag responses [nb_pairs, n_frames, nb_bands, 2*max_lag+1] of the frames from
+            start_frame, as in mel_fsgcc
+        :param pair_ind: indices of the pairs of abs_aux, all the pairs by default
+        '''
+        if pair_ind is None:
+            pair_ind = slice(None)
+        lags = slice(self.max_lag - max_lag, self.max_lag + max_lag + 1)
+        block = abs_aux.transpose(0, 1).to(device='cpu', dtype=torch.float16).numpy()
+        start, end = start_frame - self._start_frame, start_frame - self._start_frame + block.shape[0]
+        if start < 0:
+            raise ValueError('frames {} to {} already saved'.format(start_frame, self._start_frame))
+        if end > len(self._buffer):
+            nb_new = end - len(self._buffer)
+            self._buffer = np.concatenate((self._buffer, np.zeros((nb_new,) + self._shape, dtype=self.dtype)))
+            self._written = np.concatenate((self._written, np.zeros((nb_new, self._shape[0]), dtype=bool)))
+        self._buffer[start:end, pair_ind, :, lags] = block
+        self._written[start:end, pair_ind] = True
+        self._save_chunks(self.chunk_frames)
+
+    def _save_chunks(self, min_frames):
+        ''' Saves the frames whose pairs are all written, by chunks of chunk_frames and at least min_frames '''
+        nb_complete = int(np.argmin(self._written.all(axis=1))) if not self._written.all() else len(self._written)
+        while nb_complete >= min_frames and nb_complete > 0:
+            nb_saved = min(nb_complete, self.chunk_frames)
+            with self._archive.open('chunk_{:05d}.npy'.format(self._nb_chunks), 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, self._buffer[:nb_saved])
+            self._nb_chunks += 1
+            self._start_frame += nb_saved
+            self._buffer, self._written = self._buffer[nb_saved:].copy(), self._written[nb_saved:]
+            nb_complete -= nb_saved
+
+    def close(self):
+        self._save_chunks(1)
+        self._archive.close()
+        if self._start_frame != self.nb_frames or len(self._buffer):
+            self.discard()
+            raise ValueError('{} of the {} frames of {} written'.format(self._start_frame, self.nb_frames, self.path))
+        os.replace(self._tmp_path, self.path)
+
+    def discard(self):
+        ''' Removes the temporary file, nothing is saved '''
+        self._archive.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.discard()
+        elif os.path.exists(self._tmp_path):
+            self.close()
+
+
+def reduce_lag_responses(path, reduce_fn=lag_statistics, chunk_frames=256, dtype=torch.float32, device='cpu'):
+    '''
+    Statistics of the lag responses saved by a LagResponseStore, computed chunk_frames frames at a time.
+
+    :param reduce_fn: function of the magnitude lag responses [n_frames, nb_pairs, nb_bands, nb_lags] and of the
+        lags [nb_lags], returning a tensor [n_frames, ...] or a tuple of them, e.g. lag_statistics or lag_entropy
+    :return: the reduce_fn outputs of all the frames
+    '''
+    outputs = []
+    with np.load(path) as archive:
+        # one saved chunk decompressed at a time
+        for member in sorted(archive.files):
+            responses = archive[member]
+            max_lag = responses.shape[-1] // 2
+            lags = torch.arange(-max_lag, max_lag + 1, dtype=dtype, device=device)
+            for start in range(0, len(responses), chunk_frames):
+                abs_aux = torch.as_tensor(responses[start:start + chunk_frames], device=device).to(dtype)
+                outputs.append(reduce_fn(abs_aux, lags))
+    if torch.is_tensor(outputs[0]):
+        return torch.cat(outputs)
+    return tuple(torch.cat(output) for output in zip(*outputs))
+
+
+def lag_entropy(abs_aux, lags):
+    ''' Entropy (nats) of the lag responses along the last dimension, taken as lag distributions '''
+    pdf = abs_aux / abs_aux.sum(dim=-1, keepdim=True)
+    return -torch.special.xlogy(pdf, pdf).sum(dim=-1)
+
+
+def lag_response_bytes(mode, k_lims, nfft, max_lag, nb_pairs, dtype=torch.float64):
+    '''
+    Approximate peak memory of the lag response temporaries of one frame in mel_fsgcc, to size its batches.
+
+    :param k_lims: band limits from mel_band_limits
+    :param nb_pairs: number of mic pairs processed together
+    :return: bytes per frame of a batch
+    '''
+    itemsize = torch.finfo(dtype).bits // 8
+    nb_bands = len(k_lims) - 2
+    nb_lags = 2 * max_lag + 1
+    if mode == 'fft':
+        nb_values = 2 * nb_bands * nfft  # masked full spectra and their IFFT
+    elif mode == 'operator':
+        nb_values = nb_bands * nb_lags
+    else:
+        # gathered and weighted band supports, and their DFT
+        max_bw = int(max(k_lims[k + 2] - k_lims[k] for k in range(nb_bands))) + 2
+        nb_values = nb_bands * (2 * max_bw + nb_lags)
+    # complex values, then the magnitudes of the lag responses
+    return nb_pairs * (2 * itemsize * nb_values + itemsize * nb_bands * nb_lags)
@@ -15,7 +15,6 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 plot.switch_backend('agg')
-from IPython import embed
 from cls_compute_seld_results import ComputeSELDResults, reshape_3Dto2D
 from SELD_evaluation_metrics import distance_between_cartesian_coordinates
 import seldnet_model
@@ -44,6 +44,51 @@ def get_params(argv='1'):
         fmax_doa_salsalite=2000,
         fmax_spectra_salsalite=9000,
 
+        mic_channels=[14, 15, 16, 17],  # Channels of the recordings the GCC/Mel-FSGCC features and the FOA mel spectra
+                                        # are computed from, None - all the channels (SALSA-lite uses all the channels)
+        foa_channels=[0, 1, 2, 3],  # W, X, Y, Z channels of the recordings the FOA intensity vectors are computed from
+        mic_positions=None,  # [x, y, z] in m of every mic_channel, sets the Mel-FSGCC lag window of each mic pair,
+                             # e.g. [[2.5, 9, 1.2], [2.5, 10, 1.2], [2.5, 11, 1.2], [2.5, 12, 1.2]] for SpatialScaper/pyroom.py
+                             # None - the fixed round(2*1.5/343*fs) lag window on every pair
+        nb_feature_workers=1,  # Processes extracting features in parallel, 1 - serial extraction in the calling process
+        manifest_content_hash=False,  # Identify up-to-date WAVs by a hash of their contents instead of size/mtime
+        stft_cache_dir=None,  # Folder of complex64 STFTs keyed by WAV contents and STFT parameters, reused when switching
+                              # between the mel/GCC, SALSA-lite and Mel-FSGCC features, None - no cache
+
+        fsgcc_batch_size=4,   # Mel-FSGCC frames processed per IFFT call, bounds the [pairs, frames, bands, nfft] temporaries
+        fsgcc_mode='sparse',  # 'fft' - full-length IFFT per band, 'pruned' - DFT evaluated on the +-max_lag lags only,
+                              # 'sparse' - as 'pruned' with bands grouped by width (narrow bands use narrow DFTs),
+                              # 'operator' - all bands as one precomputed sparse matrix product;
+                              # 12x the per-band loop with 'sparse' and batches of 4 frames, 2-5x with 'fft', see
+                              # tests/misc/profile_fsgcc.py
+        fsgcc_plan_dir=None,  # Folder where the Mel-FSGCC plans (band supports, DFT bases, operators) are saved and
+                              # reloaded across runs, None - plans only memoized within each process
+        lag_response_dir=None,  # Folder where the float16 magnitude lag responses of every file are saved (.npz of
+                                # deflated chunks of frames), new statistics are then derived by
+                                # mel_fsgcc_engine.reduce_lag_responses without recomputing the Mel-FSGCC, None - not saved
+        fft_backend='scipy',  # 'scipy', 'numpy' or 'torch' - FFT of the STFT and GCC (the Mel-FSGCC always uses torch.fft),
+                              # see tests/misc/profile_fft.py to pick the fastest on a machine
+        fft_workers=None,  # Threads of every scipy.fft call, -1 - all the cores, None - 1; with nb_feature_workers > 1
+                           # keep it at most cpu_count // nb_feature_workers
+        feature_dtype='float64',  # 'float64' or 'float32' - precision of the STFT, Mel-FSGCC and saved features
+        feature_pool_frames=1,    # K, features computed every K STFT frames, must divide the frames per label frame
+        feature_pool_mode='mean',  # 'mean' - mel power and cross-spectra averaged over the K frames, 'decimate' - every K-th frame
+        feature_chunk_frames=None,  # STFT frames per chunk of the streaming extractor, the features are written to disk
+                                    # chunk by chunk with constant memory, None - whole recording in memory at once
+        feature_storage_dtype=None,  # 'float16', 'float32' or 'float64' - dtype of the saved features, None - feature_dtype
+        feature_storage_format='npy',  # 'npy' - one array per file, 'npz' - chunks of frames compressed with deflate,
+                                       # only the feature files of this format are read (the GCC features are always .npy)
+        lazy_normalization=False,  # True - only the normalization weights are saved, the DataGenerator normalizes the
+                                   # unnormalized features as it loads them, no normalized copy of the features written
+        feature_mem_budget_mb=None,  # Memory (MB) shared by the nb_feature_workers for their features, sizes the streaming
+                                     # chunks and the Mel-FSGCC batches (capped by feature_chunk_frames and fsgcc_batch_size), None - not used
+        extraction_profile_dir=None,  # Folder where extraction_profile.json/.csv are written, with the time, peak memory and
+                                      # bytes read/written of every file and stage (load, stft, mel, spatial, stats, save),
+                                      # None - not profiled
+        extraction_profiler=None,  # 'cprofile' or 'torch' - the extraction of one file also runs under cProfile or
+                                   # torch.profiler, saved to extraction_profile_dir, None - no profiler
+        extraction_profiler_file=None,  # Name (without extension) of the file run under extraction_profiler, None - the first one
+
 
 
         # MODEL TYPE
@@ -136,6 +181,11 @@ def get_params(argv='1'):
         exit()
 
     feature_label_resolution = int(params['label_hop_len_s'] // params['hop_len_s'])
+    if feature_label_resolution % params['feature_pool_frames']:
+        print('ERROR: feature_pool_frames {} does not divide the {} feature frames per label frame'.format(
+            params['feature_pool_frames'], feature_label_resolution))
+        exit()
+    feature_label_resolution //= params['feature_pool_frames']
     params['feature_sequence_length'] = params['label_sequence_length'] * feature_label_resolution
     params['t_pool_size'] = [feature_label_resolution, 1, 1]  # CNN time pooling
     params['patience'] = int(params['nb_epochs'])  # Stop training if patience is reached
@@ -1,29 +1,27 @@
 # Contains routines for labels creation, features extraction and normalization
 #
+# librosa and sklearn are imported where they are used, so that the class imports (e.g. for its paths and label
+# formats) without them.
+#
 
-from cls_vid_features import VideoFeatures
-from PIL import Image
 import os
 import numpy as np
 import scipy.io.wavfile as wav
-from scipy.signal.windows import hann, boxcar
-from scipy.stats import linregress
-from sklearn import preprocessing
 import joblib
-from IPython import embed
-import matplotlib.pyplot as plot
-import librosa
-plot.switch_backend('agg')
 import shutil
 import math
 import wave
 import contextlib
+import tempfile
 import torch
 import itertools
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1 import make_axes_locatable
-import sys
 import time
+import mel_fsgcc_engine
+import stft_engine
+from fft_backend import FFTBackend
+from feature_extraction_utils import run_extraction_jobs, print_throughput, ExtractionManifest, params_hash, \
+    stat_signature, pool_frames, peak_rss_mb, RunningStats, save_features, load_features, list_features, STFTCache, \
+    StageProfiler, write_profile_report, profile_hook
 # import cv2
 
 
@@ -40,8 +38,8 @@ def enframe_center(x, frame_len, hop_len, NFFT):
   signal_length = len(pad_signal)
   num_frames = int(np.floor(float(np.abs(signal_length - frame_len)) / hop_len))
 
-  indices = np.tile(np.arange(0, frame_len), (num_frames, 1)).T + np.tile(np.arange(0, num_frames * hop_len, hop_len), (frame_len, 1))
-  x_frames = pad_signal[indices.astype(np.int32)] # indices must have int type
+  # strided view of the frames, no index matrix as large as the framed signal
+  x_frames = np.lib.stride_tricks.sliding_window_view(pad_signal, frame_len)[:num_frames * hop_len:hop_len].T
   return x_frames
 
 
@@ -170,10 +168,78 @@ class FeatureClass:
             self._nb_mel_bins = self._cutoff_bin - self._lower_bin
         else:
             self._nb_mel_bins = params['nb_mel_bins']
-            self._mel_wts = librosa.filters.mel(sr=self._fs, n_fft=self._nfft, n_mels=self._nb_mel_bins).T
+        self._mel_filters = None  # librosa mel filters of _mel_wts
+        self._mel_fbank = None  # Mel_filters of _get_mel_spectrogram, built on first use
         # Sound event classes dictionary
         self._nb_unique_classes = params['unique_classes']
 
+        # Mel-FSGCC frames processed per IFFT call, and how band lag responses are computed
+        self._fsgcc_batch_size = params['fsgcc_batch_size']
+        self._fsgcc_mode = params['fsgcc_mode']
+        self._fsgcc_plan_dir = params['fsgcc_plan_dir']
+
+        # recordings read and extracted this many STFT frames at a time, None - whole file at once
+        self._feature_chunk_frames = params['feature_chunk_frames']
+        # if given, chunks and Mel-FSGCC batches are sized to fit the workers in this memory, see _chunk_sizes
+        self._feature_mem_budget_mb = params['feature_mem_budget_mb']
+
+        # float32 halves the memory traffic of the whole pipeline, the model is trained in float32 anyway
+        self._feature_dtype = np.dtype(params['feature_dtype'])
+        self._complex_dtype = np.result_type(self._feature_dtype, np.complex64)
+
+        # feature extraction worker processes, 1 extracts serially in the calling process
+        self._nb_feature_workers = params['nb_feature_workers']
+
+        # channels of the recordings the features are computed from. The mic GCC/Mel-FSGCC features only decode the
+        # mic_channels, FOA (mel spectra of the mic_channels, intensity vectors of the foa_channels) and SALSA-lite
+        # decode all the channels
+        self._mic_channels = params['mic_channels']
+        self._foa_channels = params['foa_channels']
+        self._load_channels = self._mic_channels if self._dataset == 'mic' and not self._use_salsalite else None
+        self._mic_positions = params['mic_positions']
+
+        # features computed every feature_pool_frames STFT frames, averaging ('mean') or decimating the spectra
+        self._feature_pool_frames = params['feature_pool_frames']
+        self._feature_pool_mode = params['feature_pool_mode']
+        self._feat_pool_suffix = '' if self._feature_pool_frames == 1 else '_{}{}'.format(self._feature_pool_mode,
+                                                                                          self._feature_pool_frames)
+        if self._feature_pool_frames > 1 and self._feature_pool_mode == 'mean' and (self._dataset == 'foa' or self._use_salsalite):
+            print('ERROR: feature_pool_mode mean is only implemented for the mel and GCC features')
+            exit()
+
+        # if True, preprocess_features stops at the weights, the DataGenerator normalizes the features on load
+        self._lazy_normalization = params['lazy_normalization']
+
+        # dtype and container of the saved features, see feature_extraction_utils.save_features
+        self._storage_dtype = np.dtype(params['feature_storage_dtype'] or params['feature_dtype'])
+        if params['feature_storage_format'] not in ('npy', 'npz'):
+            print('ERROR: Unknown feature_storage_format {}'.format(params['feature_storage_format']))
+            exit()
+        self._feat_file_ext = '.{}'.format(params['feature_storage_format'])
+
+        # complex64 STFTs reused by every feature type and run, see feature_extraction_utils.STFTCache
+        self._stft_cache = None if params['stft_cache_dir'] is None else STFTCache(params['stft_cache_dir'])
+
+        # float16 Mel-FSGCC lag responses of every file, see mel_fsgcc_engine.LagResponseStore
+        self._lag_response_dir = params['lag_response_dir']
+
+        # backend and threads of the FFTs of numpy arrays, the Mel-FSGCC of torch tensors always uses torch.fft
+        self._fft = FFTBackend(params['fft_backend'], params['fft_workers'])
+
+        # time, memory and I/O of every file and stage written to extraction_profile_dir, and the extraction of
+        # _profiled_file run under cProfile or torch.profiler, see feature_extraction_utils.StageProfiler
+        self._profile_dir = params['extraction_profile_dir']
+        self._profiler_hook = params['extraction_profiler']
+        self._profiled_file = params['extraction_profiler_file']
+        if self._profiler_hook not in (None, 'cprofile', 'torch') or (self._profiler_hook and not self._profile_dir):
+            print('ERROR: extraction_profiler {} needs to be cprofile or torch, with an extraction_profile_dir'.format(
+                self._profiler_hook))
+            exit()
+        self._profiler = StageProfiler(enabled=False)
+
+        # outputs already written for unchanged inputs and parameters are skipped, see get_manifest_file
+        self._manifest_content_hash = params['manifest_content_hash']
+
         self._filewise_frames = {}
 
     def get_frame_stats(self):
@@ -196,9 +262,20 @@ class FeatureClass:
         return
 
     def _load_audio(self, audio_path):
-        fs, audio = wav.read(audio_path)
-        audio = audio / 2**15
-        return audio, fs
+        # memory-mapped, only the selected channels are copied out of the file
+        fs, audio = wav.read(audio_path, mmap=True)
+        return self._audio_samples(audio), fs
+
+    def _load_samples(self, audio):
+        ''' _audio_samples of the memory-mapped wav samples audio, profiled as the load stage '''
+        with self._profiler.stage('load', bytes_read=audio.nbytes):
+            return self._audio_samples(audio)
+
+    def _audio_samples(self, audio):
+        ''' Selected channels of a block of 16-bit wav samples, scaled to the feature dtype '''
+        if self._load_channels is not None:
+            audio = audio[:, self._load_channels]
+        return (audio / 2**15).astype(self._feature_dtype)
 
     # INPUT FEATURES
     @staticmethod
@@ -219,23 +296,19 @@ class FeatureClass:
         spectra = np.moveaxis(np.asarray(spectra), 0, 2)
         _Spectra = []
         for ch_cnt in range(_nb_ch):
-            _Spectra.append(np.fft.fft(spectra[:, :, ch_cnt], self._nfft, axis=0))
+            _Spectra.append(self._fft.fft(spectra[:, :, ch_cnt], self._nfft, axis=0))
         _Spectra = np.moveaxis(np.asarray(_Spectra), 0, 2)
         return _Spectra
 
     def _spectrogram_gcc(self, audio_input, _nb_frames):
-        _nb_ch = audio_input.shape[1]
-        nb_bins = self._nfft // 2
-        spectra = []
-        for ch_cnt in range(_nb_ch):
-            stft_ch = librosa.core.stft(np.asfortranarray(audio_input[:, ch_cnt]), n_fft=self._nfft, hop_length=self._hop_len,
-                                        win_length=self._win_len, window='hann')
-            spectra.append(stft_ch[:, :_nb_frames])
-        return np.array(spectra).T
+        return stft_engine.multichannel_stft(audio_input, self._nfft, self._hop_len, self._win_len, nb_frames=_nb_frames,
+                                             fft=self._fft)
 
 
     def _get_mel_spectrogram(self, linear_spectra):
-        Mel_fbank = Mel_filters(self._nb_mel_bins, 0, self._fs/2, self._fs, self._nfft)
+        if self._mel_fbank is None:
+            self._mel_fbank = Mel_filters(self._nb_mel_bins, 0, self._fs/2, self._fs, self._nfft)
+        Mel_fbank = self._mel_fbank
         Nbins = int(np.floor(self._nfft / 2) + 1)
         powframes = np.abs(linear_spectra[:Nbins, :, :]) ** 2
         Mel_sp = []
@@ -246,14 +319,24 @@ class FeatureClass:
         Mel_sp = np.moveaxis(np.asarray(Mel_sp), 0, 2)
         return Mel_sp
 
-    def _get_mel_spectrogram_gcc(self, linear_spectra):
-        mel_feat = np.zeros((linear_spectra.shape[0], self._nb_mel_bins, linear_spectra.shape[-1]))
+    @property
+    def _mel_wts(self):
+        # built on first use, the class is created (e.g. for its paths) without importing librosa
+        if self._mel_filters is None:
+            import librosa
+            self._mel_filters = librosa.filters.mel(sr=self._fs, n_fft=self._nfft, n_mels=self._nb_mel_bins).T
+        return self._mel_filters
+
+    def _get_mel_spectrogram_gcc(self, linear_spectra, nb_pool=1, top_db=80.0):
+        import librosa
+        nb_frames = linear_spectra.shape[0] // nb_pool
+        mel_feat = np.zeros((nb_frames, self._nb_mel_bins, linear_spectra.shape[-1]), dtype=self._feature_dtype)
         for ch_cnt in range(linear_spectra.shape[-1]):
-            mag_spectra = np.abs(linear_spectra[:, :, ch_cnt])**2
+            mag_spectra = pool_frames(np.abs(linear_spectra[:, :, ch_cnt])**2, nb_pool)
             mel_spectra = np.dot(mag_spectra, self._mel_wts)
-            log_mel_spectra = librosa.power_to_db(mel_spectra)
+            log_mel_spectra = librosa.power_to_db(mel_spectra, top_db=top_db)
             mel_feat[:, :, ch_cnt] = log_mel_spectra
-        mel_feat = mel_feat.transpose((0, 2, 1)).reshape((linear_spectra.shape[0], -1))
+        mel_feat = mel_feat.transpose((0, 2, 1)).reshape((nb_frames, -1))
         return mel_feat
 
     def _get_foa_intensity_vectors(self, linear_spectra):
@@ -277,13 +360,14 @@ class FeatureClass:
         for m in range(linear_spectra.shape[-1]):
             for n in range(m+1, linear_spectra.shape[-1]):
                 R = np.conj(linear_spectra[:, :, m]) * linear_spectra[:, :, n]
-                cc = np.fft.irfft(np.exp(1.j*np.angle(R)))
+                cc = self._fft.irfft(np.exp(1.j*np.angle(R)))
                 cc = np.concatenate((cc[:, -self._nb_mel_bins//2:], cc[:, :self._nb_mel_bins//2]), axis=-1)
                 gcc_feat[:, :, cnt] = cc
                 cnt += 1
         return gcc_feat.transpose((0, 2, 1)).reshape((linear_spectra.shape[0], -1))
 
     def _get_salsalite(self, linear_spectra):
+        import librosa
         # Adapted from the official SALSA repo- https://github.com/thomeou/SALSA
         # spatial features
         phase_vector = np.angle(linear_spectra[:, :, 1:] * np.conj(linear_spectra[:, :, 0, None]))
@@ -301,15 +385,73 @@ class FeatureClass:
 
         return np.concatenate((linear_spectra, phase_vector), axis=-1)
 
-    def _get_spectrogram_for_file(self, audio_filename):
-        audio_in, fs = self._load_audio(audio_filename)
+    def _open_audio(self, audio_filename):
+        '''
+        Memory-mapped samples of a recording, its feature and label frames recorded in _filewise_frames.
 
-        nb_feat_frames = int(len(audio_in) / float(self._hop_len))
-        nb_label_frames = int(len(audio_in) / float(self._label_hop_len))
+        :return: samples [nb_samples, nb_channels], number of STFT frames
+        '''
+        fs, audio = wav.read(audio_filename, mmap=True)
+        nb_feat_frames = int(len(audio) / float(self._hop_len))
+        nb_label_frames = int(len(audio) / float(self._label_hop_len))
+        if nb_feat_frames < self._feature_pool_frames:
+            raise ValueError('{} has {} samples, less than one feature frame'.format(audio_filename, len(audio)))
         self._filewise_frames[os.path.basename(audio_filename).split('.')[0]] = [nb_feat_frames, nb_label_frames]
+        return audio, nb_feat_frames
+
+    def _get_spectrogram_for_file(self, audio_filename):
+        audio, nb_feat_frames = self._open_audio(audio_filename)
+
+        with self._profiler.stage('stft'):
+            if self._stft_cache is None:
+                return self._spectrogram_gcc(self._load_samples(audio), nb_feat_frames)
+            # on a miss as on a hit, the features are computed from the cached complex64 spectra
+            key = self._stft_cache_key(audio_filename, nb_feat_frames)
+            audio_spec = self._stft_cache.load(key)
+            if audio_spec is None:
+                audio_spec = self._stft_cache.save(key, self._spectrogram_gcc(self._load_samples(audio),
+                                                                              nb_feat_frames))
+                self._profiler.add('stft', bytes_written=audio_spec.nbytes)
+            else:
+                self._profiler.add('stft', bytes_read=audio_spec.nbytes)
+            return audio_spec.astype(self._spect_dtype, copy=False)
 
-        audio_spec = self._spectrogram_gcc(audio_in, nb_feat_frames)
-        return audio_spec
+    def _stft_cache_key(self, audio_filename, nb_frames):
+        # the key hashes the whole wav
+        self._profiler.add('stft', bytes_read=os.path.getsize(audio_filename))
+        return self._stft_cache.key(audio_filename, self._nfft, self._hop_len, self._win_len, self._load_channels,
+                                    nb_frames)
+
+    @property
+    def _spect_dtype(self):
+        return np.result_type(self._feature_dtype, np.complex64)
+
+    def _stft_chunks(self, audio_filename, audio, nb_frames, chunk_frames):
+        '''
+        STFT of a recording chunk_frames frames at a time, as stft_engine.stft_blocks, read from the STFT cache if
+        it holds the recording, else computed and written to the cache as it goes.
+
+        :return: generator of (index of the first frame, spectra [chunk_frames, nfft//2+1, nb_channels])
+        '''
+        blocks = stft_engine.stft_blocks(audio, self._nfft, self._hop_len, self._win_len, nb_frames, chunk_frames,
+                                         load=self._load_samples, fft=self._fft)
+        if self._stft_cache is None:
+            yield from blocks
+            return
+        key = self._stft_cache_key(audio_filename, nb_frames)
+        cached = self._stft_cache.load(key, mmap_mode='r')
+        if cached is not None:
+            for start_frame in range(0, nb_frames, chunk_frames):
+                self._profiler.add('stft', bytes_read=cached[start_frame:start_frame + chunk_frames].nbytes)
+                yield start_frame, cached[start_frame:start_frame + chunk_frames].astype(self._spect_dtype)
+            return
+        for start_frame, spect in blocks:
+            if cached is None:
+                cached = self._stft_cache.open(key, (nb_frames,) + spect.shape[1:])
+            cached[start_frame:start_frame + len(spect)] = spect
+            self._profiler.add('stft', bytes_written=cached[start_frame:start_frame + len(spect)].nbytes)
+            yield start_frame, cached[start_frame:start_frame + len(spect)].astype(self._spect_dtype)
+        self._stft_cache.commit(key, cached)
 
     # OUTPUT LABELS
     def get_labels_for_file(self, _desc_file, _nb_label_frames):
@@ -464,189 +606,354 @@ class FeatureClass:
     # ------------------------------- EXTRACT FEATURE AND PREPROCESS IT -------------------------------
 
     def extract_file_feature(self, _arg_in):
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
         _file_cnt, _wav_path, _feat_path = _arg_in
-        spect = self._get_spectrogram_for_file(_wav_path)
-        print('STFT shape: {}'.format(spect.shape))
-
-        spect_mics = np.zeros((spect.shape[0], spect.shape[1], 4), dtype=np.complex128)
-        spect_mics[:, :, 0] = spect[:, :, 14]
-        spect_mics[:, :, 1] = spect[:, :, 15]
-        spect_mics[:, :, 2] = spect[:, :, 16]
-        spect_mics[:, :, 3] = spect[:, :, 17]
-
-        # extract mel
-        if not self._use_salsalite:
-            mel_spect = self._get_mel_spectrogram_gcc(spect_mics)
-            print('Mel spectorgram shape: {}'.format(mel_spect.shape))
-
-        extended_spect = extend_spectrogram(spect_mics)
-        extended_spect = np.transpose(extended_spect, (1, 0, 2))
-        print("Shape estesa:", extended_spect.shape, "dtype:", extended_spect.dtype)
-
-        feats = None
-
-        if self._dataset == 'foa':
-            # extract intensity vectors
-            foa_iv = self._get_foa_intensity_vectors(spect)
-            feats = np.concatenate((mel_spect, foa_iv), axis=-1)
-
-        elif self._dataset == 'mic':
-            if self._use_salsalite:
-                feats = self._get_salsalite(spect)
+        file_name = os.path.basename(_wav_path).split('.')[0]
+        start_time = time.time()
+        self._profiler = StageProfiler(file_name, enabled=self._profile_dir is not None,
+                                       record_function=self._profiler_hook == 'torch')
+        hook = contextlib.nullcontext()
+        if self._profiler_hook is not None and file_name == self._profiled_file:
+            hook = profile_hook(self._profiler_hook, os.path.join(self._profile_dir, file_name))
+        with hook:
+            if self._feature_chunk_frames is None and self._feature_mem_budget_mb is None:
+                spect = self._get_spectrogram_for_file(_wav_path)
+                print('STFT shape: {}'.format(spect.shape))
+                with self._open_lag_store(_wav_path, spect.shape[-1]) as lag_store:
+                    feats = self._get_features(spect, lag_store=lag_store).astype(self._storage_dtype, copy=False)
+                    self._close_lag_store(lag_store)
+                with self._profiler.stage('save'):
+                    save_features(_feat_path, feats)
+                self._profiler.add('save', bytes_written=os.path.getsize(_feat_path))
+                with self._profiler.stage('stats'):
+                    feat_shape, stats = feats.shape, RunningStats().update(feats)
             else:
-                Nframes = extended_spect.shape[1]
-                # lag corresponding to each index of the GCC
-                lags = torch.arange(-(self._nfft / 2), self._nfft / 2, dtype=torch.float64, device=device)
-                # maximum lag expected according to microphone separation
-                max_lag = torch.round(torch.tensor(2 * 1.5 / 343) * self._fs).int()
-                #pairs = list(itertools.combinations(range(self._nb_channels), 2))
-                pairs = [(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)]
-
-                # Precalcolo del filtro Mel per tutte le bande
-                #k_lims = Mel_bins(self._nb_mel_bins, 0, self._fs / 2, self._fs, self._nfft)  # Shape: [nbands+2]
-                mel_bins_edges_hz = librosa.mel_frequencies(n_mels=self._nb_mel_bins + 2, fmin=0, fmax=self._fs / 2)
-
-                k_lims = np.round(mel_bins_edges_hz / self._fs * self._nfft).astype(int)
-                win = 'boxcar'
-
-                maxlag_ind1 = self._nfft // 2 - max_lag
-                maxlag_ind2 = self._nfft // 2 + max_lag
-
-                lagmask = torch.zeros(self._nfft, dtype=torch.float64, device=device)
-                lagmask[maxlag_ind1:maxlag_ind2 + 1] = 1
+                feat_shape, stats = self._stream_file_feature(_wav_path, _feat_path)
+        print(f'Time: {time.time() - start_time:.2f} s, peak RSS {peak_rss_mb():.0f} MB')
+        print('{}: {}, {}'.format(_file_cnt, os.path.basename(_wav_path), feat_shape))
 
-                start_time = time.time()
-                Xframes = torch.tensor(extended_spect, device=device)
+        # frame stats are returned as well, since a worker process only updates its own copy of _filewise_frames,
+        # the normalization statistics of the file, merged with those of the other files by the caller, and the
+        # StageProfiler record of the file (None if not profiled)
+        return file_name, self._filewise_frames[file_name], stats, self._profiler.record()
 
-                Meltde = torch.zeros((self._nb_mel_bins, Nframes, len(pairs)), dtype=torch.float64, device='cpu')
-                Melmde = torch.zeros((self._nb_mel_bins, Nframes, len(pairs)), dtype=torch.float64, device='cpu')
-                Melstd = torch.zeros((self._nb_mel_bins, Nframes, len(pairs)), dtype=torch.float64, device='cpu')
-                Melavg = torch.zeros((self._nb_mel_bins, Nframes, len(pairs)), dtype=torch.float64, device='cpu')
-                #MelGCClag = torch.zeros((self._nb_mel_bins, Nframes, len(pairs), maxlag_ind2 - maxlag_ind1 + 1), dtype=torch.complex64, device='cpu')
-                # print(torch.cuda.memory_summary())
-                batch_size = 100
-
-
-                for idx, (p1, p2) in enumerate(pairs):
-                    X1 = Xframes[:, :, p1]
-                    X2 = Xframes[:, :, p2]
-
-                    GCC = torch.exp(1j * torch.angle(X2 * torch.conj(X1)))
-
-                    # Elaborazione in batch
-                    for start in range(0, Nframes, batch_size):
-                        end = min(start + batch_size, Nframes)
-
-                        # Calcolo temporaneo su GPU
-                        batch_GCCm = torch.zeros((self._nb_mel_bins, end - start, self._nfft), dtype=torch.complex128, device=device)
-
-                        for k in range(self._nb_mel_bins):
-                            BW = k_lims[k + 2] - k_lims[k] + 1
-                            BW = BW + BW % 2
-
-                            if win == 'hann':
-                                wind = torch.hann_window(BW, device=device)
-                            else:
-                                wind = torch.ones(BW, dtype=torch.float64, device=device)
-
-                            windmask = torch.zeros(self._nfft, dtype=torch.complex128, device=device)
-                            windmask[:BW // 2] = wind[BW // 2:]
-                            windmask[-BW // 2:] = wind[:BW // 2]
-
-                            GCCd = torch.roll(GCC[:, start:end], shifts=k_lims[k + 1].item(), dims=0)
-                            GCCd = GCCd * windmask[:, None]
-                            aux = (1 / BW) * torch.fft.fftshift(torch.fft.ifft(GCCd, dim=0), dim=0) * lagmask[:, None]
+    def _stream_file_feature(self, audio_path, feat_path):
+        '''
+        Extracts the features of a recording feature_chunk_frames STFT frames at a time, writing every chunk into a
+        .npy file as soon as it is computed, so that the memory does not grow with the length of the recording.
 
-                            batch_GCCm[k, :, :] = aux.T  # Trasposta per ottenere [n_frames, Nfft] per ogni banda
-                            abs_aux = torch.abs(aux)
+        The log-mel spectra are clipped to the top_db range of their maximum over the whole file, as in the whole-file
+        extraction, by a last pass over the written file, which also accumulates the normalization statistics. For the
+        npz storage format, the .npy file is a temporary file in the parent folder of the feature folder, compressed
+        chunk by chunk into feat_path and removed.
 
-                            max_ind = torch.argmax(abs_aux, dim=0)  # Su Nfft, shape: (n_frames,)
-                            Melmde[k, start:end, idx] = abs_aux[max_ind, torch.arange(end - start)].to('cpu')
-                            Meltde[k, start:end, idx] = lags[max_ind].to('cpu')
+        :return: shape of the features, RunningStats of the features
+        '''
+        audio, nb_feat_frames = self._open_audio(audio_path)
+        nb_pool = self._feature_pool_frames
+        nb_channels = audio.shape[1] if self._load_channels is None else len(self._load_channels)
+        nb_mel_channels = nb_channels if self._mic_channels is None else len(self._mic_channels)
+        chunk_frames, fsgcc_batch_size = self._chunk_sizes(nb_channels)
+        print('Chunks of {} frames, Mel-FSGCC batches of {} frames'.format(chunk_frames, fsgcc_batch_size))
+        npy_path = feat_path
+        if not feat_path.endswith('.npy'):
+            # next to the feature folder rather than in it, where a file left by an interrupted run would be taken
+            # for the features of a recording
+            fd, npy_path = tempfile.mkstemp(suffix='.npy', prefix='{}.'.format(os.path.basename(feat_path)),
+                                            dir=os.path.dirname(os.path.dirname(os.path.abspath(feat_path))))
+            os.close(fd)
+        feats, mel_max = None, None
+        with self._open_lag_store(audio_path, nb_channels) as lag_store:
+            stft_chunks = self._stft_chunks(audio_path, audio, nb_feat_frames, chunk_frames)
+            for start_frame, spect in self._profiler.iterate('stft', stft_chunks):
+                chunk_feats = self._get_features(spect, top_db=None, fsgcc_batch_size=fsgcc_batch_size,
+                                                 lag_store=lag_store, start_frame=start_frame)
+                with self._profiler.stage('save', bytes_written=chunk_feats.nbytes):
+                    if feats is None:
+                        feats = np.lib.format.open_memmap(npy_path, mode='w+', dtype=self._storage_dtype,
+                                                          shape=(nb_feat_frames // nb_pool, chunk_feats.shape[1]))
+                    feats[start_frame // nb_pool:start_frame // nb_pool + len(chunk_feats)] = chunk_feats
+                if not self._use_salsalite:
+                    chunk_max = chunk_feats[:, :nb_mel_channels * self._nb_mel_bins].reshape(
+                        len(chunk_feats), nb_mel_channels, self._nb_mel_bins).max(axis=(0, 2))
+                    mel_max = chunk_max if mel_max is None else np.maximum(mel_max, chunk_max)
+            self._close_lag_store(lag_store)
+
+        stats = RunningStats()
+        with self._profiler.stage('stats', bytes_read=feats.nbytes):
+            for start in range(0, len(feats), chunk_frames):
+                chunk_feats = feats[start:start + chunk_frames]
+                if mel_max is not None:
+                    nb_mel_feats = len(mel_max) * self._nb_mel_bins
+                    chunk_feats[:, :nb_mel_feats] = np.maximum(chunk_feats[:, :nb_mel_feats],
+                                                               np.repeat(mel_max - 80.0, self._nb_mel_bins))
+                stats.update(chunk_feats)
+        with self._profiler.stage('save'):
+            feats.flush()
+            feat_shape = feats.shape
+            if npy_path != feat_path:
+                save_features(feat_path, feats)
+                del feats
+                os.remove(npy_path)
+                self._profiler.add('save', bytes_written=os.path.getsize(feat_path))
+        return feat_shape, stats
+
+    def _chunk_sizes(self, nb_channels):
+        '''
+        Frames per streaming chunk and per Mel-FSGCC batch, sized so that every worker fits in its share of
+        feature_mem_budget_mb (not counting the interpreter and the libraries).
 
-                            auxpdf = abs_aux / abs_aux.sum(dim=0, keepdim=True)
-                            Melavg[k, start:end, idx] = (lags[:, None] * auxpdf).sum(dim=0).to('cpu')
-                            Melstd[k, start:end, idx] = torch.sqrt(((lags[:, None] - Melavg[k, start:end, idx].to(device)) ** 2 * auxpdf).sum(dim=0)).to('cpu')
+        The batch temporaries get at most a quarter of the share, fsgcc_batch_size staying the upper bound. The rest
+        goes to the chunk: audio, STFT frames and spectra, cross-spectra and features, all proportional to its length.
 
+        :return: chunk_frames (a multiple of feature_pool_frames), fsgcc_batch_size
+        '''
+        nb_pool = self._feature_pool_frames
+        chunk_frames, fsgcc_batch_size = self._feature_chunk_frames, self._fsgcc_batch_size
+        if self._feature_mem_budget_mb is not None:
+            worker_bytes = self._feature_mem_budget_mb * 2**20 / max(1, self._nb_feature_workers)
+            itemsize = self._feature_dtype.itemsize
+            nb_bins = self._nfft // 2 + 1
+            nb_pairs = nb_channels * (nb_channels - 1) // 2
+            batch_frame_bytes = 0
+            if self._dataset == 'mic' and not self._use_salsalite:
+                k_lims = mel_fsgcc_engine.mel_band_limits(self._fs, self._nfft, self._nb_mel_bins)
+                max_lag = max(self._pair_lags(list(itertools.combinations(range(nb_channels), 2))))
+                batch_frame_bytes = mel_fsgcc_engine.lag_response_bytes(
+                    self._fsgcc_mode, k_lims, self._nfft, max_lag, nb_pairs,
+                    dtype=getattr(torch, self._feature_dtype.name))
+                fsgcc_batch_size = max(1, min(fsgcc_batch_size, int(worker_bytes / 4 // batch_frame_bytes)))
+            # audio and windowed frames, spectra and their copies, cross-spectra and PHAT temporaries, features
+            chunk_frame_bytes = itemsize * (nb_channels * (self._hop_len + self._nfft) + 4 * nb_channels * nb_bins
+                                            + 10 * nb_pairs * nb_bins
+                                            + 3 * self._nb_mel_bins * (nb_channels + 4 * nb_pairs))
+            budget_frames = int((worker_bytes - fsgcc_batch_size * batch_frame_bytes) // chunk_frame_bytes)
+            chunk_frames = budget_frames if chunk_frames is None else min(chunk_frames, budget_frames)
+        # chunks made of whole pooling groups, pooled as in the whole file
+        return max(nb_pool, chunk_frames // nb_pool * nb_pool), fsgcc_batch_size
+
+    def _open_lag_store(self, audio_path, nb_channels):
+        '''
+        LagResponseStore of the recording in lag_response_dir, to be used as a context manager, which removes its
+        temporary file if the extraction raises; a context of None if not stored
+        '''
+        if self._lag_response_dir is None or self._dataset != 'mic' or self._use_salsalite:
+            return contextlib.nullcontext()
+        file_name = os.path.basename(audio_path).split('.')[0]
+        pairs = list(itertools.combinations(range(nb_channels), 2))
+        return mel_fsgcc_engine.LagResponseStore(os.path.join(self._lag_response_dir, '{}.npz'.format(file_name)),
+                                                 self._filewise_frames[file_name][0] // self._feature_pool_frames,
+                                                 len(pairs), self._nb_mel_bins, max(self._pair_lags(pairs)))
+
+    def _close_lag_store(self, lag_store):
+        if lag_store is not None:
+            with self._profiler.stage('save'):
+                lag_store.close()
+            self._profiler.add('save', bytes_written=os.path.getsize(lag_store.path))
+
+    def _pair_lags(self, pairs):
+        # maximum lag expected according to microphone separation, fixed window without mic positions
+        if self._mic_positions is None:
+            return [int(round(2 * 1.5 / 343 * self._fs))] * len(pairs)
+        return mel_fsgcc_engine.pair_max_lags(self._mic_positions, pairs, self._fs)
+
+    def _get_features(self, spect, top_db=80.0, fsgcc_batch_size=None, lag_store=None, start_frame=0):
+        '''
+        Features of a block of STFT frames, the feature_pool_frames pooling groups start at its first frame.
+
+        :param spect: spectra [nb_frames, nfft//2+1, nb_channels]
+        :param top_db: dynamic range of the log-mel spectra below their maximum, None - not clipped
+        :param fsgcc_batch_size: Mel-FSGCC frames per batch, fsgcc_batch_size of the parameters by default
+        :param lag_store: optional LagResponseStore of the recording the Mel-FSGCC lag responses are written to
+        :param start_frame: index in the recording of the first STFT frame of spect
+        :return: feats [nb_frames // feature_pool_frames, nb_features]
+        '''
+        if fsgcc_batch_size is None:
+            fsgcc_batch_size = self._fsgcc_batch_size
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-                        #MelGCClag[:, start:end, idx, :] = batch_GCCm[:, :, maxlag_ind1:maxlag_ind2 + 1].to('cpu')
+        # decimation drops frames before any feature, averaging pools the mel power and the cross-spectra instead
+        nb_pool = self._feature_pool_frames if self._feature_pool_mode == 'mean' else 1
+        if self._feature_pool_mode == 'decimate':
+            spect = pool_frames(spect, self._feature_pool_frames, 'decimate')
+        # only the mic_channels have been loaded for the mic features
+        spect_mics = spect
+        if self._load_channels is None and self._mic_channels is not None:
+            spect_mics = spect[:, :, self._mic_channels]
 
-                print(f'Time: {time.time() - start_time:.2f} s')
+        # extract mel
+        if not self._use_salsalite:
+            with self._profiler.stage('mel'):
+                mel_spect = self._get_mel_spectrogram_gcc(spect_mics, nb_pool, top_db=top_db)
+            print('Mel spectorgram shape: {}'.format(mel_spect.shape))
 
-                Meltde = Meltde / max_lag
-                Melmde = Melmde / (0.5 * (1 / self._nfft))
-                Melstd = Melstd / max_lag
-                Melavg = Melavg / (0.5 * max_lag)
+        feats = None
 
-                Meltde = Meltde.permute(1, 2, 0).reshape(Nframes, -1)
-                Melmde = Melmde.permute(1, 2, 0).reshape(Nframes, -1)
-                Melstd = Melstd.permute(1, 2, 0).reshape(Nframes, -1)
-                Melavg = Melavg.permute(1, 2, 0).reshape(Nframes, -1)
+        # GCC/SALSA-lite/Mel-FSGCC or intensity vectors
+        with self._profiler.stage('spatial'):
+            if self._dataset == 'foa':
+                # extract intensity vectors
+                foa_iv = self._get_foa_intensity_vectors(spect[:, :, self._foa_channels])
+                feats = np.concatenate((mel_spect, foa_iv), axis=-1)
 
-                feats = torch.cat((Meltde, Melmde, Melstd, Melavg), dim=-1)
-                feats = feats.numpy()
-                feats = np.concatenate((mel_spect, feats), axis=-1)
+            elif self._dataset == 'mic':
+                if self._use_salsalite:
+                    feats = self._get_salsalite(spect)
+                else:
+                    Nframes = spect_mics.shape[0] // nb_pool
+                    pairs = list(itertools.combinations(range(spect_mics.shape[-1]), 2))
+                    pair_lags = self._pair_lags(pairs)
+
+                    # Precalcolo del filtro Mel per tutte le bande, una volta per processo
+                    plan = mel_fsgcc_engine.get_plan(self._fs, self._nfft, self._nb_mel_bins, self._fsgcc_mode,
+                                                     pair_lags, win='boxcar',
+                                                     dtype=getattr(torch, self._feature_dtype.name), device=device,
+                                                     plan_dir=self._fsgcc_plan_dir)
+
+                    # the engine takes the onesided spectrum, the negative frequencies are never materialized, and
+                    # shares its memory on the cpu
+                    Xframes = torch.as_tensor(spect_mics, device=device)
+                    GCC = mel_fsgcc_engine.phat_cross_spectra(Xframes, pairs, nb_pool=nb_pool)
+                    del Xframes
+
+                    stats = mel_fsgcc_engine.mel_fsgcc_pairs(GCC, plan.lag_responses, plan.bw, pair_lags,
+                                                             batch_size=fsgcc_batch_size, lag_store=lag_store,
+                                                             frame_offset=start_frame // self._feature_pool_frames)
+                    del GCC
+
+                    # tde, mde, std, avg normalization by the lag window of each pair, applied in place on the device
+                    # before the single transfer
+                    max_lags = torch.tensor(pair_lags, dtype=stats.dtype, device=device)
+                    stats /= torch.stack((max_lags, torch.full_like(max_lags, 0.5 * (1 / self._nfft)), max_lags,
+                                          0.5 * max_lags))[:, :, None]
+                    feats = stats.reshape(Nframes, -1).cpu().numpy()
+                    feats = np.concatenate((mel_spect, feats), axis=-1)
 
-        else:
-            print('ERROR: Unknown dataset format {}'.format(self._dataset))
-            exit()
+            else:
+                print('ERROR: Unknown dataset format {}'.format(self._dataset))
+                exit()
 
-        if feats is not None:
-            print('{}: {}, {}'.format(_file_cnt, os.path.basename(_wav_path), feats.shape))
-            np.save(_feat_path, feats)
+        return feats
 
 
     def extract_all_feature(self):
         # setting up folders
         self._feat_dir = self.get_unnormalized_feat_dir()
         create_folder(self._feat_dir)
-        from multiprocessing import Pool
-        import time
-        start_s = time.time()
         # extraction starts
         print('Extracting spectrogram:')
         print('\t\taud_dir {}\n\t\tdesc_dir {}\n\t\tfeat_dir {}'.format(
             self._aud_dir, self._desc_dir, self._feat_dir))
-        #arg_list = []
+        manifest = ExtractionManifest(self.get_manifest_file(), content_hash=self._manifest_content_hash)
+        feat_hash = self._feature_params_hash()
+        arg_list, jobs = [], {}
         for sub_folder in os.listdir(self._aud_dir):
             loc_aud_folder = os.path.join(self._aud_dir, sub_folder)
             for file_cnt, file_name in enumerate(os.listdir(loc_aud_folder)):
                 wav_filename = '{}.wav'.format(file_name.split('.')[0])
                 wav_path = os.path.join(loc_aud_folder, wav_filename)
-                feat_path = os.path.join(self._feat_dir, '{}.npy'.format(wav_filename.split('.')[0]))
-                #if not os.path.exists(feat_path):
-                print("Processed file: {}".format(wav_path))
-                self.extract_file_feature((file_cnt, wav_path, feat_path))
-                #arg_list.append((file_cnt, wav_path, feat_path_tde))
-#        with Pool() as pool:
-#            result = pool.map(self.extract_file_feature, iterable=arg_list)
-#            pool.close()
-#            pool.join()
-        print(time.time()-start_s)
+                feat_path = os.path.join(self._feat_dir, '{}{}'.format(wav_filename.split('.')[0], self._feat_file_ext))
+                wav_sig = manifest.signature(wav_path)
+                if manifest.is_up_to_date('features', wav_path, wav_sig, feat_hash, feat_path):
+                    self._filewise_frames[wav_filename.split('.')[0]] = manifest.get('features', wav_path)['frames']
+                    continue
+                arg_list.append((file_cnt, wav_path, feat_path))
+                jobs[wav_filename.split('.')[0]] = (wav_path, wav_sig, feat_path)
+        print('{} files up to date, extracting {}'.format(len(self._filewise_frames), len(arg_list)))
+
+        stats_dir = self.get_feature_stats_dir()
+        create_folder(stats_dir)
+        if self._lag_response_dir is not None:
+            create_folder(self._lag_response_dir)
+        if self._profile_dir is not None:
+            create_folder(self._profile_dir)
+            if self._profiled_file is None and arg_list:
+                self._profiled_file = os.path.basename(arg_list[0][1]).split('.')[0]
+
+        def record_file(result):
+            # recorded as soon as the file is written, an interrupted run resumes from the files that are missing
+            file_name, frames, stats, _ = result
+            wav_path, wav_sig, feat_path = jobs[file_name]
+            feat_sig = stat_signature(feat_path)
+            stats.save(os.path.join(stats_dir, '{}.npz'.format(file_name)),
+                       feat_sig=[feat_sig['size'], feat_sig['mtime_ns']])
+            manifest.update('features', wav_path, wav_sig, feat_hash, feat_path, frames=frames)
+
+        results, elapsed_s = run_extraction_jobs(self.extract_file_feature, arg_list, self._nb_feature_workers,
+                                                 on_result=record_file)
+        self._filewise_frames.update((file_name, frames) for file_name, frames, _, _ in results)
+        audio_s = sum(frames[0] for _, frames, _, _ in results) * self._hop_len_s
+        print_throughput(len(results), audio_s, elapsed_s)
+        if self._profile_dir is not None:
+            write_profile_report(self._profile_dir, [profile for _, _, _, profile in results], elapsed_s=elapsed_s,
+                                 audio_s=audio_s, nb_workers=self._nb_feature_workers, feature_params=feat_hash)
+
+        if not self._is_eval:
+            self._save_scaler_from_stats(manifest, feat_hash)
+
+    def _save_scaler_from_stats(self, manifest, feat_hash):
+        '''
+        Merges the normalization statistics saved with every feature file into the normalization weights, so that
+        preprocess_features finds them up to date instead of reading all the features again. Nothing is saved if the
+        statistics of a feature file are missing or older than the file.
+        '''
+        feat_sigs = self._feature_signatures()
+        normalized_features_wts_file = self.get_normalized_wts_file()
+        if manifest.is_up_to_date('scaler', normalized_features_wts_file, params_hash(feat_sigs), feat_hash,
+                                  normalized_features_wts_file):
+            return
+        spec_stats = RunningStats()
+        for file_name, feat_sig in feat_sigs.items():
+            stats_file = os.path.join(self.get_feature_stats_dir(), '{}.npz'.format(file_name.split('.')[0]))
+            if not os.path.exists(stats_file):
+                print('No normalization statistics for {}, weights left to preprocess_features'.format(file_name))
+                return
+            stats, info = RunningStats.load(stats_file)
+            if list(info['feat_sig']) != [feat_sig['size'], feat_sig['mtime_ns']]:
+                print('Stale normalization statistics for {}, weights left to preprocess_features'.format(file_name))
+                return
+            spec_stats.merge(stats)
+
+        joblib.dump(spec_stats.to_scaler(), normalized_features_wts_file)
+        manifest.update('scaler', normalized_features_wts_file, params_hash(feat_sigs), feat_hash,
+                        normalized_features_wts_file)
+        print('Normalized_features_wts_file: {}. Saved from the extraction statistics.'.format(
+            normalized_features_wts_file))
+
+    def _feature_signatures(self):
+        return {file_name: stat_signature(os.path.join(self._feat_dir, file_name))
+                for file_name in list_features(self._feat_dir, self._feat_file_ext)}
 
     def preprocess_features(self):
         # Setting up folders and filenames
         self._feat_dir = self.get_unnormalized_feat_dir()
         self._feat_dir_norm = self.get_normalized_feat_dir()
-        create_folder(self._feat_dir_norm)
         normalized_features_wts_file = self.get_normalized_wts_file()
         spec_scaler = None
+        manifest = ExtractionManifest(self.get_manifest_file(), content_hash=self._manifest_content_hash)
+        feat_hash = self._feature_params_hash()
+        # the weights depend on every feature file, they are refitted as soon as one of them changes (normally
+        # already done from the statistics gathered by extract_all_feature, see _save_scaler_from_stats)
+        feat_sigs = self._feature_signatures()
 
         # pre-processing starts
         if self._is_eval:
             spec_scaler = joblib.load(normalized_features_wts_file)
             print('Normalized_features_wts_file: {}. Loaded.'.format(normalized_features_wts_file))
 
+        elif manifest.is_up_to_date('scaler', normalized_features_wts_file, params_hash(feat_sigs), feat_hash,
+                                    normalized_features_wts_file):
+            spec_scaler = joblib.load(normalized_features_wts_file)
+            print('Normalized_features_wts_file: {}. Up to date, loaded.'.format(normalized_features_wts_file))
+
         else:
             print('Estimating weights for normalizing feature files:')
             print('\t\tfeat_dir: {}'.format(self._feat_dir))
 
+            from sklearn import preprocessing
             spec_scaler = preprocessing.StandardScaler()
-            for file_cnt, file_name in enumerate(os.listdir(self._feat_dir)):
+            for file_cnt, file_name in enumerate(list_features(self._feat_dir, self._feat_file_ext)):
                 print('{}: {}'.format(file_cnt, file_name))
-                feat_file = np.load(os.path.join(self._feat_dir, file_name))
+                feat_file = load_features(os.path.join(self._feat_dir, file_name))
                 #feat_file = feat_file.transpose((0, 2, 1)).reshape((feat_file.shape[0], -1))
                 spec_scaler.partial_fit(feat_file)
                 del feat_file
@@ -654,19 +961,32 @@ class FeatureClass:
                 spec_scaler,
                 normalized_features_wts_file
             )
+            manifest.update('scaler', normalized_features_wts_file, params_hash(feat_sigs), feat_hash,
+                            normalized_features_wts_file)
             print('Normalized_features_wts_file: {}. Saved.'.format(normalized_features_wts_file))
 
+        if self._lazy_normalization:
+            print('Lazy normalization, the features in {} are normalized on load'.format(self._feat_dir))
+            return
+
+        create_folder(self._feat_dir_norm)
         print('Normalizing feature files:')
         print('\t\tfeat_dir_norm {}'.format(self._feat_dir_norm))
-        for file_cnt, file_name in enumerate(os.listdir(self._feat_dir)):
+        scaler_hash = params_hash(manifest.signature(normalized_features_wts_file))
+        for file_cnt, file_name in enumerate(list_features(self._feat_dir, self._feat_file_ext)):
+            norm_path = os.path.join(self._feat_dir_norm, file_name)
+            if manifest.is_up_to_date('norm', file_name, feat_sigs[file_name], scaler_hash, norm_path):
+                continue
             print('{}: {}'.format(file_cnt, file_name))
-            feat_file = np.load(os.path.join(self._feat_dir, file_name))
+            feat_file = load_features(os.path.join(self._feat_dir, file_name))
             #feat_file = feat_file.transpose((0, 2, 1)).reshape((feat_file.shape[0], -1))
-            feat_file = spec_scaler.transform(feat_file)
-            np.save(
-                os.path.join(self._feat_dir_norm, file_name),
-                feat_file
+            # float16 features are normalized in float32
+            feat_file = spec_scaler.transform(feat_file.astype(np.promote_types(feat_file.dtype, np.float32), copy=False))
+            save_features(
+                norm_path,
+                feat_file.astype(self._storage_dtype, copy=False)
             )
+            manifest.update('norm', file_name, feat_sigs[file_name], scaler_hash, norm_path)
             del feat_file
 
         print('normalized files written to {}'.format(self._feat_dir_norm))
@@ -681,11 +1001,18 @@ class FeatureClass:
         print('\t\taud_dir {}\n\t\tdesc_dir {}\n\t\tlabel_dir {}'.format(
             self._aud_dir, self._desc_dir, self._label_dir))
         create_folder(self._label_dir)
+        manifest = ExtractionManifest(self.get_manifest_file(), content_hash=self._manifest_content_hash)
         for sub_folder in os.listdir(self._desc_dir):
             loc_desc_folder = os.path.join(self._desc_dir, sub_folder)
             for file_cnt, file_name in enumerate(os.listdir(loc_desc_folder)):
                 wav_filename = '{}.wav'.format(file_name.split('.')[0])
                 nb_label_frames = self._filewise_frames[file_name.split('.')[0]][1]
+                desc_path = os.path.join(loc_desc_folder, file_name)
+                label_path = os.path.join(self._label_dir, '{}.npy'.format(wav_filename.split('.')[0]))
+                desc_sig = manifest.signature(desc_path)
+                label_hash = self._label_params_hash(nb_label_frames)
+                if manifest.is_up_to_date('labels', desc_path, desc_sig, label_hash, label_path):
+                    continue
                 desc_file_polar = self.load_output_format_file(os.path.join(loc_desc_folder, file_name))
                 desc_file = self.convert_output_format_polar_to_cartesian(desc_file_polar)
                 if self._multi_accdoa:
@@ -693,7 +1020,20 @@ class FeatureClass:
                 else:
                     label_mat = self.get_labels_for_file(desc_file, nb_label_frames)
                 print('{}: {}, {}'.format(file_cnt, file_name, label_mat.shape))
-                np.save(os.path.join(self._label_dir, '{}.npy'.format(wav_filename.split('.')[0])), label_mat)
+                np.save(label_path, label_mat)
+                manifest.update('labels', desc_path, desc_sig, label_hash, label_path)
+
+    def _feature_params_hash(self):
+        # the parameters the saved features depend on (the FSGCC mode and batching only change the rounding, the
+        # STFT cache rounds the spectra to complex64), and the lag responses saved with them
+        return params_hash([self._fs, self._hop_len, self._win_len, self._nfft, self._nb_mel_bins, self._dataset,
+                            self._use_salsalite, self._feature_dtype.name, self._mic_channels, self._foa_channels,
+                            self._mic_positions, self._feature_pool_frames, self._feature_pool_mode,
+                            self._storage_dtype.name, self._feat_file_ext, self._stft_cache is not None,
+                            self._lag_response_dir])
+
+    def _label_params_hash(self, nb_label_frames):
+        return params_hash([self._label_hop_len, self._multi_accdoa, self._nb_unique_classes, nb_label_frames])
 
     # -------------------------------  DCASE OUTPUT  FORMAT FUNCTIONS -------------------------------
     def load_output_format_file(self, _output_format_file, cm2m=False):  # TODO: Reconsider cm2m conversion
@@ -887,14 +1227,14 @@ class FeatureClass:
     def get_normalized_feat_dir(self):
         return os.path.join(
             self._feat_label_dir,
-            '{}_norm'.format('{}_salsa'.format(self._dataset_combination) if (self._dataset=='mic' and self._use_salsalite) else self._dataset_combination)
+            '{}{}_norm'.format('{}_salsa'.format(self._dataset_combination) if (self._dataset=='mic' and self._use_salsalite) else self._dataset_combination, self._feat_pool_suffix)
         )
 
 
     def get_unnormalized_feat_dir(self):
         return os.path.join(
             self._feat_label_dir,
-            '{}'.format('{}_salsa'.format(self._dataset_combination) if (self._dataset=='mic' and self._use_salsalite) else self._dataset_combination)
+            '{}{}'.format('{}_salsa'.format(self._dataset_combination) if (self._dataset=='mic' and self._use_salsalite) else self._dataset_combination, self._feat_pool_suffix)
         )
 
 
@@ -912,11 +1252,20 @@ class FeatureClass:
     def get_normalized_wts_file(self):
         return os.path.join(
             self._feat_label_dir,
-            '{}_wts'.format(self._dataset)
+            '{}{}_wts'.format(self._dataset, self._feat_pool_suffix)
         )
 
 
 
+    def get_feature_stats_dir(self):
+        return '{}_stats'.format(self.get_unnormalized_feat_dir())
+
+    def get_manifest_file(self):
+        return os.path.join(
+            self._feat_label_dir,
+            '{}{}_manifest.json'.format(self._dataset_combination, self._feat_pool_suffix)
+        )
+
     def get_vid_feat_dir(self):
         return os.path.join(self._feat_label_dir, 'video_{}'.format('eval' if self._is_eval else 'dev'))
 
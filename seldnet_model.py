@@ -5,7 +5,6 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import math
-from IPython import embed
 
 
 class MSELoss_ADPIT(object):
@@ -0,0 +1,88 @@
+# Multichannel STFT engine: frames all the channels at once as strided views of the centre-padded signal and
+# transforms them with a single rfft call, for numpy arrays and torch tensors alike.
+#
+
+import numpy as np
+from fft_backend import FFTBackend, is_tensor
+
+
+def stft_window(win_len, nfft, dtype=np.float64):
+    ''' Periodic Hann window of win_len samples, zero-padded on both sides to nfft (as librosa does) '''
+    import scipy.signal  # slow to import, only loaded once an STFT is computed
+    window = np.zeros(nfft, dtype=dtype)
+    start = (nfft - win_len) // 2
+    window[start:start + win_len] = scipy.signal.get_window('hann', win_len, fftbins=True)
+    return window
+
+
+def multichannel_stft(audio, nfft, hop_len, win_len, nb_frames=None, center=True, fft=FFTBackend()):
+    '''
+    Centred STFT of all the channels, matching librosa.stft(center=True, pad_mode='constant', window='hann') on each
+    channel.
+
+    The frames are strided views of the padded signal, only the windowed frames [nb_frames, nfft, nb_channels] are
+    materialized before the rfft along the nfft axis, so the spectra come out in the feature layout directly.
+
+    :param audio: signal [nb_samples, nb_channels], numpy array or torch tensor
+    :param nb_frames: number of frames to compute, 1 + nb_samples // hop_len by default
+    :param center: if False, audio is taken as already padded, frame t starts at sample t * hop_len
+    :param fft: FFTBackend of the rfft of numpy audio, torch audio always goes through torch.fft
+    :return: spectra [nb_frames, nfft//2+1, nb_channels], complex64 for float32 input, complex128 otherwise
+    '''
+    pad = nfft // 2 if center else 0
+    if nb_frames is None:
+        nb_frames = 1 + (audio.shape[0] + 2 * pad - nfft) // hop_len
+
+    if is_tensor(audio):
+        import torch
+        window = torch.tensor(stft_window(win_len, nfft), dtype=audio.dtype, device=audio.device)
+        padded = torch.nn.functional.pad(audio, (0, 0, pad, pad))
+        frames = padded.unfold(0, nfft, hop_len)[:nb_frames]  # [nb_frames, nb_channels, nfft] view
+        return fft.rfft(frames.transpose(1, 2) * window[:, None], axis=1)
+
+    window = stft_window(win_len, nfft, dtype=audio.dtype)
+    padded = np.pad(audio, ((pad, pad), (0, 0)))
+    frames = np.lib.stride_tricks.sliding_window_view(padded, nfft, axis=0)[:nb_frames * hop_len:hop_len]
+    return fft.rfft(frames.transpose(0, 2, 1) * window[:, None], axis=1)
+
+
+def padded_samples(audio, start, end, load=np.asarray):
+    ''' Samples start to end of audio, with zeros outside of the signal (the centring padding) '''
+    lo = min(max(start, 0), end)
+    hi = max(min(end, audio.shape[0]), lo)
+    samples = load(audio[lo:hi])
+    return np.pad(samples, ((lo - start, end - hi), (0, 0)))
+
+
+def stft_blocks(audio, nfft, hop_len, win_len, nb_frames, block_frames, load=np.asarray, fft=FFTBackend()):
+    '''
+    Centred STFT of a long signal, computed block_frames frames at a time.
+
+    Consecutive blocks overlap by nfft - hop_len samples of the padded signal: that tail of every block is carried
+    over to the next one, so every sample is read from audio once and the blocks join into
+    multichannel_stft(audio, nb_frames=nb_frames) exactly.
+
+    :param audio: signal [nb_samples, nb_channels], e.g. a memory-mapped wav, only read one block at a time
+    :param nb_frames: number of frames to compute
+    :param block_frames: frames per block
+    :param load: function converting a slice of audio to the samples to transform, e.g. channel selection and scaling
+    :param fft: FFTBackend, see multichannel_stft
+    :return: generator of (index of the first frame, spectra [block_frames, nfft//2+1, nb_channels])
+    '''
+    pad = nfft // 2
+    carry, carry_start = None, 0  # tail of the previous block, and its position in the padded signal
+    for start_frame in range(0, nb_frames, block_frames):
+        nb_block_frames = min(block_frames, nb_frames - start_frame)
+        block_start = start_frame * hop_len
+        block_end = (start_frame + nb_block_frames - 1) * hop_len + nfft
+        if carry is None:
+            block = padded_samples(audio, block_start - pad, block_end - pad, load)
+        else:
+            read_start = max(block_start, carry_start + len(carry))
+            block = np.concatenate((carry[block_start - carry_start:],
+                                    padded_samples(audio, read_start - pad, block_end - pad, load)))
+        yield start_frame, multichannel_stft(block, nfft, hop_len, win_len, nb_frames=nb_block_frames, center=False,
+                                             fft=fft)
+
+        carry_start = block_start + nb_block_frames * hop_len
+        carry = block[nb_block_frames * hop_len:].copy()
@@ -0,0 +1,54 @@
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(HERE)))
+from feature_extraction_utils import save_features, load_features
+
+
+def make_features(nb_frames, nb_mics=4, nb_mel_bins=64, nb_pairs=6, seed=0):
+    ''' Features laid out as the Mel-FSGCC ones: log-mel in dB, then the integer peak lags, peak values, spreads and
+    mean lags of every pair and band, smooth along the frames as the real ones '''
+    rng = np.random.default_rng(seed)
+    smooth = lambda x: np.cumsum(x, axis=0) / np.sqrt(np.arange(1, len(x) + 1))[:, None]
+    mel = -40 + 10 * smooth(rng.standard_normal((nb_frames, nb_mics * nb_mel_bins)))
+    nb_stats = nb_pairs * nb_mel_bins
+    tde = np.round(20 * np.tanh(smooth(rng.standard_normal((nb_frames, nb_stats)))))
+    mde = np.abs(smooth(rng.standard_normal((nb_frames, nb_stats)))) / 10
+    std = 30 + 5 * smooth(rng.standard_normal((nb_frames, nb_stats)))
+    avg = 5 * np.tanh(smooth(rng.standard_normal((nb_frames, nb_stats))))
+    return np.concatenate((mel, tde, mde, std, avg), axis=1)
+
+
+def main(nb_frames=3000, runs=3):
+    feats = make_features(nb_frames)
+    ref_bytes = feats.astype(np.float64).nbytes
+    print(f"{nb_frames} frames x {feats.shape[1]} features, {ref_bytes / 1e6:.1f} MB as float64")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for ext, dtype in [('npy', 'float64'), ('npy', 'float32'), ('npy', 'float16'),
+                           ('npz', 'float32'), ('npz', 'float16')]:
+            path = os.path.join(tmp_dir, f'feats_{dtype}.{ext}')
+            x = feats.astype(dtype)
+            write_s, load_s = [], []
+            for _ in range(runs):
+                start_time = time.time()
+                save_features(path, x)
+                write_s.append(time.time() - start_time)
+                start_time = time.time()
+                y = load_features(path)
+                load_s.append(time.time() - start_time)
+            assert np.array_equal(x, y)
+            size = os.path.getsize(path)
+            # throughputs in MB of float64 features per second, comparable across the formats
+            write_s, load_s = min(write_s), min(load_s)
+            print(f"{ext} {dtype}: {size / 1e6:.2f} MB ({ref_bytes / size:.2f}x smaller), "
+                  f"max error {np.abs(y - feats).max():.2g}, "
+                  f"write {ref_bytes / 1e6 / write_s:.0f} MB/s, load {ref_bytes / 1e6 / load_s:.0f} MB/s "
+                  f"({nb_frames / load_s:.0f} frames/s)")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,54 @@
+import os
+import sys
+import time
+import numpy as np
+import torch
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(HERE)))
+from fft_backend import FFTBackend
+
+
+def time_it(fn, runs=5):
+    fn()  # plans and thread pools are set up on the first call
+    run_times = []
+    for _ in range(runs):
+        start_time = time.time()
+        fn()
+        run_times.append(time.time() - start_time)
+    return np.min(run_times)
+
+
+def transforms(nb_frames, nfft=2048, nb_channels=4, fft_size=1024, nb_irs=8, dtype=np.float64):
+    ''' The FFT calls of the feature extraction and of SpatialScaper spatialize, with their shapes and axes '''
+    rng = np.random.default_rng(0)
+    nb_pairs = nb_channels * (nb_channels - 1) // 2
+    frames = rng.standard_normal((nb_frames, nfft, nb_channels)).astype(dtype)
+    cross_spectra = np.exp(2j * np.pi * rng.random((nb_frames, nb_pairs, nfft // 2 + 1)))
+    win_size = fft_size // 2
+    ir_windows = rng.standard_normal((nb_channels, nb_irs, win_size, nb_frames // 4))
+    audio_windows = rng.standard_normal((win_size, nb_frames))
+    spatial_stft = rng.standard_normal((nb_frames, win_size + 1, nb_channels)) * (1 + 1j)
+    return {
+        'STFT rfft, nfft {}'.format(nfft): lambda fft: fft.rfft(frames, axis=1),
+        'GCC irfft, nfft {}'.format(nfft): lambda fft: fft.irfft(cross_spectra, axis=-1),
+        'spatialize IR rfft, fft_size {}'.format(fft_size): lambda fft: fft.rfft(ir_windows, fft_size, axis=-2),
+        'spatialize audio rfft, fft_size {}'.format(fft_size): lambda fft: fft.rfft(audio_windows, fft_size, axis=-2),
+        'spatialize irfft, fft_size {}'.format(fft_size): lambda fft: fft.irfft(spatial_stft, fft_size, axis=1),
+    }
+
+
+def main(nb_frames=3000, dtype='float64'):
+    nb_cpus = os.cpu_count() or 1
+    backends = [FFTBackend('numpy'), FFTBackend('torch')] + [
+        FFTBackend('scipy', workers) for workers in sorted({1, 2, 4, nb_cpus}) if workers <= nb_cpus]
+    print(f"{nb_frames} frames, {dtype}, {nb_cpus} cores, torch threads {torch.get_num_threads()}")
+    for name, transform in transforms(nb_frames, dtype=np.dtype(dtype)).items():
+        run_times = {backend: time_it(lambda: transform(backend)) for backend in backends}
+        best = min(run_times, key=run_times.get)
+        print(f"{name}: " + ", ".join(f"{b.name}" + (f"/{b.workers}" if b.name == 'scipy' else '') + f" {1000 * t:.1f} ms"
+                                      for b, t in run_times.items()) + f" -> fastest {best}")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:2]], *sys.argv[2:3])
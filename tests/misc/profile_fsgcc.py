@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+import torch
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, os.path.dirname(os.path.dirname(HERE)))
+import mel_fsgcc_engine as engine
+from test_mel_fsgcc import make_spectrum, reference_mel_fsgcc, FS, NFFT, NB_MEL_BINS, MAX_LAG, PAIRS
+
+
+def time_it(fn, runs=3):
+    run_times = []
+    for _ in range(runs):
+        start_time = time.time()
+        fn()
+        run_times.append(time.time() - start_time)
+    return np.min(run_times)
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def profile_mode(mode, batch_size, nb_frames):
+    ''' Run in a fresh process, so that the peak RSS only accounts for this mode '''
+    spect = make_spectrum(nb_frames=nb_frames)
+    GCC = engine.phat_cross_spectra(torch.tensor(spect[:, :NFFT // 2 + 1]), PAIRS)
+    k_lims = engine.mel_band_limits(FS, NFFT, NB_MEL_BINS)
+    base_mb = peak_rss_mb()
+
+    start_time = time.time()
+    if mode == 'dense operator':
+        operator, bw = engine.fsgcc_operator(k_lims, NFFT, MAX_LAG, sparse=False)
+        lag_response = lambda GCC: engine.operator_lag_response(GCC, operator, len(bw))
+    else:
+        lag_response, bw = engine.make_lag_response(mode, k_lims, NFFT, MAX_LAG)
+    setup_s = time.time() - start_time
+
+    t = time_it(lambda: engine.mel_fsgcc(GCC, lag_response, bw, MAX_LAG, batch_size=batch_size))
+    return t, setup_s, peak_rss_mb() - base_mb
+
+
+def main(nb_frames=500, batch_sizes=(4, 16, 64), modes=('fft', 'pruned', 'sparse', 'operator', 'dense operator')):
+    spect = make_spectrum(nb_frames=nb_frames)
+    t_ref = time_it(lambda: reference_mel_fsgcc(spect), runs=1)
+    print(f"per-band loop: {nb_frames / t_ref:.1f} frames/s")
+    with ProcessPoolExecutor(1, mp_context=get_context('spawn'), max_tasks_per_child=1) as pool:
+        for mode in modes:
+            for batch_size in batch_sizes:
+                t, setup_s, mem_mb = pool.submit(profile_mode, mode, batch_size, nb_frames).result()
+                print(f"{mode}, batch_size {batch_size}: {nb_frames / t:.1f} frames/s ({t_ref / t:.1f}x), "
+                      f"setup {setup_s:.2f} s, peak memory +{mem_mb:.0f} MB")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:2]])
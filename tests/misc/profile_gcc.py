@@ -0,0 +1,39 @@
+import os
+import sys
+import time
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, os.path.dirname(os.path.dirname(HERE)))
+import cls_feature_class
+import stft_engine
+from test_gcc import pair_loop_gcc, gcc_feature_class, FS, NFFT, HOP
+
+
+def time_it(fn, runs=3):
+    run_times = []
+    for _ in range(runs):
+        start_time = time.time()
+        fn()
+        run_times.append(time.time() - start_time)
+    return np.min(run_times)
+
+
+def main(duration_s=10, nb_channels=4):
+    audio = np.random.default_rng(0).standard_normal((int(duration_s * FS), nb_channels))
+    spect = stft_engine.multichannel_stft(audio, NFFT, HOP, 2 * HOP, nb_frames=len(audio) // HOP)
+    feat_cls = gcc_feature_class()
+
+    ref = pair_loop_gcc(spect)
+    gcc = cls_feature_class.FeatureClass._get_gcc(feat_cls, spect)
+    print('max abs deviation from the pair loop: {:.2e}'.format(np.abs(gcc - ref).max()))
+
+    t_ref = time_it(lambda: pair_loop_gcc(spect))
+    t = time_it(lambda: cls_feature_class.FeatureClass._get_gcc(feat_cls, spect))
+    print('{} s of {}-channel audio: pair loop {:.3f} s, all pairs {:.3f} s ({:.1f}x, {:.0f} audio-s/s)'.format(
+        duration_s, nb_channels, t_ref, t, t_ref / t, duration_s / t))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:3]])
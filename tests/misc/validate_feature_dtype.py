@@ -0,0 +1,58 @@
+import os
+import sys
+import random
+import tempfile
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(HERE)))
+import parameters
+import pytorch_mel_fsgcc_cls_feature_class
+
+
+def feature_blocks(nb_mel_bins, nb_channels=4, nb_pairs=6):
+    blocks = [('mel', nb_mel_bins * nb_channels)]
+    blocks += [(name, nb_mel_bins * nb_pairs) for name in ('tde', 'mde', 'std', 'avg')]
+    start = 0
+    for name, size in blocks:
+        yield name, slice(start, start + size)
+        start += size
+
+
+def extract(params, feature_dtype, wav_path, out_dir):
+    params = dict(params, feature_dtype=feature_dtype)
+    feat_cls = pytorch_mel_fsgcc_cls_feature_class.FeatureClass(params)
+    feat_path = os.path.join(out_dir, '{}_{}.npy'.format(os.path.basename(wav_path).split('.')[0], feature_dtype))
+    feat_cls.extract_file_feature((0, wav_path, feat_path))
+    return np.load(feat_path)
+
+
+def main(task_id='6', nb_files=5, seed=0):
+    params = parameters.get_params(task_id)
+    feat_cls = pytorch_mel_fsgcc_cls_feature_class.FeatureClass(params)
+    aud_dir = feat_cls._aud_dir
+    wav_files = sorted(os.path.join(aud_dir, sub_folder, f) for sub_folder in os.listdir(aud_dir)
+                       for f in os.listdir(os.path.join(aud_dir, sub_folder)))
+    random.Random(seed).shuffle(wav_files)
+
+    report = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        for wav_path in wav_files[:int(nb_files)]:
+            ref = extract(params, 'float64', wav_path, out_dir)
+            feat = extract(params, 'float32', wav_path, out_dir)
+            for name, cols in feature_blocks(params['nb_mel_bins']):
+                diff = np.abs(feat[:, cols].astype(np.float64) - ref[:, cols])
+                scale = np.std(ref[:, cols]) + 1e-12
+                stats = report.setdefault(name, [0., 0., 0.])
+                stats[0] = max(stats[0], diff.max())
+                stats[1] = max(stats[1], diff.max() / scale)
+                stats[2] = max(stats[2], np.mean(diff > 1e-3 * scale))
+
+    print('\nfloat32 vs float64 on {} files'.format(min(int(nb_files), len(wav_files))))
+    print('{:>6} {:>14} {:>14} {:>14}'.format('block', 'max abs dev', 'max dev / std', 'frac > 1e-3 std'))
+    for name, (max_dev, rel_dev, frac) in report.items():
+        print('{:>6} {:>14.3e} {:>14.3e} {:>14.3e}'.format(name, max_dev, rel_dev, frac))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
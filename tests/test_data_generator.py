@@ -0,0 +1,45 @@
+import io
+import os
+import sys
+import contextlib
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cls_data_generator
+from test_feature_class import make_dataset, feature_params, extract_features
+
+
+def batches(params, lazy_normalization):
+    with contextlib.redirect_stdout(io.StringIO()):
+        data_gen = cls_data_generator.DataGenerator(dict(params, lazy_normalization=lazy_normalization), split=[1],
+                                                    shuffle=False)
+        return list(data_gen.generate())
+
+
+@pytest.mark.parametrize("storage_format", ['npy', 'npz'])
+def test_lazy_normalization_matches_normalized_features(tmp_path, storage_format):
+    make_dataset(str(tmp_path / 'dataset'))
+    # 2 sequences of 2 label frames per batch, 3 batches from the 5 label frames of each of the 3 files
+    params = feature_params(tmp_path, feature_storage_format=storage_format, batch_size=2, label_sequence_length=2,
+                            feature_sequence_length=36)
+    feat_cls, feats = extract_features(params)
+    with contextlib.redirect_stdout(io.StringIO()):
+        feat_cls.preprocess_features()
+    label_dir = feat_cls.get_label_dir()
+    os.makedirs(label_dir)
+    rng = np.random.default_rng(0)
+    for file_name in feats:
+        np.save(os.path.join(label_dir, '{}.npy'.format(file_name)), rng.random((5, 6, 4, 8)))
+
+    if storage_format == 'npz':
+        # .npy features of a previous run with the other feature_storage_format
+        for feat_dir in [feat_cls.get_unnormalized_feat_dir(), feat_cls.get_normalized_feat_dir()]:
+            for file_name in feats:
+                np.save(os.path.join(feat_dir, '{}.npy'.format(file_name)), np.zeros((5, 1792)))
+
+    eager, lazy = batches(params, False), batches(params, True)
+    assert len(eager) == 3
+    for (eager_feat, eager_label), (lazy_feat, lazy_label) in zip(eager, lazy):
+        assert eager_feat.shape == (2, 28, 36, 64)
+        assert np.array_equal(lazy_feat, eager_feat) and np.array_equal(lazy_label, eager_label)
@@ -0,0 +1,37 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from feature_extraction_utils import ExtractionManifest, params_hash
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+@pytest.mark.parametrize("content_hash", [False, True])
+def test_manifest_tracks_inputs_params_and_outputs(tmp_path, content_hash):
+    wav_path, feat_path = str(tmp_path / 'a.wav'), str(tmp_path / 'a.npy')
+    manifest_file = str(tmp_path / 'manifest.json')
+    write(wav_path, b'audio')
+    write(feat_path, b'features')
+    feat_hash = params_hash([24000, 0.02, 2048])
+
+    manifest = ExtractionManifest(manifest_file, content_hash=content_hash)
+    wav_sig = manifest.signature(wav_path)
+    assert not manifest.is_up_to_date('features', wav_path, wav_sig, feat_hash, feat_path)
+    manifest.update('features', wav_path, wav_sig, feat_hash, feat_path, frames=[10, 2])
+
+    # reloaded from disk, as a resumed run would
+    manifest = ExtractionManifest(manifest_file, content_hash=content_hash)
+    assert manifest.is_up_to_date('features', wav_path, manifest.signature(wav_path), feat_hash, feat_path)
+    assert manifest.get('features', wav_path)['frames'] == [10, 2]
+    assert not manifest.is_up_to_date('features', wav_path, wav_sig, params_hash([48000, 0.02, 2048]), feat_path)
+
+    write(wav_path, b'other audio')
+    assert not manifest.is_up_to_date('features', wav_path, manifest.signature(wav_path), feat_hash, feat_path)
+
+    os.remove(feat_path)
+    assert not manifest.is_up_to_date('features', wav_path, wav_sig, feat_hash, feat_path)
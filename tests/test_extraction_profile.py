@@ -0,0 +1,96 @@
+import os
+import sys
+import csv
+import json
+import time
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from feature_extraction_utils import StageProfiler, write_profile_report, profile_hook, peak_rss_mb
+
+
+def chunks(nb_chunks, chunk_s):
+    for chunk_cnt in range(nb_chunks):
+        time.sleep(chunk_s)
+        yield chunk_cnt
+
+
+def test_stage_profiler():
+    profiler = StageProfiler('a')
+    start_s = time.perf_counter()
+    with profiler.stage('stft'):
+        time.sleep(0.05)
+        # nested stages are not counted in the time of the stage they run in
+        with profiler.stage('load', bytes_read=1000):
+            time.sleep(0.1)
+            x = np.ones(2**22)  # 32 MB
+        del x
+    stft_block_s = time.perf_counter() - start_s
+    assert 0.05 <= profiler.stages['stft']['time_s'] <= stft_block_s - profiler.stages['load']['time_s']
+    assert list(profiler.iterate('stft', chunks(3, 0.02))) == [0, 1, 2]
+    with profiler.stage('save', bytes_written=10):
+        profiler.add('save', bytes_written=5)
+
+    record = profiler.record()
+    stages = record['stages']
+    assert json.loads(json.dumps(record)) == record
+    assert record['file'] == 'a'
+    assert stages['load']['time_s'] >= 0.1 and stages['load']['calls'] == 1
+    assert stages['stft']['time_s'] >= 0.11 and stages['stft']['calls'] == 5
+    assert record['time_s'] >= sum(stage['time_s'] for stage in stages.values())
+    assert stages['load']['bytes_read'] == 1000 and stages['save']['bytes_written'] == 15
+    # the peak of a stage includes its nested stages
+    assert stages['stft']['peak_rss_mb'] >= stages['load']['peak_rss_mb'] > 32
+
+    disabled = StageProfiler('a', enabled=False)
+    with disabled.stage('stft'):
+        disabled.add('stft', bytes_read=10)
+    assert disabled.record() is None and disabled.stages == {}
+
+
+def test_stage_profiler_keeps_process_peak():
+    x = np.ones(2**23)  # 64 MB
+    del x
+    process_peak_mb = peak_rss_mb()
+    profiler = StageProfiler('a')
+    with profiler.stage('load'):
+        x = np.ones(2**20)
+    del x
+    with profiler.stage('stft'):
+        pass
+    # the stages do not lower the peak of the process, only read it
+    assert peak_rss_mb() >= process_peak_mb
+    assert profiler.record()['peak_rss_mb'] >= process_peak_mb
+    x = np.ones(2**23)
+    assert peak_rss_mb() >= process_peak_mb
+
+
+def test_profile_report(tmp_path):
+    records = []
+    for file_name in ['a', 'b']:
+        profiler = StageProfiler(file_name)
+        for stage in ['load', 'stft', 'save']:
+            with profiler.stage(stage, bytes_read=100):
+                time.sleep(0.01)
+        records.append(profiler.record())
+    write_profile_report(str(tmp_path), records + [None], elapsed_s=1.)
+
+    with open(tmp_path / 'extraction_profile.json') as f:
+        report = json.load(f)
+    assert report['elapsed_s'] == 1. and report['nb_files'] == 2 and report['files'] == records
+    assert report['totals']['stft']['calls'] == 2 and report['totals']['load']['bytes_read'] == 200
+    assert np.isclose(sum(total['time_s'] for total in report['totals'].values()),
+                      sum(record['time_s'] for record in records))
+    with open(tmp_path / 'extraction_profile.csv') as f:
+        rows = list(csv.DictReader(f))
+    assert [(row['file'], row['stage']) for row in rows] == [(f, s) for f in 'ab' for s in ['load', 'stft', 'save']]
+
+
+def test_profile_hook(tmp_path):
+    with profile_hook('cprofile', str(tmp_path / 'a')):
+        np.fft.rfft(np.ones(1024))
+    assert os.path.exists(tmp_path / 'a.prof')
+    with pytest.raises(ValueError):
+        with profile_hook('perf', str(tmp_path / 'a')):
+            pass
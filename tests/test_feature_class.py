@@ -0,0 +1,225 @@
+import io
+import os
+import sys
+import json
+import contextlib
+import joblib
+import numpy as np
+import scipy.io.wavfile as wav
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import parameters
+import cls_feature_class
+import pytorch_mel_fsgcc_cls_feature_class
+from feature_extraction_utils import load_features
+
+FS = 24000
+
+
+def make_dataset(dataset_dir, nb_files=3, nb_channels=4, nb_samples=FS // 2, dataset='mic', seed=0):
+    ''' dataset_dir/<dataset>_dev/dev-train/ of nb_files recordings of a noise source reaching the channels with delays '''
+    rng = np.random.default_rng(seed)
+    aud_dir = os.path.join(dataset_dir, '{}_dev'.format(dataset), 'dev-train')
+    os.makedirs(aud_dir)
+    for file_cnt in range(nb_files):
+        delays = rng.integers(-20, 20, nb_channels)
+        src = rng.standard_normal(nb_samples + 40)
+        audio = np.stack([src[20 + d:20 + d + nb_samples] for d in delays], axis=-1)
+        audio += 0.1 * rng.standard_normal(audio.shape)
+        wav.write(os.path.join(aud_dir, 'fold1_room1_mix{:03d}.wav'.format(file_cnt)), FS,
+                  (3000 * audio).astype(np.int16))
+
+
+def feature_params(tmp_path, feat_label='feat_label', **params):
+    with contextlib.redirect_stdout(io.StringIO()):
+        feat_params = parameters.get_params('6')
+    feat_params.update(dataset_dir=str(tmp_path / 'dataset'), feat_label_dir=str(tmp_path / feat_label),
+                       mic_channels=None, fsgcc_mode='sparse', feature_dtype='float32')
+    feat_params.update(params)
+    return feat_params
+
+
+def extract_features(feat_params):
+    ''' :return: FeatureClass, {file name: features} of extract_all_feature '''
+    feat_cls = pytorch_mel_fsgcc_cls_feature_class.FeatureClass(feat_params)
+    with contextlib.redirect_stdout(io.StringIO()):
+        feat_cls.extract_all_feature()
+    feat_dir = feat_cls.get_unnormalized_feat_dir()
+    return feat_cls, {f.split('.')[0]: load_features(os.path.join(feat_dir, f)) for f in sorted(os.listdir(feat_dir))}
+
+
+def test_parallel_extraction_matches_serial(tmp_path):
+    make_dataset(str(tmp_path / 'dataset'))
+    feat_cls, feats = extract_features(feature_params(tmp_path, 'serial'))
+    parallel_cls, parallel_feats = extract_features(feature_params(tmp_path, 'parallel', nb_feature_workers=2,
+                                                                   extraction_profile_dir=str(tmp_path / 'profile')))
+    assert len(feats) == 3 and feats.keys() == parallel_feats.keys()
+    for file_name in feats:
+        assert np.array_equal(parallel_feats[file_name], feats[file_name])
+    assert parallel_cls._filewise_frames == feat_cls._filewise_frames
+    assert feat_cls._filewise_frames['fold1_room1_mix000'] == [FS // 2 // feat_cls._hop_len, 5]
+    # normalization weights merged from the statistics returned by the workers
+    scaler = joblib.load(feat_cls.get_normalized_wts_file())
+    parallel_scaler = joblib.load(parallel_cls.get_normalized_wts_file())
+    assert np.allclose(parallel_scaler.mean_, scaler.mean_) and np.allclose(parallel_scaler.var_, scaler.var_)
+    with open(tmp_path / 'profile' / 'extraction_profile.json') as f:
+        profile = json.load(f)
+    assert sorted(record['file'] for record in profile['files']) == sorted(feats)
+    assert profile['totals']['spatial']['calls'] == 3
+
+
+def test_rerun_skips_extracted_files(tmp_path, monkeypatch):
+    make_dataset(str(tmp_path / 'dataset'))
+    feat_params = feature_params(tmp_path)
+    feat_cls, feats = extract_features(feat_params)
+    feat_dir = feat_cls.get_unnormalized_feat_dir()
+    mtimes = {f: os.stat(os.path.join(feat_dir, f)).st_mtime_ns for f in os.listdir(feat_dir)}
+
+    extracted = []
+    extract_file_feature = pytorch_mel_fsgcc_cls_feature_class.FeatureClass.extract_file_feature
+    monkeypatch.setattr(pytorch_mel_fsgcc_cls_feature_class.FeatureClass, 'extract_file_feature',
+                        lambda self, arg_in: extracted.append(arg_in[1]) or extract_file_feature(self, arg_in))
+    rerun_cls, rerun_feats = extract_features(feat_params)
+    assert extracted == []
+    assert {f: os.stat(os.path.join(feat_dir, f)).st_mtime_ns for f in os.listdir(feat_dir)} == mtimes
+    # the frame stats of the skipped files come from the manifest
+    assert rerun_cls._filewise_frames == feat_cls._filewise_frames
+
+    # only the changed recording is extracted again
+    aud_dir = os.path.join(str(tmp_path / 'dataset'), 'mic_dev', 'dev-train')
+    fs, audio = wav.read(os.path.join(aud_dir, 'fold1_room1_mix001.wav'))
+    wav.write(os.path.join(aud_dir, 'fold1_room1_mix001.wav'), fs, audio[::-1].copy())
+    extract_features(feat_params)
+    assert extracted == [os.path.join(aud_dir, 'fold1_room1_mix001.wav')]
+
+
+def baseline_foa_features(audio, feat_cls, mic_channels=(14, 15, 16, 17), foa_channels=(0, 1, 2, 3)):
+    ''' FOA features as computed before the channel selection, kept as ground truth '''
+    import librosa
+    nb_frames = int(len(audio) / float(feat_cls._hop_len))
+    spect = np.array([librosa.core.stft(np.asfortranarray(audio[:, ch_cnt]), n_fft=feat_cls._nfft,
+                                        hop_length=feat_cls._hop_len, win_length=feat_cls._win_len,
+                                        window='hann')[:, :nb_frames] for ch_cnt in range(audio.shape[1])]).T
+    mel_wts = librosa.filters.mel(sr=FS, n_fft=feat_cls._nfft, n_mels=feat_cls._nb_mel_bins).T
+    mel_feat = np.stack([librosa.power_to_db(np.dot(np.abs(spect[:, :, ch_cnt])**2, mel_wts))
+                         for ch_cnt in mic_channels], axis=-1)
+    mel_feat = mel_feat.transpose((0, 2, 1)).reshape((nb_frames, -1))
+
+    foa_spect = spect[:, :, list(foa_channels)]
+    W = foa_spect[:, :, 0]
+    I = np.real(np.conj(W)[:, :, np.newaxis] * foa_spect[:, :, 1:])
+    E = 1e-8 + (np.abs(W)**2 + ((np.abs(foa_spect[:, :, 1:])**2).sum(-1)) / 3.0)
+    I_norm_mel = np.transpose(np.dot(np.transpose(I / E[:, :, np.newaxis], (0, 2, 1)), mel_wts), (0, 2, 1))
+    foa_iv = I_norm_mel.transpose((0, 2, 1)).reshape((nb_frames, feat_cls._nb_mel_bins * 3))
+    return np.concatenate((mel_feat, foa_iv), axis=-1)
+
+
+@pytest.mark.parametrize("feature_class", [pytorch_mel_fsgcc_cls_feature_class, cls_feature_class])
+def test_foa_features_of_all_channel_recordings(tmp_path, feature_class):
+    make_dataset(str(tmp_path / 'dataset'), nb_files=1, nb_channels=18, dataset='foa')
+    wav_path = str(tmp_path / 'dataset' / 'foa_dev' / 'dev-train' / 'fold1_room1_mix000.wav')
+    feat_cls = feature_class.FeatureClass(feature_params(tmp_path, dataset='foa', feature_dtype='float64',
+                                                         mic_channels=[14, 15, 16, 17]))
+    with contextlib.redirect_stdout(io.StringIO()):
+        feat_cls.extract_file_feature((0, wav_path, str(tmp_path / 'feat.npy')))
+    ref = baseline_foa_features(wav.read(wav_path)[1] / 2**15, feat_cls)
+    assert np.allclose(np.load(str(tmp_path / 'feat.npy')), ref, atol=1e-6)
+
+
+@pytest.mark.parametrize("storage_format", ['npy', 'npz'])
+@pytest.mark.parametrize("pool_frames", [1, 5])
+def test_streaming_matches_whole_file(tmp_path, pool_frames, storage_format):
+    make_dataset(str(tmp_path / 'dataset'), nb_files=1, nb_samples=FS + 123)
+    wav_path = str(tmp_path / 'dataset' / 'mic_dev' / 'dev-train' / 'fold1_room1_mix000.wav')
+    feat_params = feature_params(tmp_path, feature_pool_frames=pool_frames, feature_storage_format=storage_format)
+    feats, stats = {}, {}
+    for chunk_frames in [None, 20]:
+        feat_cls = pytorch_mel_fsgcc_cls_feature_class.FeatureClass(dict(feat_params, feature_chunk_frames=chunk_frames))
+        feat_path = str(tmp_path / 'feat_{}.{}'.format(chunk_frames, storage_format))
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, frames, stats[chunk_frames], _ = feat_cls.extract_file_feature((0, wav_path, feat_path))
+        feats[chunk_frames] = load_features(feat_path)
+    assert feats[None].shape[0] == frames[0] // pool_frames
+    # the mel spectra of a shorter last chunk can differ in the last bit (BLAS blocking of the filterbank product)
+    nb_mel_feats = 4 * feat_cls._nb_mel_bins
+    assert np.allclose(feats[20][:, :nb_mel_feats], feats[None][:, :nb_mel_feats], rtol=1e-6, atol=0)
+    assert np.array_equal(feats[20][:, nb_mel_feats:], feats[None][:, nb_mel_feats:])
+    assert np.allclose(stats[20].mean, stats[None].mean) and np.allclose(stats[20].var, stats[None].var)
+    assert sorted(os.listdir(tmp_path)) == sorted(['dataset', 'feat_None.' + storage_format, 'feat_20.' + storage_format])
+
+
+@pytest.mark.parametrize("chunk_frames", [None, 20])
+def test_recording_shorter_than_a_frame(tmp_path, chunk_frames):
+    make_dataset(str(tmp_path / 'dataset'), nb_files=1, nb_samples=100)
+    wav_path = str(tmp_path / 'dataset' / 'mic_dev' / 'dev-train' / 'fold1_room1_mix000.wav')
+    feat_cls = pytorch_mel_fsgcc_cls_feature_class.FeatureClass(feature_params(tmp_path,
+                                                                               feature_chunk_frames=chunk_frames))
+    with pytest.raises(ValueError, match='less than one feature frame'):
+        feat_cls.extract_file_feature((0, wav_path, str(tmp_path / 'feat.npy')))
+
+
+def test_interrupted_streaming_leaves_no_feature_file(tmp_path, monkeypatch):
+    make_dataset(str(tmp_path / 'dataset'), nb_files=1)
+    feat_params = feature_params(tmp_path, feature_storage_format='npz', feature_chunk_frames=20)
+
+    def interrupt(feat_path, feats):
+        raise RuntimeError('interrupted')
+    # run stopped while the streamed .npy file is compressed into the .npz
+    monkeypatch.setattr(pytorch_mel_fsgcc_cls_feature_class, 'save_features', interrupt)
+    feat_cls = pytorch_mel_fsgcc_cls_feature_class.FeatureClass(feat_params)
+    with pytest.raises(RuntimeError), contextlib.redirect_stdout(io.StringIO()):
+        feat_cls.extract_all_feature()
+    assert os.listdir(feat_cls.get_unnormalized_feat_dir()) == []
+
+    monkeypatch.undo()
+    feat_cls, feats = extract_features(feat_params)
+    with contextlib.redirect_stdout(io.StringIO()):
+        feat_cls.preprocess_features()
+    assert list(feats) == ['fold1_room1_mix000']
+    assert os.listdir(feat_cls.get_normalized_feat_dir()) == ['fold1_room1_mix000.npz']
+
+
+def test_gcc_weights_from_extraction_stats(tmp_path, monkeypatch):
+    from sklearn import preprocessing
+    make_dataset(str(tmp_path / 'dataset'))
+    feat_params = feature_params(tmp_path)
+    feat_cls = cls_feature_class.FeatureClass(feat_params)
+    with contextlib.redirect_stdout(io.StringIO()):
+        feat_cls.extract_all_feature()
+    scaler = joblib.load(feat_cls.get_normalized_wts_file())
+
+    fitted = []
+    partial_fit = preprocessing.StandardScaler.partial_fit
+    monkeypatch.setattr(preprocessing.StandardScaler, 'partial_fit',
+                        lambda self, X, *args, **kwargs: fitted.append(len(X)) or partial_fit(self, X, *args, **kwargs))
+    with contextlib.redirect_stdout(io.StringIO()):
+        feat_cls.preprocess_features()
+    assert fitted == []
+    assert len(os.listdir(feat_cls.get_normalized_feat_dir())) == 3
+
+    # weights fitted by reading the features back, without the statistics of an extraction
+    with contextlib.redirect_stdout(io.StringIO()):
+        cls_feature_class.FeatureClass(feat_params).preprocess_features()
+    assert len(fitted) == 3
+    refitted = joblib.load(feat_cls.get_normalized_wts_file())
+    assert np.allclose(scaler.mean_, refitted.mean_) and np.allclose(scaler.scale_, refitted.scale_)
+
+
+def test_storage_format_change(tmp_path):
+    make_dataset(str(tmp_path / 'dataset'))
+    extract_features(feature_params(tmp_path, feature_storage_format='npy'))
+    feat_cls, _ = extract_features(feature_params(tmp_path, feature_storage_format='npz'))
+    feat_dir = feat_cls.get_unnormalized_feat_dir()
+    assert len(os.listdir(feat_dir)) == 6
+
+    # the .npy files of the previous run are left out of the weights and of the normalized features
+    scaler = joblib.load(feat_cls.get_normalized_wts_file())
+    assert scaler.n_samples_seen_ == sum(frames[0] for frames in feat_cls._filewise_frames.values())
+    os.remove(feat_cls.get_normalized_wts_file())
+    with contextlib.redirect_stdout(io.StringIO()):
+        feat_cls.preprocess_features()
+    refitted = joblib.load(feat_cls.get_normalized_wts_file())
+    assert refitted.n_samples_seen_ == scaler.n_samples_seen_ and np.allclose(refitted.mean_, scaler.mean_)
+    assert sorted(os.listdir(feat_cls.get_normalized_feat_dir())) == sorted(f for f in os.listdir(feat_dir)
+                                                                            if f.endswith('.npz'))
@@ -0,0 +1,28 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from feature_extraction_utils import save_features, load_features
+
+
+@pytest.mark.parametrize("ext", [".npy", ".npz"])
+@pytest.mark.parametrize("dtype", [np.float16, np.float32, np.float64])
+@pytest.mark.parametrize("nb_frames", [0, 100, 2500])
+def test_saved_features_load_back(tmp_path, ext, dtype, nb_frames):
+    feats = np.random.default_rng(0).standard_normal((nb_frames, 1792)).astype(dtype)
+    path = str(tmp_path / 'feat{}'.format(ext))
+    save_features(path, feats)
+    loaded = load_features(path)
+    assert loaded.dtype == dtype and np.array_equal(loaded, feats)
+
+
+def test_chunks_of_memmap_readable_by_numpy(tmp_path):
+    feats = np.lib.format.open_memmap(str(tmp_path / 'feat.npy'), mode='w+', dtype=np.float32, shape=(2500, 8))
+    feats[:] = np.arange(feats.size).reshape(feats.shape)
+    save_features(str(tmp_path / 'feat.npz'), feats, chunk_frames=1000)
+    with np.load(str(tmp_path / 'feat.npz')) as archive:
+        assert archive.files == ['chunk_00000', 'chunk_00001', 'chunk_00002']
+        assert [len(archive[chunk]) for chunk in archive.files] == [1000, 1000, 500]
+    assert np.array_equal(load_features(str(tmp_path / 'feat.npz')), feats)
@@ -0,0 +1,39 @@
+import os
+import sys
+import numpy as np
+import torch
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stft_engine
+from fft_backend import FFTBackend
+
+BACKENDS = [FFTBackend('scipy'), FFTBackend('scipy', workers=2), FFTBackend('numpy'), FFTBackend('torch')]
+
+
+@pytest.mark.parametrize("fft", BACKENDS, ids=repr)
+def test_backends_match_numpy(fft):
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((7, 300, 3))
+    spect = np.fft.rfft(x, 512, axis=1)
+    assert np.allclose(fft.rfft(x, 512, axis=1), spect)
+    assert np.allclose(fft.irfft(spect, 512, axis=1), np.fft.irfft(spect, 512, axis=1))
+    assert np.allclose(fft.fft(x, axis=1), np.fft.fft(x, axis=1))
+    assert np.allclose(fft.ifft(spect, axis=-1, norm='forward'), np.fft.ifft(spect, axis=-1, norm='forward'))
+    assert isinstance(fft.rfft(x), np.ndarray)
+
+    # torch tensors go through torch.fft whatever the backend
+    spect_tensor = fft.rfft(torch.tensor(x), 512, axis=1)
+    assert torch.is_tensor(spect_tensor) and np.allclose(spect_tensor.numpy(), spect)
+
+
+@pytest.mark.parametrize("fft", BACKENDS, ids=repr)
+def test_stft_backends(fft):
+    audio = np.random.default_rng(0).standard_normal((24000, 4))
+    assert np.allclose(stft_engine.multichannel_stft(audio, 2048, 480, 960, fft=fft),
+                       stft_engine.multichannel_stft(audio, 2048, 480, 960), atol=1e-10)
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        FFTBackend('fftw')
@@ -0,0 +1,64 @@
+import os
+import sys
+import types
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cls_feature_class
+import stft_engine
+from fft_backend import FFTBackend
+from feature_extraction_utils import pool_frames
+
+FS = 24000
+NFFT = 2048
+HOP = 128
+NB_MEL_BINS = 64
+
+
+def pair_loop_gcc(linear_spectra, nb_mel_bins=NB_MEL_BINS):
+    ''' Per-pair loop _get_gcc replaced, kept as ground truth '''
+    gcc_channels = cls_feature_class.nCr(linear_spectra.shape[-1], 2)
+    gcc_feat = np.zeros((linear_spectra.shape[0], nb_mel_bins, gcc_channels))
+    cnt = 0
+    for m in range(linear_spectra.shape[-1]):
+        for n in range(m+1, linear_spectra.shape[-1]):
+            R = np.conj(linear_spectra[:, :, m]) * linear_spectra[:, :, n]
+            cc = np.fft.irfft(np.exp(1.j*np.angle(R)))
+            cc = np.concatenate((cc[:, -nb_mel_bins//2:], cc[:, :nb_mel_bins//2]), axis=-1)
+            gcc_feat[:, :, cnt] = cc
+            cnt += 1
+    return gcc_feat.transpose((0, 2, 1)).reshape((linear_spectra.shape[0], -1))
+
+
+def gcc_feature_class(fft=FFTBackend()):
+    return types.SimpleNamespace(_nb_mel_bins=NB_MEL_BINS, _fft=fft)  # _get_gcc only reads the lags and the FFT
+
+
+def make_spectrum(duration_s=1, nb_channels=4, seed=0):
+    audio = np.random.default_rng(seed).standard_normal((int(duration_s * FS), nb_channels))
+    return stft_engine.multichannel_stft(audio, NFFT, HOP, 2 * HOP, nb_frames=len(audio) // HOP)
+
+
+@pytest.mark.parametrize("nb_channels", [2, 4, 6])
+def test_gcc_matches_pair_loop(nb_channels):
+    spect = make_spectrum(nb_channels=nb_channels)
+    gcc = cls_feature_class.FeatureClass._get_gcc(gcc_feature_class(), spect)
+    assert gcc.shape == (spect.shape[0], NB_MEL_BINS * nb_channels * (nb_channels - 1) // 2)
+    assert np.allclose(gcc, pair_loop_gcc(spect), atol=1e-12)
+    # exp(1j*angle(0)) = 1 on silent bins, as in the pair loop
+    spect[:, :100] = 0
+    assert np.allclose(cls_feature_class.FeatureClass._get_gcc(gcc_feature_class(), spect), pair_loop_gcc(spect),
+                       atol=1e-12)
+
+
+def test_pooled_gcc():
+    spect = make_spectrum()
+    spect = spect[:len(spect) // 3 * 3]
+    gcc = cls_feature_class.FeatureClass._get_gcc(gcc_feature_class(), spect, nb_pool=3)
+    # the cross-spectra are averaged over the pooled frames before the PHAT weighting
+    m, n = np.triu_indices(spect.shape[-1], k=1)
+    R = pool_frames(np.conj(spect[:, :, m]) * spect[:, :, n], 3)
+    # the first pairs of the loop over [1, R...] are (0, k), whose cross-spectra are the pooled R
+    ref = pair_loop_gcc(np.concatenate((np.ones_like(R[:, :, :1]), R), axis=-1))[:, :NB_MEL_BINS * len(m)]
+    assert np.allclose(gcc, ref, atol=1e-12)
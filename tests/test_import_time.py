@@ -0,0 +1,37 @@
+import os
+import sys
+import subprocess
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# path/config helpers, metrics and data generator, imported by every training worker and evaluation script
+ENTRY_POINTS = ['parameters', 'SELD_evaluation_metrics', 'cls_compute_seld_results', 'cls_data_generator',
+                'cls_feature_class']
+# plotting, notebook, video and feature extraction stacks, seconds to import
+HEAVY_MODULES = ['matplotlib', 'IPython', 'PIL', 'cls_vid_features', 'sklearn', 'librosa', 'numba', 'torch',
+                 'scipy.signal', 'scipy.stats', 'scipy.optimize']
+# seconds, only checked when set (e.g. SELD_IMPORT_BUDGET_S=3), the import time depending on the machine and its load:
+# about 0.5 s here, against 5 s with the heavy modules imported at the top of the modules
+IMPORT_BUDGET_S = os.environ.get('SELD_IMPORT_BUDGET_S')
+
+
+def import_in_fresh_interpreter(module):
+    ''' :return: import time of module in seconds, heavy modules it imported '''
+    code = ('import sys, time\n'
+            'start_time = time.perf_counter()\n'
+            'import {}\n'
+            'print(time.perf_counter() - start_time)\n'
+            'print(" ".join(m for m in {!r} if m in sys.modules))').format(module, HEAVY_MODULES)
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    import_s, loaded = out.stdout.split('\n')[:2]
+    return float(import_s), loaded.split()
+
+
+@pytest.mark.parametrize("module", ENTRY_POINTS)
+def test_entry_point_import_time(module):
+    import_s, loaded = import_in_fresh_interpreter(module)
+    print('{}: {:.2f} s'.format(module, import_s))
+    assert loaded == [], '{} imports {}'.format(module, loaded)
+    if IMPORT_BUDGET_S is not None:
+        assert import_s < float(IMPORT_BUDGET_S)
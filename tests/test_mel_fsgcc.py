@@ -0,0 +1,235 @@
+import os
+import sys
+import numpy as np
+import torch
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mel_fsgcc_engine as engine
+from feature_extraction_utils import load_features
+
+FS = 24000
+NFFT = 2048
+HOP = 128
+NB_MEL_BINS = 64
+MAX_LAG = int(round(2 * 1.5 / 343 * FS))
+PAIRS = [(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)]
+
+
+def make_spectrum(nb_frames=40, delays=(0, 7, -23, 55), seed=0):
+    ''' Extended STFT [nb_frames, nfft, 4] of a noise source reaching 4 mics with integer delays '''
+    rng = np.random.default_rng(seed)
+    nb_samples = (nb_frames - 1) * HOP + NFFT
+    src = rng.standard_normal(nb_samples + 2 * max(map(abs, delays)))
+    pad = max(map(abs, delays))
+    mics = np.stack([src[pad - d:pad - d + nb_samples] for d in delays], axis=-1)
+    mics = mics + 0.1 * rng.standard_normal(mics.shape)
+    win = np.hanning(2 * HOP)
+    frames = np.stack([mics[i * HOP:i * HOP + 2 * HOP] * win[:, None] for i in range(nb_frames)])
+    return np.fft.fft(frames, NFFT, axis=1)
+
+
+def reference_mel_fsgcc(extended_spect):
+    ''' Per-band loop of the original extract_file_feature, kept as ground truth '''
+    Xframes = torch.tensor(np.transpose(extended_spect, (1, 0, 2)))
+    Nframes = Xframes.shape[1]
+    lags = torch.arange(-(NFFT / 2), NFFT / 2, dtype=torch.float64)
+    k_lims = engine.mel_band_limits(FS, NFFT, NB_MEL_BINS)
+    lagmask = torch.zeros(NFFT, dtype=torch.float64)
+    lagmask[NFFT // 2 - MAX_LAG:NFFT // 2 + MAX_LAG + 1] = 1
+
+    out = torch.zeros((4, NB_MEL_BINS, Nframes, len(PAIRS)), dtype=torch.float64)
+    for idx, (p1, p2) in enumerate(PAIRS):
+        GCC = torch.exp(1j * torch.angle(Xframes[:, :, p2] * torch.conj(Xframes[:, :, p1])))
+        for k in range(NB_MEL_BINS):
+            BW = k_lims[k + 2] - k_lims[k] + 1
+            BW = BW + BW % 2
+            windmask = torch.zeros(NFFT, dtype=torch.complex128)
+            windmask[:BW // 2] = 1
+            windmask[-BW // 2:] = 1
+            GCCd = torch.roll(GCC, shifts=k_lims[k + 1].item(), dims=0) * windmask[:, None]
+            aux = (1 / BW) * torch.fft.fftshift(torch.fft.ifft(GCCd, dim=0), dim=0) * lagmask[:, None]
+            abs_aux = torch.abs(aux)
+            max_ind = torch.argmax(abs_aux, dim=0)
+            out[1, k, :, idx] = abs_aux[max_ind, torch.arange(Nframes)]
+            out[0, k, :, idx] = lags[max_ind]
+            auxpdf = abs_aux / abs_aux.sum(dim=0, keepdim=True)
+            out[3, k, :, idx] = (lags[:, None] * auxpdf).sum(dim=0)
+            out[2, k, :, idx] = torch.sqrt(((lags[:, None] - out[3, k, :, idx]) ** 2 * auxpdf).sum(dim=0))
+    return out
+
+
+@pytest.fixture(scope='module')
+def spectrum_and_reference():
+    spect = make_spectrum()
+    return spect, reference_mel_fsgcc(spect)
+
+
+def compare_stats(stats, ref):
+    tde, mde, std, avg = stats
+    # the peak lag can only flip between near-equal peaks, allow a handful of them
+    assert (tde != ref[0]).float().mean() < 0.01, "peak lags do not match"
+    assert torch.allclose(mde, ref[1], rtol=1e-6, atol=1e-9), "peak values do not match"
+    assert torch.allclose(std, ref[2], rtol=1e-6, atol=1e-6), "lag spreads do not match"
+    assert torch.allclose(avg, ref[3], rtol=1e-6, atol=1e-6), "mean lags do not match"
+
+
+def run_engine(spect, mode, batch_size=16):
+    k_lims = engine.mel_band_limits(FS, NFFT, NB_MEL_BINS)
+    lag_response, bw = engine.make_lag_response(mode, k_lims, NFFT, MAX_LAG)
+    GCC = engine.phat_cross_spectra(torch.tensor(spect[:, :NFFT // 2 + 1]), PAIRS)
+    stats = engine.mel_fsgcc(GCC, lag_response, bw, MAX_LAG, batch_size=batch_size)
+    return stats.permute(1, 3, 0, 2)  # tde, mde, std, avg, each [bands, frames, pairs]
+
+
+@pytest.mark.parametrize("batch_size", [1, 16, 100])
+def test_batched_fft_matches_reference(spectrum_and_reference, batch_size):
+    spect, ref = spectrum_and_reference
+    compare_stats(run_engine(spect, 'fft', batch_size=batch_size), ref)
+
+
+@pytest.mark.parametrize("mode", ["pruned", "sparse", "operator"])
+def test_pruned_lags_match_reference(spectrum_and_reference, mode):
+    spect, ref = spectrum_and_reference
+    compare_stats(run_engine(spect, mode), ref)
+
+
+@pytest.mark.parametrize("win", ["boxcar", "hann"])
+def test_band_supports_match_masks(win):
+    k_lims = engine.mel_band_limits(FS, NFFT, NB_MEL_BINS)
+    masks, bw = engine.mel_band_masks(k_lims, NFFT, win=win)
+    for k in range(NB_MEL_BINS):
+        BW = int(bw[k])
+        if win == 'hann':
+            wind = torch.hann_window(BW, dtype=torch.float64)
+        else:
+            wind = torch.ones(BW, dtype=torch.float64)
+        windmask = torch.zeros(NFFT, dtype=torch.float64)
+        windmask[:BW // 2] = wind[BW // 2:]
+        windmask[-BW // 2:] = wind[:BW // 2]
+        assert torch.equal(torch.roll(masks[k], shifts=int(k_lims[k + 1])), windmask), "band {} window".format(k)
+
+
+def test_onesided_supports_match_full_spectrum(spectrum_and_reference):
+    spect, _ = spectrum_and_reference
+    GCC = engine.phat_cross_spectra(torch.tensor(spect), PAIRS)
+    GCC_half = GCC[..., :NFFT // 2 + 1]
+    assert torch.allclose(engine.full_spectrum(GCC_half), GCC, atol=1e-12)
+
+    k_lims = engine.mel_band_limits(FS, NFFT, NB_MEL_BINS)
+    idx, weights, _ = engine.mel_band_supports(k_lims, NFFT, win='hann')
+    half_idx, half_weights = engine.onesided_supports(idx, weights, NFFT)
+    gathered = torch.view_as_complex(torch.view_as_real(GCC_half[..., half_idx]) * half_weights)
+    assert torch.allclose(gathered, GCC[..., idx] * weights, atol=1e-12)
+
+
+def test_pooled_cross_spectra(spectrum_and_reference):
+    spect, _ = spectrum_and_reference
+    Xframes = torch.tensor(spect[:, :NFFT // 2 + 1])
+    GCC = engine.phat_cross_spectra(Xframes, PAIRS, nb_pool=3)
+    assert GCC.shape == (len(PAIRS), Xframes.shape[0] // 3, NFFT // 2 + 1)
+    R = Xframes[3:6, :, 2] * torch.conj(Xframes[3:6, :, 0])
+    assert torch.allclose(GCC[1, 1], torch.exp(1j * torch.angle(R.mean(dim=0))))
+
+
+def test_lag_spread_of_sharp_peaks():
+    # peaks under a lag wide near the edge of the widest lag window, where E[l^2] - avg^2 cancels in float32
+    lags = torch.arange(-210, 211, dtype=torch.float64)
+    abs_aux = torch.exp(-0.5 * ((lags - torch.linspace(150, 209, 64, dtype=torch.float64)[:, None]) / 0.7) ** 2)
+    pdf = abs_aux / abs_aux.sum(dim=-1, keepdim=True)
+    ref_std = torch.sqrt(((lags - (pdf * lags).sum(-1, keepdim=True)) ** 2 * pdf).sum(-1))
+    assert torch.allclose(engine.lag_statistics(abs_aux, lags)[3], ref_std)
+    std32 = engine.lag_statistics(abs_aux.float(), lags.float())[3]
+    assert torch.allclose(std32.double(), ref_std, rtol=1e-5)
+
+
+def test_pair_lag_windows(spectrum_and_reference):
+    mic_positions = [[2.5, 9, 1.2], [2.5, 10, 1.2], [2.5, 11, 1.2], [2.5, 12, 1.2]]
+    pair_lags = engine.pair_max_lags(mic_positions, PAIRS, FS)
+    assert pair_lags == [70, 140, 210, 70, 140, 70]
+
+    spect, _ = spectrum_and_reference
+    GCC = engine.phat_cross_spectra(torch.tensor(spect[:, :NFFT // 2 + 1]), PAIRS)
+    k_lims = engine.mel_band_limits(FS, NFFT, NB_MEL_BINS)
+    lag_responses = {}
+    for max_lag in set(pair_lags):
+        lag_responses[max_lag], bw = engine.make_lag_response('sparse', k_lims, NFFT, max_lag)
+    stats = engine.mel_fsgcc_pairs(GCC, lag_responses, bw, pair_lags)
+    for p, max_lag in enumerate(pair_lags):
+        pair_stats = engine.mel_fsgcc(GCC[p:p + 1], lag_responses[max_lag], bw, max_lag)
+        assert torch.equal(stats[:, :, p:p + 1], pair_stats)
+        assert stats[:, 0, p].abs().max() <= max_lag
+
+
+@pytest.mark.parametrize("mode", ["fft", "sparse", "operator"])
+def test_plan_memoized_and_reloaded(spectrum_and_reference, tmp_path, monkeypatch, mode):
+    pair_lags = [70, 140, 210, 70, 140, 70]
+    plan = engine.get_plan(FS, NFFT, NB_MEL_BINS, mode, pair_lags, plan_dir=str(tmp_path))
+    assert engine.get_plan(FS, NFFT, NB_MEL_BINS, mode, pair_lags[::-1], plan_dir=str(tmp_path)) is plan
+    assert len(os.listdir(tmp_path)) == 1
+
+    engine._plans.clear()
+    # the band limits are reloaded with the plan, not computed again
+    monkeypatch.setattr(engine, 'mel_band_limits', None)
+    reloaded = engine.get_plan(FS, NFFT, NB_MEL_BINS, mode, pair_lags, plan_dir=str(tmp_path))
+    assert reloaded is not plan
+    assert np.array_equal(reloaded.k_lims, plan.k_lims)
+
+    spect, _ = spectrum_and_reference
+    GCC = engine.phat_cross_spectra(torch.tensor(spect[:, :NFFT // 2 + 1]), PAIRS)
+    stats = engine.mel_fsgcc_pairs(GCC, plan.lag_responses, plan.bw, pair_lags)
+    assert torch.equal(engine.mel_fsgcc_pairs(GCC, reloaded.lag_responses, reloaded.bw, pair_lags), stats)
+
+
+def test_lag_response_store(spectrum_and_reference, tmp_path):
+    pair_lags = [70, 140, 210, 70, 140, 70]
+    plan = engine.get_plan(FS, NFFT, NB_MEL_BINS, 'sparse', pair_lags)
+    spect, _ = spectrum_and_reference
+    GCC = engine.phat_cross_spectra(torch.tensor(spect[:, :NFFT // 2 + 1]), PAIRS)
+    nb_frames = GCC.shape[1]
+
+    # written in two chunks of frames, as by the streaming extractor, saved in chunks of 16 frames
+    path = str(tmp_path / 'lags.npz')
+    store = engine.LagResponseStore(path, nb_frames, len(PAIRS), NB_MEL_BINS, max(pair_lags), chunk_frames=16)
+    stats = torch.cat([engine.mel_fsgcc_pairs(GCC[:, start:start + 25], plan.lag_responses, plan.bw, pair_lags,
+                                              lag_store=store, frame_offset=start) for start in (0, 25)])
+    assert not os.path.exists(path)
+    # only the frames not saved yet are buffered
+    assert len(store._buffer) < 16
+    store.close()
+    assert os.listdir(tmp_path) == ['lags.npz']
+    with np.load(path) as archive:
+        assert len(archive.files) == -(-nb_frames // 16)
+
+    tde, mde, avg, std = engine.reduce_lag_responses(path, chunk_frames=16)
+    assert tde.shape == (nb_frames, len(PAIRS), NB_MEL_BINS)
+    # the float16 peaks are flat, the peak lag can move along them but not away from the peak value
+    responses = torch.as_tensor(load_features(path))
+    at_tde = responses.gather(-1, (stats[:, 0].long() + max(pair_lags))[..., None])[..., 0].float()
+    assert torch.allclose(at_tde, mde, rtol=2e-3)
+    assert torch.allclose(mde, stats[:, 1].float(), rtol=1e-3)
+    assert torch.allclose(std, stats[:, 2].float(), rtol=1e-3, atol=0.05)
+    assert torch.allclose(avg, stats[:, 3].float(), rtol=1e-3, atol=0.05)
+
+    entropy = engine.reduce_lag_responses(path, engine.lag_entropy)
+    assert entropy.shape == tde.shape
+    assert torch.all(entropy <= torch.log(2 * torch.tensor(pair_lags, dtype=torch.float32)[:, None] + 1) + 1e-4)
+
+
+def test_lag_response_store_removed_on_error(spectrum_and_reference, tmp_path):
+    pair_lags = [70, 140, 210, 70, 140, 70]
+    plan = engine.get_plan(FS, NFFT, NB_MEL_BINS, 'sparse', pair_lags)
+    spect, _ = spectrum_and_reference
+    GCC = engine.phat_cross_spectra(torch.tensor(spect[:, :NFFT // 2 + 1]), PAIRS)
+    path = str(tmp_path / 'lags.npz')
+    with pytest.raises(RuntimeError):
+        with engine.LagResponseStore(path, GCC.shape[1], len(PAIRS), NB_MEL_BINS, max(pair_lags),
+                                     chunk_frames=16) as store:
+            engine.mel_fsgcc_pairs(GCC[:, :40], plan.lag_responses, plan.bw, pair_lags, lag_store=store)
+            raise RuntimeError('extraction interrupted')
+    assert os.listdir(tmp_path) == []
+    # frames missing when the store is closed
+    with pytest.raises(ValueError):
+        with engine.LagResponseStore(path, GCC.shape[1], len(PAIRS), NB_MEL_BINS, max(pair_lags)) as store:
+            engine.mel_fsgcc_pairs(GCC[:, :20], plan.lag_responses, plan.bw, pair_lags, lag_store=store)
+    assert os.listdir(tmp_path) == []
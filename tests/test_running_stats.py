@@ -0,0 +1,32 @@
+import os
+import sys
+import numpy as np
+from sklearn import preprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from feature_extraction_utils import RunningStats
+
+
+def test_merged_chunks_match_standard_scaler(tmp_path):
+    rng = np.random.default_rng(0)
+    files = [rng.normal(5, 3, (n, 10)).astype(np.float32) for n in (1, 37, 200, 64)]
+    files[2][:, 3] = 7  # constant feature, unit scale
+
+    ref = preprocessing.StandardScaler()
+    for feat in files:
+        ref.partial_fit(feat)
+
+    # chunks of the files accumulated per worker, then merged
+    workers = [RunningStats(), RunningStats()]
+    for file_cnt, feat in enumerate(files):
+        for start in range(0, len(feat), 16):
+            workers[file_cnt % 2].update(feat[start:start + 16])
+    workers[0].save(str(tmp_path / 'stats.npz'), feat_sig=[3, 4])
+    loaded, info = RunningStats.load(str(tmp_path / 'stats.npz'))
+    assert list(info['feat_sig']) == [3, 4]
+    scaler = RunningStats().merge(loaded).merge(workers[1]).merge(RunningStats()).to_scaler()
+
+    assert scaler.n_samples_seen_ == ref.n_samples_seen_
+    for attr in ('mean_', 'var_', 'scale_'):
+        assert np.allclose(getattr(scaler, attr), getattr(ref, attr), rtol=1e-6, atol=1e-6), attr
+    assert np.allclose(scaler.transform(files[1]), ref.transform(files[1]), atol=1e-5)
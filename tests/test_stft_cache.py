@@ -0,0 +1,57 @@
+import os
+import sys
+import shutil
+import numpy as np
+import scipy.io.wavfile as wav
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stft_engine
+from feature_extraction_utils import STFTCache
+
+NFFT = 512
+HOP = 120
+WIN = 240
+
+
+def write_wav(path, seed=0, nb_samples=24000, nb_channels=4):
+    rng = np.random.default_rng(seed)
+    wav.write(path, 24000, (3000 * rng.standard_normal((nb_samples, nb_channels))).astype(np.int16))
+
+
+def test_cache_keys(tmp_path):
+    wav_path, copy_path = str(tmp_path / 'a.wav'), str(tmp_path / 'b.wav')
+    write_wav(wav_path)
+    shutil.copy(wav_path, copy_path)
+    cache = STFTCache(str(tmp_path / 'cache'))
+    key = cache.key(wav_path, NFFT, HOP, WIN, [0, 1], 200)
+    assert cache.key(copy_path, NFFT, HOP, WIN, [0, 1], 200) == key
+    assert cache.key(wav_path, NFFT, HOP, WIN, [0, 2], 200) != key
+    assert cache.key(wav_path, NFFT, 2 * HOP, WIN, [0, 1], 200) != key
+    write_wav(copy_path, seed=1)
+    assert cache.key(copy_path, NFFT, HOP, WIN, [0, 1], 200) != key
+
+
+def test_cached_spectra(tmp_path):
+    wav_path = str(tmp_path / 'a.wav')
+    write_wav(wav_path)
+    audio = wav.read(wav_path)[1] / 2**15
+    nb_frames = len(audio) // HOP
+    spect = stft_engine.multichannel_stft(audio, NFFT, HOP, WIN, nb_frames=nb_frames)
+
+    cache = STFTCache(str(tmp_path / 'cache'))
+    key = cache.key(wav_path, NFFT, HOP, WIN, None, nb_frames)
+    assert cache.load(key) is None
+    cached = cache.save(key, spect)
+    assert cached.dtype == np.complex64
+    assert np.array_equal(cache.load(key), spect.astype(np.complex64))
+
+    # filled block by block, as by the streaming extractor
+    other_key = cache.key(wav_path, NFFT, HOP, WIN, None, nb_frames - 1)
+    entry = cache.open(other_key, spect.shape)
+    for start_frame, block in stft_engine.stft_blocks(audio, NFFT, HOP, WIN, nb_frames, 64):
+        entry[start_frame:start_frame + len(block)] = block
+    assert cache.load(other_key) is None
+    cache.commit(other_key, entry)
+    assert np.array_equal(cache.load(other_key, mmap_mode='r'), cached)
+    assert sorted(os.listdir(tmp_path / 'cache')) == sorted([os.path.basename(cache.path(key)),
+                                                             os.path.basename(cache.path(other_key))])
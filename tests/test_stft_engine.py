@@ -0,0 +1,53 @@
+import os
+import sys
+import numpy as np
+import librosa
+import torch
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stft_engine
+
+NFFT = 2048
+HOP = 480
+WIN = 960
+
+
+def librosa_stft(audio, nb_frames):
+    ''' Per-channel librosa loop the feature classes used before, [nb_frames, nfft//2+1, nb_channels] '''
+    spectra = [librosa.stft(np.asfortranarray(audio[:, ch]), n_fft=NFFT, hop_length=HOP, win_length=WIN,
+                            window='hann')[:, :nb_frames] for ch in range(audio.shape[1])]
+    return np.array(spectra).T
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+@pytest.mark.parametrize("use_torch", [False, True])
+def test_multichannel_stft_matches_librosa(dtype, use_torch):
+    audio = np.random.default_rng(0).standard_normal((24000 + 123, 4)).astype(dtype)
+    nb_frames = audio.shape[0] // HOP
+    ref = librosa_stft(audio, nb_frames)
+
+    spect = stft_engine.multichannel_stft(torch.tensor(audio) if use_torch else audio, NFFT, HOP, WIN,
+                                          nb_frames=nb_frames)
+    if use_torch:
+        spect = spect.numpy()
+    assert spect.shape == ref.shape and spect.dtype == ref.dtype
+    tol = 1e-10 if dtype == np.float64 else 1e-4
+    assert np.allclose(spect, ref, rtol=tol, atol=tol * np.abs(ref).max())
+
+
+def test_default_frame_count():
+    audio = np.zeros((24000, 2))
+    assert stft_engine.multichannel_stft(audio, NFFT, HOP, WIN).shape == (1 + 24000 // HOP, NFFT // 2 + 1, 2)
+
+
+@pytest.mark.parametrize("block_frames", [1, 7, 50, 1000])
+@pytest.mark.parametrize("hop", [HOP, 128])
+def test_stft_blocks_match_whole_signal(block_frames, hop):
+    audio = np.random.default_rng(0).standard_normal((24000 + 123, 4))
+    nb_frames = 1 + audio.shape[0] // hop
+    ref = stft_engine.multichannel_stft(audio, NFFT, hop, 2 * hop, nb_frames=nb_frames)
+
+    blocks = list(stft_engine.stft_blocks(audio, NFFT, hop, 2 * hop, nb_frames, block_frames))
+    assert [start for start, _ in blocks] == list(range(0, nb_frames, block_frames))
+    assert np.array_equal(np.concatenate([spect for _, spect in blocks]), ref)